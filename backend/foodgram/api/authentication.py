@@ -0,0 +1,155 @@
+"""Аутентификация по токену с кэшированием пользователя."""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from users.models import User
+
+logger = logging.getLogger(__name__)
+
+# Поля пользователя, которые хранятся в кэше. Пароль и счётчики
+# не кэшируются и загружаются из базы при обращении.
+USER_FIELDS = (
+    'id',
+    'username',
+    'email',
+    'first_name',
+    'last_name',
+    'role',
+    'is_active',
+    'is_staff',
+    'is_superuser',
+)
+
+
+class TokenCache:
+    """LRU-кэш соответствия токена пользователю с ограниченным временем
+    жизни записей.
+
+    С общим кэшем (shared_alias) записи хранятся только в нём, а не в
+    памяти процесса: удалённая при выходе или смене пароля запись
+    сразу перестаёт действовать во всех процессах. Без общего кэша
+    каждый процесс видит чужие удаления только после истечения ttl.
+    """
+
+    def __init__(self, max_size, ttl, shared_alias=None, report_every=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_alias = shared_alias
+        self.report_every = report_every
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def shared_key(key):
+        return f'auth:token:{key}'
+
+    def get(self, key):
+        if self.shared_alias:
+            user = caches[self.shared_alias].get(self.shared_key(key))
+        else:
+            user = self._get_local(key)
+        with self._lock:
+            if user is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            lookups = self.hits + self.misses
+        if self.report_every and lookups % self.report_every == 0:
+            logger.info('Кэш токенов: %s', self.stats())
+        return user
+
+    def _get_local(self, key):
+        with self._lock:
+            if (item := self._data.get(key)) is None:
+                return None
+            user, expires = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return user
+
+    def set(self, key, user):
+        if self.shared_alias:
+            caches[self.shared_alias].set(
+                self.shared_key(key), user, timeout=self.ttl
+            )
+            return
+        with self._lock:
+            self._data[key] = (user, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+        if self.shared_alias and keys:
+            caches[self.shared_alias].delete_many(
+                [self.shared_key(key) for key in keys]
+            )
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0,
+            'size': len(self._data),
+        }
+
+
+token_cache = TokenCache(
+    max_size=settings.TOKEN_CACHE['MAX_SIZE'],
+    ttl=settings.TOKEN_CACHE['TTL'],
+    shared_alias=settings.TOKEN_CACHE['SHARED_ALIAS'],
+    report_every=settings.TOKEN_CACHE['REPORT_EVERY'],
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, которая не обращается к базе данных,
+    пока пользователь токена есть в кэше.
+
+    В кэше хранятся только значения USER_FIELDS, из них собирается
+    пользователь с отложенными остальными полями. Записи удаляются
+    при выходе, сохранении и удалении пользователя, счётчики в кэш
+    не попадают. С TOKEN_CACHE['SHARED_ALIAS'] удаление сразу видно
+    во всех процессах, без него - после истечения TOKEN_CACHE['TTL'].
+    """
+
+    def authenticate_credentials(self, key):
+        if (values := token_cache.get(key)) is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(
+                key, {name: getattr(user, name) for name in USER_FIELDS}
+            )
+            return user, token
+        # from_db ожидает значения в порядке полей модели.
+        names = [
+            field.attname for field in User._meta.concrete_fields
+            if field.attname in values
+        ]
+        user = User.from_db(
+            DEFAULT_DB_ALIAS, names, [values[name] for name in names]
+        )
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return user, self.get_model()(key=key, user=user)
@@ -0,0 +1,88 @@
+"""Индекс названий ингредиентов для автодополнения."""
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.models.functions import Lower
+from recipes.catalog import get_catalog_version
+from recipes.models import Ingredient
+
+
+class IngredientIndex:
+    """Отсортированный по названию список ингредиентов в памяти процесса.
+
+    Поиск по началу названия выполняется бинарным поиском, затем
+    добавляются ингредиенты, содержащие строку в середине названия.
+    Названия в нижнем регистре и порядок ингредиентов берутся из базы
+    данных, поэтому результат совпадает с IngredientNameFilter с учётом
+    правил сравнения (collation) базы данных.
+    Индекс строится при первом обращении и перестраивается при смене
+    версии справочника ингредиентов, в том числе другим процессом или
+    командой load_data, или по истечении INGREDIENT_INDEX_TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = None
+        self._entries = None
+        self._prefixes = None
+        self._version = None
+        self._built_at = 0
+
+    def invalidate(self):
+        self._keys = None
+
+    def build(self):
+        rows = Ingredient.objects.annotate(
+            name_lower=Lower('name')
+        ).values_list(
+            'id', 'name', 'measurement_unit', 'name_lower'
+        ).order_by('name_lower', 'name', 'id')
+        self._entries = []
+        self._keys = []
+        for pk, name, measurement_unit, name_lower in rows:
+            self._entries.append(
+                {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            )
+            self._keys.append(name_lower)
+        # Для бинарного поиска названия упорядочены по кодам символов,
+        # рядом с названием хранится его позиция в порядке базы данных.
+        self._prefixes = sorted(
+            (key, position) for position, key in enumerate(self._keys)
+        )
+        self._built_at = time.monotonic()
+
+    def get_index(self):
+        version = get_catalog_version('ingredients')
+        with self._lock:
+            if self._keys is None or self._version != version or (
+                time.monotonic() - self._built_at
+                > settings.INGREDIENT_INDEX_TTL
+            ):
+                self.build()
+                self._version = version
+            return self._keys, self._entries, self._prefixes
+
+    def search(self, value, limit=None):
+        keys, entries, prefixes = self.get_index()
+        value = value.lower()
+        positions = []
+        index = bisect_left(prefixes, (value,))
+        while (
+            index < len(prefixes) and prefixes[index][0].startswith(value)
+        ):
+            positions.append(prefixes[index][1])
+            index += 1
+        result = [entries[position] for position in sorted(positions)]
+        if limit is not None and len(result) >= limit:
+            return result[:limit]
+        for key, entry in zip(keys, entries):
+            if value in key and not key.startswith(value):
+                result.append(entry)
+                if limit is not None and len(result) >= limit:
+                    break
+        return result
+
+
+ingredient_index = IngredientIndex()
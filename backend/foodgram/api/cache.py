@@ -0,0 +1,170 @@
+"""Кэширование справочников, карточек рецептов и сформированных
+списков покупок."""
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import transaction
+from recipes.catalog import get_catalog_version
+from recipes.models import Purchase, Tag
+
+
+class LRUFileBasedCache(FileBasedCache):
+    """Файловый кэш, вытесняющий давно не использованные записи.
+
+    Время последнего обращения хранится в mtime файла записи.
+    """
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, default, version)
+        if value is not default:
+            try:
+                os.utime(self._key_to_file(key, version))
+            except FileNotFoundError:
+                pass
+        return value
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        num_entries = len(filelist)
+        if num_entries < self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            return self.clear()
+        mtimes = []
+        for fname in filelist:
+            try:
+                mtimes.append((os.path.getmtime(fname), fname))
+            except FileNotFoundError:
+                pass
+        mtimes.sort()
+        for _, fname in mtimes[:num_entries // self._cull_frequency]:
+            self._delete(fname)
+
+
+def get_tags():
+    """Теги справочника, кэшируются до смены его версии."""
+
+    key = f'catalog:tags:{get_catalog_version("tags")}'
+    if (tags := cache.get(key)) is None:
+        tags = list(
+            Tag.objects.order_by('id').values('id', 'name', 'color', 'slug')
+        )
+        cache.set(key, tags)
+    return tags
+
+
+def get_cards_cache():
+    return caches[settings.CARDS_CACHE_ALIAS]
+
+
+def card_key(recipe_id):
+    return f'recipe:card:v1:{recipe_id}'
+
+
+def get_cards(recipe_ids):
+    """Сохранённые карточки рецептов в виде {id: карточка}."""
+
+    keys = {card_key(pk): pk for pk in recipe_ids}
+    cards = get_cards_cache().get_many(keys)
+    return {keys[key]: card for key, card in cards.items()}
+
+
+def set_cards(cards):
+    get_cards_cache().set_many(
+        {card_key(pk): card for pk, card in cards.items()}
+    )
+
+
+def invalidate_cards(recipe_ids):
+    """Удаление карточек рецептов после фиксации транзакции, чтобы
+    параллельный запрос не сохранил карточку по старым данным."""
+
+    keys = [card_key(pk) for pk in recipe_ids]
+    if keys:
+        transaction.on_commit(lambda: get_cards_cache().delete_many(keys))
+
+
+def get_exports_cache():
+    return caches[settings.EXPORTS_CACHE_ALIAS]
+
+
+def user_key(user_id):
+    return f'shopping_list:user:{user_id}'
+
+
+def content_key(etag):
+    return f'shopping_list:content:{etag}'
+
+
+def rows_digest(rows):
+    """Хэш агрегированных строк списка покупок."""
+
+    digest = hashlib.sha256()
+    for name, measurement_unit, amount in rows:
+        digest.update(f'{name}\0{measurement_unit}\0{amount}\n'.encode())
+    return digest.hexdigest()
+
+
+def make_etag(digest, export_format):
+    return hashlib.sha256(f'{digest}:{export_format}'.encode()).hexdigest()
+
+
+def get_user_digest(user_id):
+    return get_exports_cache().get(user_key(user_id))
+
+
+def set_user_digest(user_id, digest):
+    get_exports_cache().set(user_key(user_id), digest)
+
+
+def invalidate_users(user_ids):
+    """Сброс хэшей списков покупок у пользователей после фиксации
+    транзакции, чтобы параллельный запрос не сохранил хэш по старым
+    данным.
+
+    Сами файлы адресуются по содержимому и не устаревают,
+    они вытесняются из кэша по мере заполнения.
+    """
+
+    keys = [user_key(pk) for pk in user_ids]
+    if keys:
+        transaction.on_commit(lambda: get_exports_cache().delete_many(keys))
+
+
+def invalidate_recipe_carts(recipe_id):
+    """Сброс хэшей списков покупок, в которые входит рецепт."""
+
+    invalidate_users(
+        Purchase.objects.filter(recipe_id=recipe_id).values_list(
+            'user_id', flat=True
+        )
+    )
+
+
+def get_content(etag):
+    return get_exports_cache().get(content_key(etag))
+
+
+def cache_content(etag, chunks):
+    """Отдаёт части файла и сохраняет их в кэш после завершения.
+
+    Файлы больше EXPORTS_CACHE_MAX_SIZE не кэшируются.
+    """
+
+    content = []
+    size = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        if content is not None:
+            size += len(chunk)
+            if size <= settings.EXPORTS_CACHE_MAX_SIZE:
+                content.append(chunk)
+            else:
+                content = None
+        yield chunk
+    if content is not None:
+        get_exports_cache().set(content_key(etag), b''.join(content))
@@ -0,0 +1,325 @@
+"""Подбор рецептов по имеющимся у пользователя ингредиентам.
+
+Рецепты ранжируются по доле своих ингредиентов, которые есть
+у пользователя, затем по количеству совпавших ингредиентов и по
+новизне. Результат - последовательность кортежей
+(id рецепта, совпало ингредиентов, всего ингредиентов), которую
+можно разбить на страницы пагинатором.
+"""
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from operator import truediv
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F, FloatField, Q
+from django.db.models.functions import Cast
+from recipes.catalog import (COOKABLE_CATALOG, bump_catalog_version,
+                             get_catalog_changes, get_catalog_version)
+from recipes.models import RecipeIngredient
+
+rebuild_executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix='cookable'
+)
+
+
+class Ranking:
+    """Рецепты с совпавшими ингредиентами в порядке покрытия.
+
+    Полная сортировка не нужна: для среза лучшие рецепты отбираются
+    кучей размером с конец среза.
+    """
+
+    def __init__(self, matched, totals):
+        self._matched = matched
+        self._totals = totals
+
+    def __len__(self):
+        return len(self._matched)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError('Поддерживаются только срезы без шага.')
+        stop = len(self) if index.stop is None else index.stop
+        recipe_ids = self._matched.keys()
+        counts = self._matched.values()
+        top = heapq.nlargest(stop, zip(
+            map(truediv, counts, map(self._totals.__getitem__, recipe_ids)),
+            counts,
+            recipe_ids,
+        ))
+        return [
+            (recipe_id, matched, self._totals[recipe_id])
+            for _, matched, recipe_id in top[index.start or 0:]
+        ]
+
+
+class CookableIndex:
+    """Инвертированный индекс ингредиент -> рецепты в памяти процесса.
+
+    Для каждого ингредиента хранится отсортированный массив id
+    рецептов, для каждого рецепта - массив id его ингредиентов
+    и их количество в массиве, индексированном id рецепта.
+    Совпадения считаются только по массивам запрошенных ингредиентов,
+    остальные рецепты не просматриваются.
+
+    Индекс строится при первом обращении. Изменения рецептов вносятся
+    после фиксации транзакции, один раз на транзакцию, со сменой
+    версии индекса и записью изменённых рецептов в журнал изменений.
+    Если версию сменил другой процесс, рецепты из журнала
+    перечитываются из базы. Если журнал не содержит нужных изменений
+    (версию сменила команда seed_benchmark или процесс отстал
+    на CATALOG_CHANGES_KEPT изменений) и по истечении
+    COOKABLE_INDEX_TTL индекс перестраивается в фоновом потоке,
+    а до замены подбор идёт по прежнему индексу.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = None
+        self._ingredients = None
+        self._totals = None
+        self._version = None
+        self._built_at = 0
+        self._rebuilding = False
+
+    def invalidate(self):
+        self._postings = None
+
+    def load(self):
+        """Массивы индекса по всем ингредиентам рецептов в базе."""
+
+        postings = defaultdict(list)
+        ingredients = defaultdict(list)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        ).order_by().iterator():
+            postings[ingredient_id].append(recipe_id)
+            ingredients[recipe_id].append(ingredient_id)
+        totals = array('H', bytes(2 * (max(ingredients, default=0) + 1)))
+        for recipe_id, ingredient_ids in ingredients.items():
+            totals[recipe_id] = len(ingredient_ids)
+        return (
+            {
+                ingredient_id: array('I', sorted(recipe_ids))
+                for ingredient_id, recipe_ids in postings.items()
+            },
+            {
+                recipe_id: array('I', ingredient_ids)
+                for recipe_id, ingredient_ids in ingredients.items()
+            },
+            totals,
+        )
+
+    def build(self):
+        """Построение индекса, версия читается до данных, поэтому
+        изменения, внесённые во время построения, не теряются."""
+
+        version = get_catalog_version(COOKABLE_CATALOG)
+        postings, ingredients, totals = self.load()
+        with self._lock:
+            self._postings = postings
+            self._ingredients = ingredients
+            self._totals = totals
+            self._version = version
+            self._built_at = time.monotonic()
+
+    def _build_in_background(self):
+        close_old_connections()
+        try:
+            self.build()
+        finally:
+            self._rebuilding = False
+            close_old_connections()
+
+    def start_rebuild(self):
+        """Перестроение индекса в фоновом потоке, не больше одного
+        одновременно."""
+
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        rebuild_executor.submit(self._build_in_background)
+
+    def _replace(self, recipe_id, ingredient_ids):
+        old = set(self._ingredients.get(recipe_id, ()))
+        new = set(ingredient_ids)
+        for ingredient_id in old - new:
+            postings = self._postings[ingredient_id]
+            del postings[bisect_left(postings, recipe_id)]
+            if not postings:
+                del self._postings[ingredient_id]
+        for ingredient_id in new - old:
+            postings = self._postings.setdefault(ingredient_id, array('I'))
+            postings.insert(bisect_left(postings, recipe_id), recipe_id)
+        if new:
+            self._ingredients[recipe_id] = array('I', sorted(new))
+        else:
+            self._ingredients.pop(recipe_id, None)
+        if recipe_id >= len(self._totals):
+            self._totals.frombytes(
+                bytes(2 * (recipe_id + 1 - len(self._totals)))
+            )
+        self._totals[recipe_id] = len(new)
+
+    def apply(self, recipes):
+        """Замена ингредиентов рецептов {id: ингредиенты} со сменой
+        версии и записью id рецептов в журнал изменений.
+
+        Индекс получает новую версию, только если был построен по
+        предыдущей, иначе он пропустил чужие изменения и догонит их
+        по журналу при следующем подборе.
+        """
+
+        previous, version = bump_catalog_version(
+            COOKABLE_CATALOG, changes=sorted(recipes)
+        )
+        with self._lock:
+            if self._postings is not None:
+                for recipe_id, ingredient_ids in recipes.items():
+                    self._replace(recipe_id, ingredient_ids)
+                if self._version == previous:
+                    self._version = version
+
+    def refresh(self, recipe_ids):
+        """Перечитывание ингредиентов рецептов из базы."""
+
+        self.apply(load_ingredients(recipe_ids))
+
+    def catch_up(self):
+        """Перенос изменений других процессов из журнала изменений."""
+
+        version = self._version
+        changes = get_catalog_changes(COOKABLE_CATALOG, version)
+        if changes is None:
+            self.start_rebuild()
+            return
+        ingredients = load_ingredients(
+            {pk for _, recipe_ids in changes for pk in recipe_ids}
+        )
+        with self._lock:
+            if self._postings is None or self._version != version:
+                return
+            for recipe_id, ingredient_ids in ingredients.items():
+                self._replace(recipe_id, ingredient_ids)
+            self._version = changes[-1][0]
+
+    def rank(self, ingredient_ids):
+        """Совпадения по ингредиентам и снимок количества ингредиентов
+        рецептов, не зависящий от последующих изменений индекса."""
+
+        if self._postings is None:
+            self.build()
+        elif self._version != get_catalog_version(COOKABLE_CATALOG):
+            self.catch_up()
+        if (
+            time.monotonic() - self._built_at
+            > settings.COOKABLE_INDEX_TTL
+        ):
+            self.start_rebuild()
+        with self._lock:
+            matched = Counter()
+            for ingredient_id in set(ingredient_ids):
+                matched.update(self._postings.get(ingredient_id, ()))
+            return Ranking(matched, self._totals[:])
+
+
+cookable_index = CookableIndex()
+# Рецепты, изменённые в текущей транзакции потока.
+pending = threading.local()
+
+
+def rank_in_database(ingredient_ids):
+    """Тот же порядок рецептов запросом с группировкой по рецептам."""
+
+    return RecipeIngredient.objects.filter(
+        recipe_id__in=RecipeIngredient.objects.filter(
+            ingredient_id__in=ingredient_ids
+        ).values('recipe_id')
+    ).values('recipe_id').annotate(
+        matched=Count('pk', filter=Q(ingredient_id__in=ingredient_ids)),
+        total=Count('pk'),
+    ).annotate(
+        coverage=Cast(F('matched'), FloatField()) / F('total')
+    ).order_by('-coverage', '-matched', '-recipe_id').values_list(
+        'recipe_id', 'matched', 'total'
+    )
+
+
+def rank_recipes(ingredient_ids):
+    """Рецепты в порядке покрытия ингредиентами пользователя."""
+
+    if settings.COOKABLE_BACKEND == 'memory':
+        return cookable_index.rank(ingredient_ids)
+    return rank_in_database(ingredient_ids)
+
+
+def load_ingredients(recipe_ids):
+    """Ингредиенты рецептов из базы: {id рецепта: [id ингредиентов]},
+    у удалённых рецептов - пустой список."""
+
+    ingredients = {recipe_id: [] for recipe_id in recipe_ids}
+    if ingredients:
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+            recipe_id__in=ingredients
+        ).values_list('recipe_id', 'ingredient_id').order_by():
+            ingredients[recipe_id].append(ingredient_id)
+    return ingredients
+
+
+def flush_cookable():
+    """Внесение изменённых за транзакцию рецептов в индекс."""
+
+    recipes = getattr(pending, 'recipes', None)
+    pending.recipes = {}
+    if not recipes:
+        return
+    recipes.update(load_ingredients([
+        recipe_id for recipe_id, ingredient_ids in recipes.items()
+        if ingredient_ids is None
+    ]))
+    cookable_index.apply(recipes)
+
+
+def schedule_cookable(recipes):
+    """Запоминание изменённых рецептов {id: ингредиенты или None, если
+    их нужно перечитать из базы} до фиксации транзакции.
+
+    На транзакцию регистрируется один обработчик on_commit, поэтому
+    каскадное удаление рецепта со всеми ингредиентами меняет версию
+    индекса один раз. Обработчик регистрируется заново, если он был
+    отброшен при откате: рецепты из откаченной транзакции
+    перечитываются вместе со следующей, это лишь лишняя работа.
+    """
+
+    if settings.COOKABLE_BACKEND != 'memory':
+        return
+    if getattr(pending, 'recipes', None):
+        registered = any(
+            hook[1] is flush_cookable
+            for hook in transaction.get_connection().run_on_commit
+        )
+    else:
+        pending.recipes = {}
+        registered = False
+    pending.recipes.update(recipes)
+    if not registered:
+        transaction.on_commit(flush_cookable)
+
+
+def update_cookable(recipe_id, ingredient_ids):
+    """Обновление рецепта в индексе после фиксации транзакции."""
+
+    schedule_cookable({recipe_id: list(ingredient_ids)})
+
+
+def refresh_cookable(recipe_ids):
+    """Перечитывание рецептов в индекс после фиксации транзакции."""
+
+    schedule_cookable(dict.fromkeys(recipe_ids))
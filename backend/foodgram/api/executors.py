@@ -0,0 +1,48 @@
+"""Ограниченные пулы потоков.
+
+read_executor обслуживает асинхронные представления для чтения
+в ASGI-режиме, cpu_executor - тяжёлые вычисления: сборку pdf,
+декодирование и перекодирование изображений. Размер пулов
+ограничивает число одновременных задач каждого вида в процессе.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+read_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_READ_WORKERS, thread_name_prefix='api-read'
+)
+cpu_executor = ThreadPoolExecutor(
+    max_workers=settings.CPU_WORKERS, thread_name_prefix='cpu'
+)
+
+
+def run_cpu(func, *args, **kwargs):
+    """Выполнение функции в пуле cpu_executor с ожиданием результата."""
+
+    return cpu_executor.submit(func, *args, **kwargs).result()
+
+
+def call_view(view, request, *args, **kwargs):
+    """Вызов синхронного представления в потоке пула чтения.
+
+    Ответ отрисовывается здесь же, соединения с базой закрываются
+    по правилам CONN_MAX_AGE, как в конце обычного запроса.
+    """
+
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+async def call_view_async(view, request, *args, **kwargs):
+    return await sync_to_async(
+        call_view, thread_sensitive=False, executor=read_executor
+    )(view, request, *args, **kwargs)
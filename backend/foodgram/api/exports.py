@@ -0,0 +1,205 @@
+"""Формирование списка покупок в форматах pdf, csv и txt."""
+import csv
+from datetime import timedelta
+from functools import lru_cache
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from recipes.models import CartLine, Job
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Paragraph, SimpleDocTemplate
+from reportlab.platypus.tables import Table
+
+from .cache import get_user_digest, rows_digest, set_user_digest
+from .executors import run_cpu
+from .jobs import enqueue
+
+FONT = 'DejaVuSerif'
+FONT_BOLD = 'DejaVuSerifBold'
+TITLE = 'Список покупок:'
+HEADER = ('Ингредиент', 'Количество', 'Ед.измерения')
+CHUNK_SIZE = 64 * 1024
+PDF_MEMORY_LIMIT = 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def register_fonts():
+    """Регистрация шрифтов для pdf, выполняется один раз при сборке
+    первого pdf, а не при старте каждой команды."""
+
+    pdfmetrics.registerFont(TTFont(FONT, 'DejaVuSerif.ttf'))
+    pdfmetrics.registerFont(TTFont(FONT_BOLD, 'DejaVuSerif-Bold.ttf'))
+
+
+def get_shopping_list(user):
+    """Суммарное количество ингредиентов из списка покупок пользователя.
+
+    Читается из предварительно агрегированных строк CartLine.
+    Возвращает кортежи (название, единица измерения, количество).
+    """
+
+    return (
+        CartLine.objects.filter(user=user)
+        .values_list(
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            'total_amount',
+        )
+        .order_by('ingredient__name', 'ingredient__measurement_unit')
+    )
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADER)
+    for name, measurement_unit, amount in rows:
+        yield writer.writerow((name, amount, measurement_unit))
+
+
+def render_txt(rows):
+    yield f'{TITLE}\n'
+    for name, measurement_unit, amount in rows:
+        yield f'{name} ({measurement_unit}) — {amount}\n'
+
+
+def build_pdf(file, rows):
+    register_fonts()
+    pdf = SimpleDocTemplate(
+        file,
+        pagesize=A4,
+        rightMargin=20,
+        leftMargin=20,
+        topMargin=15,
+        bottomMargin=15,
+    )
+    style = ParagraphStyle(
+        name='Normal',
+        fontName=FONT_BOLD,
+        fontSize=15,
+        spaceAfter=14,
+        spaceBefore=20,
+    )
+    table = Table(
+        [HEADER, *((name, amount, unit) for name, unit, amount in rows)],
+        colWidths=[340, 100, 100],
+        rowHeights=20,
+        repeatRows=1,
+    )
+    table.setStyle(
+        [
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.darkcyan),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, -1), FONT),
+            ('FONTSIZE', (0, 0), (-1, 0), 12),
+            ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+        ]
+    )
+    pdf.build([Paragraph(TITLE, style=style), table])
+
+
+def read_chunks(file):
+    with file:
+        file.seek(0)
+        while chunk := file.read(CHUNK_SIZE):
+            yield chunk
+
+
+def render_pdf(rows):
+    """Pdf собирается во временный файл сразу, в пуле cpu_executor,
+    и затем отдаётся частями.
+
+    ReportLab пишет таблицу перекрёстных ссылок только после сборки
+    документа, поэтому построчная отдача pdf невозможна. Сборка при
+    вызове, а не при первом чтении, не блокирует цикл событий ASGI,
+    который читает потоковые ответы синхронно.
+    """
+
+    file = SpooledTemporaryFile(max_size=PDF_MEMORY_LIMIT)
+    try:
+        run_cpu(build_pdf, file, rows)
+    except Exception:
+        file.close()
+        raise
+    return read_chunks(file)
+
+
+EXPORTS = {
+    'pdf': render_pdf,
+    'csv': render_csv,
+    'txt': render_txt,
+}
+
+
+def render_shopping_list(rows, export_format):
+    """Генератор содержимого списка покупок в выбранном формате."""
+
+    return EXPORTS[export_format](rows)
+
+
+def shopping_list_key(user_id, export_format, digest):
+    return f'{user_id}:{export_format}:{digest}'
+
+
+def submit_shopping_list(user, export_format):
+    """Постановка формирования списка покупок в очередь.
+
+    Для того же содержимого списка и формата возвращается уже
+    поставленная или готовая и ещё не удалённая задача.
+    Возвращает кортеж (задача, создана ли).
+    """
+
+    if (digest := get_user_digest(user.pk)) is None:
+        digest = rows_digest(get_shopping_list(user))
+        set_user_digest(user.pk, digest)
+    key = shopping_list_key(user.pk, export_format, digest)
+    expired = timezone.now() - timedelta(seconds=settings.JOBS_TTL)
+    job = (
+        Job.objects.defer('result')
+        .filter(kind=Job.SHOPPING_LIST, key=key)
+        .filter(
+            Q(status__in=Job.ACTIVE)
+            | Q(status=Job.DONE, updated_at__gt=expired)
+        )
+        .order_by('-pk')
+        .first()
+    )
+    if job is not None:
+        return job, False
+    return enqueue(
+        Job.SHOPPING_LIST, key, user=user, params={'format': export_format}
+    )
+
+
+def shopping_list_job(job):
+    """Формирование файла списка покупок для задачи очереди.
+
+    Ключ задачи обновляется по списку на момент выполнения.
+    """
+
+    rows = list(get_shopping_list(job.user_id))
+    export_format = job.params['format']
+    content = b''.join(
+        chunk.encode() if isinstance(chunk, str) else chunk
+        for chunk in render_shopping_list(rows, export_format)
+    )
+    return {
+        'result': content,
+        'key': shopping_list_key(
+            job.user_id, export_format, rows_digest(rows)
+        ),
+    }
@@ -0,0 +1,81 @@
+"""Фасеты поиска рецептов: количество рецептов по тегам, авторам
+и интервалам времени приготовления.
+
+Каждый фасет считается одним запросом с группировкой по рецептам,
+отфильтрованным всеми фильтрами, кроме фильтра самого фасета, чтобы
+было видно, сколько рецептов добавит выбор ещё одного значения.
+"""
+from django.db.models import Count
+from recipes.models import Recipe
+
+from .cache import get_tags
+from .filters import COOKING_TIME_BUCKETS, cooking_time_condition
+
+FACET_AUTHORS_LIMIT = 10
+
+
+def tag_facets(queryset):
+    """Теги справочника с количеством рецептов."""
+
+    counts = dict(
+        Recipe.tags.through.objects.filter(
+            recipe__in=queryset.order_by().values('pk')
+        ).values('tag_id').annotate(count=Count('pk')).order_by().values_list(
+            'tag_id', 'count'
+        )
+    )
+    return [
+        {**tag, 'count': counts.get(tag['id'], 0)} for tag in get_tags()
+    ]
+
+
+def author_facets(queryset):
+    """Авторы с наибольшим количеством рецептов."""
+
+    authors = queryset.values(
+        'author',
+        'author__username',
+        'author__first_name',
+        'author__last_name',
+    ).annotate(count=Count('pk')).order_by('-count', 'author')
+    return [
+        {
+            'id': author['author'],
+            'username': author['author__username'],
+            'first_name': author['author__first_name'],
+            'last_name': author['author__last_name'],
+            'count': author['count'],
+        }
+        for author in authors[:FACET_AUTHORS_LIMIT]
+    ]
+
+
+def cooking_time_facets(queryset):
+    """Количество рецептов в интервалах времени приготовления."""
+
+    counts = queryset.order_by().aggregate(
+        **{
+            bucket: Count('pk', filter=cooking_time_condition(bucket))
+            for bucket in COOKING_TIME_BUCKETS
+        }
+    )
+    return [
+        {'value': bucket, 'min': low, 'max': high, 'count': counts[bucket]}
+        for bucket, (low, high) in COOKING_TIME_BUCKETS.items()
+    ]
+
+
+FACETS = {
+    'tags': tag_facets,
+    'author': author_facets,
+    'cooking_time': cooking_time_facets,
+}
+
+
+def get_facets(filterset):
+    """Все фасеты для проверенного набора фильтров."""
+
+    return {
+        name: facet(filterset.filter_queryset_except(name))
+        for name, facet in FACETS.items()
+    }
@@ -1,18 +1,57 @@
 import django_filters
-from django.db.models import Case, Q, Value, When
+from django.db.models import (BooleanField, Case, Exists, OuterRef, Q, Value,
+                              When)
+from django.db.models.functions import Lower
 from recipes.models import Ingredient, Recipe
 from users.models import User
 
+from .cache import get_tags
+from .search import search_recipes
+
+# Интервалы времени приготовления: наименьшее и наибольшее время.
+COOKING_TIME_BUCKETS = {
+    '0-15': (None, 15),
+    '16-30': (16, 30),
+    '31-60': (31, 60),
+    '61-120': (61, 120),
+    '121-': (121, None),
+}
+
+
+def cooking_time_condition(bucket):
+    """Условие попадания времени приготовления в интервал."""
+
+    low, high = COOKING_TIME_BUCKETS[bucket]
+    condition = Q()
+    if low is not None:
+        condition &= Q(cooking_time__gte=low)
+    if high is not None:
+        condition &= Q(cooking_time__lte=high)
+    return condition
+
+
+def get_tag_choices():
+    return [(tag['slug'], tag['name']) for tag in get_tags()]
+
 
 class IngredientNameFilter(django_filters.Filter):
+    """Поиск по названию: сначала совпадения с начала названия.
+
+    Условия строятся по lower(name), чтобы в PostgreSQL использовались
+    индексы lower(name) text_pattern_ops и gin_trgm_ops.
+    """
+
     def filter(self, queryset, value):
         if value:
-            queryset = queryset.filter(name__icontains=value).annotate(
+            value = value.lower()
+            queryset = queryset.annotate(
+                name_lower=Lower('name')
+            ).filter(name_lower__contains=value).annotate(
                 qs_order=Case(
-                    When(Q(name__istartswith=value), then=Value('1')),
+                    When(name_lower__startswith=value, then=Value('1')),
                     default=Value('2')
                 )
-            ).order_by('qs_order', 'name')
+            ).order_by('qs_order', 'name_lower', 'name', 'id')
         return queryset
 
 
@@ -24,18 +63,47 @@ class IngredientFilter(django_filters.FilterSet):
         fields = ('name',)
 
 
+class TagsFilter(django_filters.MultipleChoiceFilter):
+    """Фильтр по слагам тегов через подзапрос Exists.
+
+    Рецепт с несколькими подходящими тегами не дублируется, поэтому
+    DISTINCT не нужен. Список тегов берётся из кэша справочника.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('choices', get_tag_choices)
+        super().__init__(*args, **kwargs)
+
+    def filter(self, queryset, value):
+        if not value:
+            return queryset
+        tag_ids = [tag['id'] for tag in get_tags() if tag['slug'] in value]
+        return queryset.filter(
+            Exists(
+                Recipe.tags.through.objects.filter(
+                    recipe=OuterRef('pk'), tag_id__in=tag_ids
+                )
+            )
+        )
+
+
 class RecipeFilter(django_filters.FilterSet):
     author = django_filters.ModelChoiceFilter(
         to_field_name='id',
         queryset=User.objects.all()
     )
-    tags = django_filters.AllValuesMultipleFilter(
-        field_name='tags__slug',
+    tags = TagsFilter()
+    cooking_time = django_filters.ChoiceFilter(
+        choices=[(bucket, bucket) for bucket in COOKING_TIME_BUCKETS],
+        method='filter_cooking_time',
     )
+    search = django_filters.CharFilter(method='filter_search')
     is_favorited = django_filters.TypedChoiceFilter(
-        choices=[(1, 'true'), (0, 'false')], field_name='is_favorited')
+        choices=[(1, 'true'), (0, 'false')], coerce=int,
+        method='filter_is_favorited')
     is_in_shopping_cart = django_filters.TypedChoiceFilter(
-        choices=[(1, 'true'), (0, 'false')], field_name='is_in_shopping_cart')
+        choices=[(1, 'true'), (0, 'false')], coerce=int,
+        method='filter_is_in_shopping_cart')
 
     class Meta:
         model = Recipe
@@ -44,4 +112,51 @@ class RecipeFilter(django_filters.FilterSet):
             'author',
             'is_favorited',
             'is_in_shopping_cart',
+            'cooking_time',
+            'search',
+        )
+
+    def filter_queryset_except(self, exclude):
+        """Рецепты с применением всех фильтров, кроме exclude.
+
+        Нужен для фасетов: количество вариантов фильтра считается
+        без учёта выбранных в нём самом значений.
+        """
+
+        queryset = self.queryset
+        for name, value in self.form.cleaned_data.items():
+            if name != exclude:
+                queryset = self.filters[name].filter(queryset, value)
+        return queryset
+
+    def filter_cooking_time(self, queryset, name, value):
+        return queryset.filter(cooking_time_condition(value))
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def filter_user_relation(self, queryset, value, lookup, annotation):
+        """Фильтр через JOIN со связью пользователя вместо фильтрации
+        по подзапросу Exists. Значение аннотации при активном фильтре
+        известно заранее, поэтому подзапрос заменяется константой."""
+
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none() if value else queryset
+        if value:
+            queryset = queryset.filter(**{lookup: user})
+        else:
+            queryset = queryset.exclude(**{lookup: user})
+        return queryset.annotate(
+            **{annotation: Value(bool(value), output_field=BooleanField())}
+        )
+
+    def filter_is_favorited(self, queryset, name, value):
+        return self.filter_user_relation(
+            queryset, value, 'favorites__user', name
+        )
+
+    def filter_is_in_shopping_cart(self, queryset, name, value):
+        return self.filter_user_relation(
+            queryset, value, 'purchases_recipe__user', name
         )
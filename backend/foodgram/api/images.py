@@ -0,0 +1,223 @@
+"""Обработка изображений рецептов: декодирование, перекодирование
+и создание миниатюр."""
+import binascii
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+from recipes.images import EXTENSIONS, HASHED_NAME, IMAGES_DIR, thumbnail_name
+from recipes.models import Job, Recipe
+from rest_framework import serializers
+
+from .cache import invalidate_cards
+from .executors import run_cpu
+from .jobs import enqueue
+
+BASE64_CHUNK = 64 * 1024
+
+executor = ThreadPoolExecutor(
+    max_workers=max(settings.IMAGE_PROCESSING_WORKERS, 1),
+    thread_name_prefix='images',
+)
+pending = set()
+pending_lock = threading.Lock()
+
+
+def decode_base64_image(data):
+    """Потоковое декодирование data URL во временный файл.
+
+    Размер проверяется до декодирования, файлы больше
+    IMAGE_MAX_UPLOAD_SIZE отклоняются.
+    """
+
+    header, _, encoded = data.partition(';base64,')
+    if not encoded:
+        raise serializers.ValidationError('Некорректное изображение!')
+    if len(encoded) * 3 // 4 > settings.IMAGE_MAX_UPLOAD_SIZE:
+        raise serializers.ValidationError(
+            'Размер изображения не должен превышать '
+            f'{settings.IMAGE_MAX_UPLOAD_SIZE // 1024 // 1024} МБ!'
+        )
+    file = SpooledTemporaryFile(max_size=BASE64_CHUNK * 16)
+    try:
+        for start in range(0, len(encoded), BASE64_CHUNK):
+            file.write(
+                binascii.a2b_base64(encoded[start:start + BASE64_CHUNK])
+            )
+    except binascii.Error:
+        file.close()
+        raise serializers.ValidationError('Некорректное изображение!')
+    file.seek(0)
+    return File(file, name='upload.' + header.split('/')[-1])
+
+
+def file_digest(file):
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def encode(image, size=None):
+    """Перекодирование изображения в IMAGE_FORMAT."""
+
+    image = ImageOps.exif_transpose(image)
+    if size is not None:
+        image.thumbnail(size)
+    if settings.IMAGE_FORMAT == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(
+        buffer, settings.IMAGE_FORMAT, quality=settings.IMAGE_QUALITY
+    )
+    return buffer.getvalue()
+
+
+def make_thumbnails(name, recipe_ids=()):
+    """Создание недостающих миниатюр всех размеров для изображения.
+
+    Если файла изображения нет (рецепт удалён или транзакция
+    откатилась), ничего не делается. Карточки рецептов recipe_ids,
+    в которых вместо миниатюр стоял адрес изображения, сбрасываются.
+    """
+
+    if (match := HASHED_NAME.match(name)) is None:
+        return
+    if not default_storage.exists(name):
+        return
+    digest = match['digest']
+    created = False
+    with default_storage.open(name) as file, Image.open(file) as image:
+        image.load()
+        for size_name, size in settings.IMAGE_THUMBNAILS.items():
+            thumbnail = thumbnail_name(digest, size_name)
+            if default_storage.exists(thumbnail):
+                continue
+            saved = default_storage.save(
+                thumbnail, ContentFile(encode(image.copy(), size))
+            )
+            if saved != thumbnail:
+                # Миниатюру одновременно создал другой процесс.
+                default_storage.delete(saved)
+            created = True
+    if created:
+        invalidate_cards(recipe_ids)
+
+
+def make_thumbnails_async(name, recipe_ids=()):
+    """Создание миниатюр в пуле потоков, не более одной задачи на файл."""
+
+    with pending_lock:
+        if name in pending:
+            return
+        pending.add(name)
+
+    def task():
+        try:
+            make_thumbnails(name, recipe_ids)
+        finally:
+            with pending_lock:
+                pending.discard(name)
+
+    executor.submit(task)
+
+
+def thumbnails_job(job):
+    """Создание миниатюр для задачи очереди.
+
+    Повреждённый файл повторными попытками не исправить, поэтому
+    задача завершается с ошибкой сразу.
+    """
+
+    try:
+        make_thumbnails(job.params['name'], job.params.get('recipes', ()))
+    except UnidentifiedImageError as error:
+        return {'status': Job.FAILED, 'error': str(error)}
+
+
+class UploadedImage:
+    """Перекодированное изображение, ещё не сохранённое в хранилище.
+
+    name - имя по хэшу содержимого, content - байты файла или None,
+    если файл с таким именем уже есть.
+    """
+
+    def __init__(self, name, content):
+        self.name = name
+        self.content = content
+
+
+def prepare_image(file):
+    """Перекодирование изображения без записи в хранилище.
+
+    Перекодирование выполняется в пуле cpu_executor.
+    """
+
+    digest = file_digest(file)
+    name = f'{IMAGES_DIR}{digest}.{EXTENSIONS[settings.IMAGE_FORMAT]}'
+    content = None
+    if not default_storage.exists(name):
+        with Image.open(file) as image:
+            content = run_cpu(encode, image, settings.IMAGE_MAX_SIZE)
+    return UploadedImage(name, content)
+
+
+def save_image(image, recipe_ids=()):
+    """Запись подготовленного изображения и запуск создания миниатюр.
+
+    Повторная загрузка того же файла не создаёт новых файлов.
+    Миниатюры создаются задачей очереди или в пуле потоков,
+    если они включены.
+    Возвращает имя, под которым хранилище сохранило файл.
+    """
+
+    name = image.name
+    if image.content is not None and not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(image.content))
+    recipe_ids = list(recipe_ids)
+    if settings.IMAGE_PROCESSING_JOBS:
+        enqueue(
+            Job.THUMBNAILS, name, params={'name': name, 'recipes': recipe_ids}
+        )
+    elif settings.IMAGE_PROCESSING_WORKERS:
+        make_thumbnails_async(name, recipe_ids)
+    else:
+        make_thumbnails(name, recipe_ids)
+    return name
+
+
+def store_image(file):
+    """Перекодирование и немедленное сохранение изображения.
+
+    Возвращает имя файла в хранилище.
+    """
+
+    return save_image(prepare_image(file))
+
+
+def store_recipe_image(recipe, image):
+    """Сохранение изображения рецепта после фиксации транзакции.
+
+    При ошибке валидации или откате файлы не остаются в хранилище.
+    Если хранилище сохранило файл под другим именем, оно
+    записывается в рецепт.
+    """
+
+    def store():
+        name = save_image(image, [recipe.pk])
+        if name != image.name:
+            Recipe.objects.filter(pk=recipe.pk, image=image.name).update(
+                image=name
+            )
+            invalidate_cards([recipe.pk])
+
+    transaction.on_commit(store)
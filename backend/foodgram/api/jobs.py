@@ -0,0 +1,134 @@
+"""Очередь фоновых задач в таблице базы данных.
+
+Задачи ставятся в очередь запросами API и выполняются командой
+run_jobs в пуле потоков, внешний брокер не нужен. Задача захватывается
+условным UPDATE, поэтому несколько процессов run_jobs не выполнят её
+дважды. Захват действует JOBS_LEASE секунд: задачу упавшего процесса
+по истечении этого времени заберёт другой. Ошибки повторяются с
+растущей задержкой до JOBS_MAX_ATTEMPTS попыток, завершённые задачи
+удаляются через JOBS_TTL секунд.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from recipes.models import Job
+
+logger = logging.getLogger(__name__)
+
+# Тип задачи и функция, которая её выполняет. Функция получает задачу
+# и возвращает словарь полей для сохранения, например result или
+# status и error, чтобы завершить задачу с ошибкой без повторов.
+HANDLERS = {
+    Job.SHOPPING_LIST: 'api.exports.shopping_list_job',
+    Job.THUMBNAILS: 'api.images.thumbnails_job',
+}
+
+
+def enqueue(kind, key, user=None, params=None):
+    """Постановка задачи в очередь без дублей.
+
+    Если задача того же типа с тем же ключом ещё не выполнена,
+    возвращается она. Если такую задачу одновременно поставил и уже
+    выполнил другой запрос, возвращается выполненная задача.
+    Возвращает кортеж (задача, создана ли).
+    """
+
+    jobs = Job.objects.defer('result').filter(kind=kind, key=key)
+    conflict = False
+    while True:
+        if (job := jobs.filter(status__in=Job.ACTIVE).first()) is not None:
+            return job, False
+        if conflict and (
+            job := jobs.filter(status=Job.DONE).order_by('-pk').first()
+        ) is not None:
+            return job, False
+        try:
+            with transaction.atomic():
+                job = Job.objects.create(
+                    kind=kind, key=key, user=user, params=params or {}
+                )
+        except IntegrityError:
+            # Другой запрос поставил такую же задачу между проверкой
+            # и вставкой, она могла уже завершиться.
+            conflict = True
+            continue
+        return job, True
+
+
+def claim_jobs(limit, kinds=None):
+    """Захват до limit задач, готовых к выполнению.
+
+    Возвращает id захваченных задач.
+    """
+
+    now = timezone.now()
+    ready = Job.objects.filter(status__in=Job.ACTIVE, run_after__lte=now)
+    if kinds:
+        ready = ready.filter(kind__in=kinds)
+    candidates = ready.order_by('run_after').values_list('pk', flat=True)
+    claimed = []
+    for pk in candidates[:limit * 2]:
+        if ready.filter(pk=pk).update(
+            status=Job.RUNNING,
+            attempts=F('attempts') + 1,
+            run_after=now + timedelta(seconds=settings.JOBS_LEASE),
+            updated_at=now,
+        ):
+            claimed.append(pk)
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def finish_job(job, **fields):
+    """Сохранение результата, если задачу не захватил другой процесс."""
+
+    return Job.objects.filter(
+        pk=job.pk, status=Job.RUNNING, attempts=job.attempts
+    ).update(updated_at=timezone.now(), **fields)
+
+
+def process_job(pk):
+    """Выполнение захваченной задачи с повтором при ошибке."""
+
+    close_old_connections()
+    try:
+        job = Job.objects.defer('result').get(pk=pk)
+        if job.attempts > settings.JOBS_MAX_ATTEMPTS:
+            finish_job(
+                job, status=Job.FAILED, error='Превышено число попыток.'
+            )
+            return
+        try:
+            fields = import_string(HANDLERS[job.kind])(job)
+        except Exception as error:
+            logger.exception('Ошибка задачи %s', job.pk)
+            if job.attempts >= settings.JOBS_MAX_ATTEMPTS:
+                finish_job(job, status=Job.FAILED, error=str(error))
+            else:
+                delay = settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1)
+                finish_job(
+                    job,
+                    status=Job.PENDING,
+                    error=str(error),
+                    run_after=timezone.now() + timedelta(seconds=delay),
+                )
+            return
+        finish_job(job, **{'status': Job.DONE, 'error': '', **(fields or {})})
+    finally:
+        close_old_connections()
+
+
+def cleanup_jobs():
+    """Удаление завершённых задач старше JOBS_TTL секунд."""
+
+    deleted, _ = Job.objects.filter(
+        status__in=(Job.DONE, Job.FAILED),
+        updated_at__lt=timezone.now() - timedelta(seconds=settings.JOBS_TTL),
+    ).delete()
+    return deleted
@@ -0,0 +1,175 @@
+"""Проверка количества запросов к базе данных в эндпоинтах API.
+
+Списки запрашиваются с двумя размерами страницы: количество запросов
+не должно зависеть от числа объектов на странице (N+1) и не должно
+превышать бюджета эндпоинта. Кэш карточек рецептов на время проверки
+отключается, чтобы учитывались запросы сборки карточек. Все запросы
+выполняются в транзакции, которая затем откатывается. Базу нужно
+заполнить так, чтобы на большой странице было больше одного объекта.
+"""
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from recipes.models import Ingredient, Recipe, Tag
+from rest_framework.test import APIClient
+from users.models import Subscription, User
+
+CARDS_CACHE_ALIAS = 'check_query_counts'
+SMALL_PAGE = 1
+
+# Метод, адрес и наибольшее допустимое количество запросов.
+ENDPOINTS = (
+    ('get', '/api/recipes/?limit={limit}', 6),
+    ('get', '/api/recipes/?limit={limit}&cursor=', 5),
+    ('get', '/api/recipes/?limit={limit}&tags={tag_slug}', 6),
+    ('get', '/api/recipes/?limit={limit}&author={author}', 7),
+    ('get', '/api/recipes/?limit={limit}&is_favorited=1', 6),
+    ('get', '/api/recipes/?limit={limit}&is_in_shopping_cart=1', 6),
+    ('get', '/api/recipes/?limit={limit}&search={recipe_word}', 6),
+    ('get', '/api/recipes/facets/?limit={limit}', 9),
+    ('get', '/api/recipes/facets/?limit={limit}&tags={tag_slug}', 9),
+    (
+        'get',
+        '/api/recipes/cookable/?limit={limit}&ingredients={ingredient}',
+        7,
+    ),
+    ('get', '/api/recipes/{recipe}/', 6),
+    ('post', '/api/recipes/{recipe}/favorite/', 6),
+    ('delete', '/api/recipes/{recipe}/favorite/', 6),
+    ('post', '/api/recipes/{recipe}/shopping_cart/', 10),
+    ('delete', '/api/recipes/{recipe}/shopping_cart/', 10),
+    ('get', '/api/recipes/download_shopping_cart/', 2),
+    ('post', '/api/recipes/download_shopping_cart/jobs/', 6),
+    ('get', '/api/tags/', 1),
+    ('get', '/api/tags/{tag}/', 1),
+    ('get', '/api/ingredients/?name={ingredient_name}&limit={limit}', 1),
+    ('get', '/api/ingredients/{ingredient}/', 1),
+    ('get', '/api/users/?limit={limit}', 3),
+    ('get', '/api/users/{author}/', 2),
+    ('get', '/api/users/me/', 2),
+    ('get', '/api/users/subscriptions/?limit={limit}&recipes_limit=3', 3),
+    ('post', '/api/users/{author}/subscribe/', 8),
+    ('delete', '/api/users/{author}/subscribe/', 5),
+)
+
+
+def get_objects(user):
+    """Объекты для подстановки в адреса: рецепт не в избранном и не в
+    списке покупок пользователя, автор без подписки пользователя."""
+
+    recipe = Recipe.objects.exclude(favorites__user=user).exclude(
+        purchases_recipe__user=user
+    ).first()
+    author = User.objects.exclude(pk=user.pk).exclude(
+        subscriptions__subscriber=user
+    ).order_by('-recipes_count').first()
+    tag = Tag.objects.first()
+    ingredient = Ingredient.objects.first()
+    if None in (recipe, author, tag, ingredient):
+        raise CommandError('Заполните базу перед проверкой!')
+    return {
+        'recipe': recipe.pk,
+        'author': author.pk,
+        'tag': tag.pk,
+        'tag_slug': tag.slug,
+        'ingredient': ingredient.pk,
+        'ingredient_name': ingredient.name[:2],
+        'recipe_word': recipe.name.split()[0],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Fail if an API endpoint exceeds its query budget or has N+1'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int,
+            help='User id (default: the user with most subscriptions)'
+        )
+        parser.add_argument(
+            '--page-size', type=int, default=20,
+            help='Large page size compared with a page of one object'
+        )
+        parser.add_argument(
+            '--verbose-queries', action='store_true',
+            help='Print queries of failed endpoints'
+        )
+
+    def get_user(self, user_id):
+        if user_id is not None:
+            try:
+                return User.objects.get(pk=user_id)
+            except User.DoesNotExist:
+                raise CommandError(f'Пользователь {user_id} не найден!')
+        subscriber = Subscription.objects.values('subscriber').annotate(
+            count=Count('pk')
+        ).order_by('-count').values_list('subscriber', flat=True).first()
+        if subscriber is None:
+            raise CommandError('Заполните базу перед проверкой!')
+        return User.objects.get(pk=subscriber)
+
+    def count_queries(self, client, method, url):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(client, method)(url)
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{method.upper()} {url}: ответ {response.status_code}.'
+            )
+        return context.captured_queries
+
+    def handle(self, *args, **kwargs):
+        user = self.get_user(kwargs['user'])
+        page_size = kwargs['page_size']
+        if page_size <= SMALL_PAGE:
+            raise CommandError(
+                f'Размер страницы должен быть больше {SMALL_PAGE}!'
+            )
+        client = APIClient()
+        client.force_authenticate(user)
+        caches[CARDS_CACHE_ALIAS] = DummyCache(CARDS_CACHE_ALIAS, {})
+
+        failed = 0
+        with override_settings(
+            ALLOWED_HOSTS=['testserver'],
+            CARDS_CACHE_ALIAS=CARDS_CACHE_ALIAS,
+        ), transaction.atomic():
+            objects = get_objects(user)
+            for method, url, budget in ENDPOINTS:
+                name = f'{method.upper()} {url}'
+                small = self.count_queries(
+                    client, method, url.format(limit=SMALL_PAGE, **objects)
+                )
+                if '{limit}' in url:
+                    large = self.count_queries(
+                        client, method, url.format(limit=page_size, **objects)
+                    )
+                else:
+                    large = small
+                errors = []
+                if len(large) > len(small):
+                    errors.append(
+                        f'N+1: {len(small)} запросов на странице из '
+                        f'{SMALL_PAGE}, {len(large)} из {page_size}'
+                    )
+                if len(large) > budget:
+                    errors.append(
+                        f'{len(large)} запросов при бюджете {budget}'
+                    )
+                if not errors:
+                    self.stdout.write(
+                        self.style.SUCCESS(f'{name}: {len(large)} OK')
+                    )
+                    continue
+                failed += 1
+                self.stderr.write(
+                    self.style.ERROR(f'{name}: {"; ".join(errors)}')
+                )
+                if kwargs['verbose_queries']:
+                    for query in large:
+                        self.stderr.write(f'  {query["sql"]}')
+            transaction.set_rollback(True)
+        if failed:
+            raise CommandError(f'Эндпоинтов с ошибками: {failed}.')
@@ -0,0 +1,107 @@
+"""Проверка планов основных запросов API на чтение таблиц целиком.
+
+Планировщику запрещается последовательное сканирование, поэтому
+Seq Scan в плане означает, что для запроса нет подходящего индекса.
+Без последовательного сканирования планировщик может пройти целиком
+любой индекс таблицы и затем отсортировать строки, такой проход тоже
+считается ошибкой. Результат не зависит от объёма данных в базе, но
+для правдоподобных планов базу лучше заполнить.
+"""
+import json
+
+from api.exports import get_shopping_list
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipes.models import Recipe, Tag
+from users.models import User
+
+INDEX_SCANS = ('Index Scan', 'Index Only Scan')
+SORTS = ('Sort', 'Incremental Sort')
+# Небольшие справочники, которые допустимо читать целиком для соединения.
+REFERENCE_TABLES = ('recipes_ingredient', 'recipes_tag')
+PAGE_SIZE = 6
+
+
+def get_hot_queries(user, tag):
+    feed = Recipe.objects.add_user_annotations(user)
+    return {
+        'Лента рецептов': feed[:PAGE_SIZE],
+        'Лента по тегу': feed.filter(tags__slug=tag.slug)[:PAGE_SIZE],
+        'Рецепты автора': feed.filter(author=user)[:PAGE_SIZE],
+        'Избранное': feed.filter(favorites__user=user)[:PAGE_SIZE],
+        'Список покупок': feed.filter(
+            purchases_recipe__user=user
+        )[:PAGE_SIZE],
+        'Подписки': User.objects.filter(
+            subscriptions__subscriber=user
+        ).order_by('id')[:PAGE_SIZE],
+        'Скачивание списка покупок': get_shopping_list(user),
+    }
+
+
+def find_full_scans(node, sorted_above=False):
+    """Таблицы, прочитанные последовательным сканированием или полным
+    проходом по индексу без условия, результат которого потом
+    сортируется."""
+
+    node_type = node['Node Type']
+    if node_type == 'Seq Scan' or (
+        node_type in INDEX_SCANS
+        and 'Index Cond' not in node
+        and sorted_above
+        and node['Relation Name'] not in REFERENCE_TABLES
+    ):
+        yield f'{node_type} on {node["Relation Name"]}'
+    sorted_above = sorted_above or node_type in SORTS
+    for child in node.get('Plans', ()):
+        yield from find_full_scans(child, sorted_above)
+
+
+def explain(queryset):
+    """План запроса в формате JSON."""
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+class Command(BaseCommand):
+    help = 'Fail if a hot API query reads a whole table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Print full query plans'
+        )
+
+    def handle(self, *args, **kwargs):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Проверка доступна только для PostgreSQL!')
+        user = User.objects.order_by('-followers_count').first()
+        tag = Tag.objects.first()
+        if user is None or tag is None:
+            raise CommandError('Заполните базу перед проверкой!')
+
+        failed = []
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            for name, queryset in get_hot_queries(user, tag).items():
+                scans = sorted(set(find_full_scans(explain(queryset))))
+                if kwargs['verbose_plans']:
+                    self.stdout.write(f'{name}:\n{queryset.explain()}\n')
+                if scans:
+                    failed.append(name)
+                    self.stderr.write(
+                        self.style.ERROR(f'{name}: {", ".join(scans)}')
+                    )
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'{name}: OK'))
+        if failed:
+            raise CommandError(
+                f'Чтение таблиц целиком в запросах: {len(failed)}.'
+            )
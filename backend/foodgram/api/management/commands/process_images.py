@@ -0,0 +1,30 @@
+"""Перекодирование старых изображений рецептов и создание миниатюр."""
+from api.images import make_thumbnails, store_image
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from recipes.images import HASHED_NAME
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Re-encode recipe images and generate missing thumbnails'
+
+    def handle(self, *args, **kwargs):
+        processed = 0
+        for recipe in Recipe.objects.exclude(image='').only('id', 'image'):
+            name = recipe.image.name
+            if HASHED_NAME.match(name):
+                make_thumbnails(name)
+                continue
+            if not default_storage.exists(name):
+                self.stderr.write(
+                    self.style.WARNING(f'Нет файла {name} рецепта {recipe.pk}')
+                )
+                continue
+            with default_storage.open(name) as file:
+                new_name = store_image(file)
+            Recipe.objects.filter(pk=recipe.pk).update(image=new_name)
+            processed += 1
+        self.stdout.write(
+            self.style.SUCCESS(f'Перекодировано изображений: {processed}.')
+        )
@@ -0,0 +1,48 @@
+"""Сверка строк списков покупок с рецептами в списках покупок."""
+from api.cache import invalidate_users
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.carts import repair_cart_lines
+from recipes.models import CartLine, Purchase
+
+
+class Command(BaseCommand):
+    help = 'Check shopping cart lines against purchases and fix mismatches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of users checked per transaction'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report mismatches without fixing them'
+        )
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs['batch_size']
+        dry_run = kwargs['dry_run']
+        if batch_size < 1:
+            raise CommandError('Размер пакета должен быть больше нуля!')
+        user_ids = sorted(
+            set(Purchase.objects.values_list('user_id', flat=True))
+            | set(CartLine.objects.values_list('user_id', flat=True))
+        )
+        created = changed = deleted = 0
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            with transaction.atomic():
+                new, updated, extra = repair_cart_lines(batch, dry_run)
+            if (new or updated or extra) and not dry_run:
+                invalidate_users(batch)
+            created += new
+            changed += updated
+            deleted += extra
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Проверено пользователей: {len(user_ids)}. '
+                f'{"Найдено" if dry_run else "Исправлено"}: '
+                f'недостающих строк {created}, неверных {changed}, '
+                f'лишних {deleted}.'
+            )
+        )
@@ -0,0 +1,669 @@
+"""Замер производительности эндпоинтов API на заполненной базе.
+
+По умолчанию запросы выполняются тестовым клиентом Django через весь
+стек middleware и DRF, но без сети и веб-сервера. С --base-url запросы
+отправляются по HTTP запущенному серверу, например gunicorn в режиме
+wsgi или asgi, с заданным числом одновременных клиентов (--concurrency).
+Для каждого сценария сохраняются перцентили задержки, количество
+запросов к базе данных (только для тестового клиента) и пропускная
+способность. Результат пишется в json, чтобы сравнивать прогоны между
+собой (--compare). Базу удобно заполнить командой seed_benchmark.
+
+С --cart-size замеряется выгрузка списка покупок во всех форматах для
+временного пользователя с заданным числом рецептов в списке покупок,
+без кэша готовых файлов. Кроме задержки сохраняется пик выделенной
+памяти за один запрос (tracemalloc) и пиковый RSS процесса.
+
+С --catalog-size замеряется загрузка синтетического справочника
+ингредиентов заданного размера командой load_data из csv- и json-файла
+каждым доступным способом вставки. Каждая загрузка откатывается.
+"""
+import asyncio
+import csv
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from io import StringIO
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+from api.pagination import FoodgramPagination
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from recipes.carts import repair_cart_lines
+from recipes.models import (CartLine, Ingredient, Purchase, Recipe,
+                            RecipeIngredient, Tag)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import Subscription, User
+
+PERCENTILES = (50, 90, 95, 99)
+# Страницы ленты в сценариях сравнения номеров страниц и курсоров.
+FEED_PAGES = (1, 1000)
+# Длины префикса в сценариях автодополнения ингредиентов.
+SEARCH_LENGTHS = (1, 2, 3, 5, 8)
+EXPORTS_CACHE_ALIAS = 'run_benchmark_exports'
+CART_FORMATS = {
+    'cart_pdf': 'application/pdf',
+    'cart_csv': 'text/csv',
+    'cart_txt': 'text/plain',
+}
+CATALOG_FORMATS = ('.csv', '.json')
+CATALOG_UNITS = ('г', 'мл', 'шт', 'по вкусу')
+# Доля строк синтетического справочника, повторяющих предыдущие.
+CATALOG_DUPLICATES = 0.01
+
+
+def feed_cursor(page):
+    """Курсор страницы page ленты рецептов, как в ссылке next
+    предыдущей страницы."""
+
+    if page == 1:
+        return ''
+    pagination = FoodgramPagination()
+    ordering = pagination.keyset_ordering
+    position = Recipe.objects.order_by(*ordering).values_list(
+        *(name.lstrip('-') for name in ordering)
+    )[(page - 1) * pagination.page_size - 1]
+    return pagination.encode_cursor(position)
+
+
+def get_scenarios(rng):
+    """Сценарии: название и функция, возвращающая адрес и заголовки
+    очередного запроса."""
+
+    recipe_ids = list(
+        Recipe.objects.order_by('?').values_list('id', flat=True)[:1000]
+    )
+    slugs = list(Tag.objects.values_list('slug', flat=True))
+    names = list(
+        Ingredient.objects.order_by('?').values_list('name', flat=True)[:200]
+    )
+    authors = list(
+        User.objects.filter(recipes_count__gt=0)
+        .order_by('?').values_list('id', flat=True)[:200]
+    )
+    words = [
+        name.split()[0] for name in Recipe.objects.order_by('?').values_list(
+            'name', flat=True
+        )[:200]
+    ]
+    pantry = list(
+        RecipeIngredient.objects.values('ingredient').annotate(
+            recipes=Count('pk')
+        ).order_by('-recipes').values_list('ingredient', flat=True)[:100]
+    )
+    pages = max(Recipe.objects.count() // FoodgramPagination.page_size, 1)
+    if not recipe_ids or not slugs or not names or not authors:
+        raise CommandError('Заполните базу перед замером!')
+    return {
+        'feed': lambda: (
+            f'/api/recipes/?page={rng.randint(1, min(pages, 50))}', {}
+        ),
+        'feed_cursor': lambda: ('/api/recipes/?cursor=', {}),
+        **{
+            f'feed_page_{page}': (
+                lambda page=min(page, pages): (
+                    f'/api/recipes/?page={page}', {}
+                )
+            )
+            for page in FEED_PAGES
+        },
+        **{
+            f'feed_cursor_{page}': (
+                lambda cursor=feed_cursor(min(page, pages)): (
+                    f'/api/recipes/?cursor={cursor}', {}
+                )
+            )
+            for page in FEED_PAGES
+        },
+        'feed_tags': lambda: (
+            f'/api/recipes/?tags={rng.choice(slugs)}', {}
+        ),
+        'feed_facets': lambda: (
+            f'/api/recipes/facets/?tags={rng.choice(slugs)}', {}
+        ),
+        'feed_author': lambda: (
+            f'/api/recipes/?author={rng.choice(authors)}', {}
+        ),
+        'feed_favorited': lambda: ('/api/recipes/?is_favorited=1', {}),
+        'feed_in_cart': lambda: ('/api/recipes/?is_in_shopping_cart=1', {}),
+        'feed_not_favorited': lambda: ('/api/recipes/?is_favorited=0', {}),
+        'feed_not_in_cart': lambda: (
+            '/api/recipes/?is_in_shopping_cart=0', {}
+        ),
+        'search': lambda: (f'/api/recipes/?search={rng.choice(words)}', {}),
+        'search_two_words': lambda: (
+            f'/api/recipes/?search={rng.choice(words)}+{rng.choice(words)}',
+            {},
+        ),
+        'cookable': lambda: (
+            '/api/recipes/cookable/?' + '&'.join(
+                f'ingredients={pk}'
+                for pk in rng.sample(pantry, min(len(pantry), 10))
+            ),
+            {},
+        ),
+        'recipe_detail': lambda: (
+            f'/api/recipes/{rng.choice(recipe_ids)}/', {}
+        ),
+        'subscriptions': lambda: (
+            '/api/users/subscriptions/?recipes_limit=3', {}
+        ),
+        'cart_pdf': lambda: (
+            '/api/recipes/download_shopping_cart/',
+            {'HTTP_ACCEPT': 'application/pdf'},
+        ),
+        'cart_txt': lambda: (
+            '/api/recipes/download_shopping_cart/',
+            {'HTTP_ACCEPT': 'text/plain'},
+        ),
+        'ingredient_search': lambda: (
+            '/api/ingredients/?name='
+            f'{rng.choice(names)[:rng.randint(1, 4)]}',
+            {},
+        ),
+        **{
+            f'ingredient_search_{length}': (
+                lambda length=length: (
+                    f'/api/ingredients/?name={rng.choice(names)[:length]}',
+                    {},
+                )
+            )
+            for length in SEARCH_LENGTHS
+        },
+    }
+
+
+def write_catalog(path, size, rng):
+    """Синтетический справочник ингредиентов из size строк в формате
+    load_data, часть строк повторяет уже записанные."""
+
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        if path.suffix == '.json':
+            file.write('[')
+        for row in range(size):
+            number = row
+            if row and rng.random() < CATALOG_DUPLICATES:
+                number = rng.randrange(row)
+            name = f'синтетический ингредиент {number}'
+            unit = CATALOG_UNITS[number % len(CATALOG_UNITS)]
+            if path.suffix == '.csv':
+                writer.writerow((name, unit))
+                continue
+            file.write(',\n' if row else '\n')
+            file.write(
+                json.dumps(
+                    {'name': name, 'measurement_unit': unit},
+                    ensure_ascii=False,
+                )
+            )
+        if path.suffix == '.json':
+            file.write('\n]\n')
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(round(percent / 100 * (len(values) - 1)), len(values) - 1)
+    return values[index]
+
+
+def summarize(latencies, queries, errors, elapsed):
+    latencies_ms = [latency * 1000 for latency in latencies]
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'mean': round(statistics.mean(latencies_ms), 2),
+            **{
+                f'p{percent}': round(percentile(latencies_ms, percent), 2)
+                for percent in PERCENTILES
+            },
+            'max': round(max(latencies_ms), 2),
+        },
+        'queries': {
+            'mean': round(statistics.mean(queries), 2),
+            'max': max(queries),
+        } if queries else None,
+    }
+
+
+def http_headers(headers):
+    """Заголовки в формате тестового клиента (HTTP_ACCEPT) для HTTP."""
+
+    return {
+        name[5:].replace('_', '-').title(): value
+        for name, value in headers.items()
+    }
+
+
+async def http_get(host, port, path, headers):
+    """GET-запрос в отдельном соединении, возвращает код ответа."""
+
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        lines = [
+            f'GET {quote(path, safe="/?&=%")} HTTP/1.1',
+            f'Host: {host}:{port}',
+            'Connection: close',
+            *(f'{name}: {value}' for name, value in headers.items()),
+        ]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+class Command(BaseCommand):
+    help = 'Measure latency, query counts and throughput of API endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=100,
+            help='Measured requests per scenario'
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=10,
+            help='Unmeasured requests per scenario before measuring'
+        )
+        parser.add_argument(
+            '--scenario', action='append',
+            help='Run only the given scenarios (can be repeated)'
+        )
+        parser.add_argument(
+            '--user', type=int,
+            help='User id (default: the user with most purchases)'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--base-url',
+            help='Send HTTP requests to a running server, e.g. '
+                 'http://127.0.0.1:8000'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, action='append',
+            help='Concurrent HTTP clients with --base-url (can be repeated, '
+                 'default: 50)'
+        )
+        parser.add_argument(
+            '--cart-size', type=int, action='append',
+            help='Measure shopping list exports for a cart with this '
+                 'number of recipes instead of the scenarios (can be '
+                 'repeated)'
+        )
+        parser.add_argument(
+            '--catalog-size', type=int, action='append',
+            help='Measure load_data on a synthetic ingredient catalog with '
+                 'this number of rows instead of the scenarios (can be '
+                 'repeated, e.g. 1000000)'
+        )
+        parser.add_argument(
+            '--catalog-runs', type=int, default=3,
+            help='Measured loads per catalog size, format and method'
+        )
+        parser.add_argument(
+            '--catalog-batch-size', type=int, default=1000,
+            help='load_data --batch-size for catalog loads'
+        )
+        parser.add_argument(
+            '--output', help='Write results to this json file'
+        )
+        parser.add_argument(
+            '--compare', help='Previous json results to compare with'
+        )
+
+    def get_user(self, user_id):
+        if user_id is None:
+            user_id = (
+                Purchase.objects.values('user')
+                .annotate(count=Count('pk'))
+                .order_by('-count')
+                .values_list('user', flat=True)
+                .first()
+            )
+        try:
+            return User.objects.get(pk=user_id)
+        except User.DoesNotExist:
+            raise CommandError('Пользователь для замера не найден!')
+
+    def run_scenario(self, client, make_request, count, warmup):
+        for _ in range(warmup):
+            url, headers = make_request()
+            client.get(url, **headers)
+        latencies = []
+        queries = []
+        errors = 0
+        started = time.perf_counter()
+        for _ in range(count):
+            url, headers = make_request()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = client.get(url, **headers)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                latencies.append(time.perf_counter() - start)
+            queries.append(len(context.captured_queries))
+            if response.status_code >= 400:
+                errors += 1
+        return summarize(
+            latencies, queries, errors, time.perf_counter() - started
+        )
+
+    def measure_memory(self, client, url, headers):
+        """Пик памяти, выделенной Python за один запрос, в КиБ."""
+
+        tracemalloc.start()
+        try:
+            response = client.get(url, **headers)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return peak // 1024
+
+    def run_cart_scenarios(self, sizes, rng, count, warmup):
+        """Выгрузки списков покупок из sizes рецептов.
+
+        Пользователи и их списки покупок создаются в транзакции,
+        которая затем откатывается.
+        """
+
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        if len(recipe_ids) < max(sizes):
+            raise CommandError(
+                f'В базе меньше {max(sizes)} рецептов!'
+            )
+        caches[EXPORTS_CACHE_ALIAS] = DummyCache(EXPORTS_CACHE_ALIAS, {})
+        url = '/api/recipes/download_shopping_cart/'
+        results = {}
+        with override_settings(
+            ALLOWED_HOSTS=['testserver'],
+            EXPORTS_CACHE_ALIAS=EXPORTS_CACHE_ALIAS,
+        ), transaction.atomic():
+            for size in sorted(set(sizes)):
+                user = User.objects.create(
+                    username=f'benchmark_cart_{size}',
+                    email=f'benchmark_cart_{size}@example.com',
+                )
+                Purchase.objects.bulk_create(
+                    Purchase(user=user, recipe_id=recipe_id)
+                    for recipe_id in rng.sample(recipe_ids, size)
+                )
+                repair_cart_lines([user.pk])
+                lines = CartLine.objects.filter(user=user).count()
+                client = APIClient()
+                client.force_authenticate(user)
+                for name, accept in CART_FORMATS.items():
+                    headers = {'HTTP_ACCEPT': accept}
+                    result = self.run_scenario(
+                        client, lambda: (url, headers), count, warmup
+                    )
+                    result['cart'] = {'recipes': size, 'lines': lines}
+                    result['peak_memory_kb'] = self.measure_memory(
+                        client, url, headers
+                    )
+                    result['max_rss_kb'] = resource.getrusage(
+                        resource.RUSAGE_SELF
+                    ).ru_maxrss
+                    results[f'{name}@{size}'] = result
+            transaction.set_rollback(True)
+        return results
+
+    def run_catalog_scenarios(self, sizes, rng, runs, batch_size):
+        """Загрузка синтетических справочников из sizes строк командой
+        load_data, каждая загрузка выполняется в откатываемой
+        транзакции."""
+
+        methods = ['bulk']
+        if connection.vendor == 'postgresql':
+            methods.append('copy')
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for size in sorted(set(sizes)):
+                for suffix in CATALOG_FORMATS:
+                    path = Path(directory) / f'catalog_{size}{suffix}'
+                    write_catalog(path, size, rng)
+                    for method in methods:
+                        durations = []
+                        for _ in range(runs):
+                            with transaction.atomic():
+                                start = time.perf_counter()
+                                call_command(
+                                    'load_data', str(path), method=method,
+                                    batch_size=batch_size, stdout=StringIO(),
+                                )
+                                durations.append(time.perf_counter() - start)
+                                transaction.set_rollback(True)
+                        result = summarize(
+                            durations, None, 0, sum(durations)
+                        )
+                        result['catalog'] = {
+                            'rows': size,
+                            'file_kb': os.path.getsize(path) // 1024,
+                            'method': method,
+                            'batch_size': batch_size,
+                        }
+                        result['rows_per_s'] = round(
+                            size / statistics.median(durations)
+                        )
+                        result['max_rss_kb'] = resource.getrusage(
+                            resource.RUSAGE_SELF
+                        ).ru_maxrss
+                        name = f'load_{suffix[1:]}_{method}@{size}'
+                        results[name] = result
+                    path.unlink()
+        return results
+
+    async def load(self, address, make_request, count, concurrency, headers):
+        """count запросов от concurrency одновременных клиентов."""
+
+        host, port = address
+        requests = iter(range(count))
+        latencies = []
+        errors = 0
+
+        async def client():
+            nonlocal errors
+            for _ in requests:
+                url, extra = make_request()
+                start = time.perf_counter()
+                try:
+                    status = await http_get(
+                        host, port, url, {**headers, **http_headers(extra)}
+                    )
+                except (OSError, ValueError, IndexError):
+                    status = None
+                latencies.append(time.perf_counter() - start)
+                if status is None or status >= 400:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return summarize(
+            latencies, None, errors, time.perf_counter() - started
+        )
+
+    def run_http_scenario(
+        self, address, make_request, count, warmup, concurrency, headers
+    ):
+        if warmup:
+            asyncio.run(
+                self.load(address, make_request, warmup, concurrency, headers)
+            )
+        return asyncio.run(
+            self.load(address, make_request, count, concurrency, headers)
+        )
+
+    def print_comparison(self, results, path):
+        try:
+            with open(path, encoding='utf-8') as file:
+                previous = json.load(file)['scenarios']
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        self.stdout.write(f'Сравнение с {path} (p50, p95, rps):')
+        for name, result in results.items():
+            if name not in previous:
+                continue
+            old = previous[name]
+            changes = []
+            for title, new_value, old_value in (
+                ('p50', result['latency_ms']['p50'],
+                 old['latency_ms']['p50']),
+                ('p95', result['latency_ms']['p95'],
+                 old['latency_ms']['p95']),
+                ('rps', result['rps'], old['rps']),
+            ):
+                change = (
+                    (new_value - old_value) / old_value * 100
+                    if old_value else 0
+                )
+                changes.append(
+                    f'{title} {old_value} -> {new_value} ({change:+.0f}%)'
+                )
+            self.stdout.write(f'  {name}: {", ".join(changes)}')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['requests'] < 1 or kwargs['warmup'] < 0:
+            raise CommandError('Неверное количество запросов!')
+        rng = random.Random(kwargs['seed'])
+        if catalog_sizes := kwargs['catalog_size']:
+            if min(catalog_sizes) < 1 or kwargs['catalog_runs'] < 1:
+                raise CommandError('Неверный размер справочника!')
+            results = self.run_catalog_scenarios(
+                catalog_sizes, rng, kwargs['catalog_runs'],
+                kwargs['catalog_batch_size'],
+            )
+            self.report(results, None, kwargs)
+            return
+        user = self.get_user(kwargs['user'])
+        client = APIClient()
+        client.force_authenticate(user)
+        scenarios = get_scenarios(rng)
+        if selected := kwargs['scenario']:
+            if unknown := set(selected) - set(scenarios):
+                raise CommandError(
+                    f'Неизвестные сценарии: {", ".join(sorted(unknown))}. '
+                    f'Доступны: {", ".join(scenarios)}.'
+                )
+            scenarios = {name: scenarios[name] for name in selected}
+
+        results = {}
+        base_url = kwargs['base_url']
+        if cart_sizes := kwargs['cart_size']:
+            if base_url:
+                raise CommandError(
+                    '--cart-size нельзя использовать с --base-url!'
+                )
+            if min(cart_sizes) < 1:
+                raise CommandError('Неверный размер списка покупок!')
+            results = self.run_cart_scenarios(
+                cart_sizes, rng, kwargs['requests'], kwargs['warmup']
+            )
+        elif base_url:
+            url = urlsplit(base_url)
+            if url.scheme != 'http' or not url.hostname:
+                raise CommandError('Поддерживаются только адреса http://!')
+            address = (url.hostname, url.port or 80)
+            token, _ = Token.objects.get_or_create(user=user)
+            headers = {'Authorization': f'Token {token.key}'}
+            concurrency = kwargs['concurrency'] or [50]
+            if min(concurrency) < 1:
+                raise CommandError('Неверное число клиентов!')
+            for name, make_request in scenarios.items():
+                for clients in concurrency:
+                    results[f'{name}@{clients}'] = self.run_http_scenario(
+                        address, make_request, kwargs['requests'],
+                        kwargs['warmup'], clients, headers,
+                    )
+        else:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                for name, make_request in scenarios.items():
+                    results[name] = self.run_scenario(
+                        client, make_request, kwargs['requests'],
+                        kwargs['warmup'],
+                    )
+        self.report(results, user, kwargs)
+
+    def report(self, results, user, kwargs):
+        """Вывод результатов, запись в json и сравнение с прошлым
+        прогоном."""
+
+        base_url = kwargs['base_url']
+        for name, result in results.items():
+            latency = result['latency_ms']
+            queries = (
+                f', {result["queries"]["mean"]} запросов к базе'
+                if result['queries'] else ''
+            )
+            memory = (
+                f', пик памяти {result["peak_memory_kb"]} КиБ, '
+                f'RSS {result["max_rss_kb"]} КиБ'
+                if 'peak_memory_kb' in result else ''
+            )
+            if 'rows_per_s' in result:
+                self.stdout.write(
+                    f'{name}: p50 {latency["p50"]} мс, '
+                    f'{result["rows_per_s"]} строк/с, '
+                    f'RSS {result["max_rss_kb"]} КиБ'
+                )
+                continue
+            self.stdout.write(
+                f'{name}: p50 {latency["p50"]} мс, p99 {latency["p99"]} мс, '
+                f'{result["rps"]} запросов/с, ошибок {result["errors"]}'
+                f'{queries}{memory}'
+            )
+
+        report = {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'cache': settings.CACHES['default']['BACKEND'],
+                'debug': settings.DEBUG,
+                'base_url': base_url,
+            },
+            'dataset': {
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'subscriptions': Subscription.objects.count(),
+                'purchases': Purchase.objects.count(),
+            },
+            'parameters': {
+                'requests': kwargs['requests'],
+                'warmup': kwargs['warmup'],
+                'user': user.pk if user else None,
+                'seed': kwargs['seed'],
+                'concurrency': kwargs['concurrency'],
+                'cart_sizes': kwargs['cart_size'],
+                'catalog_sizes': kwargs['catalog_size'],
+                'catalog_runs': kwargs['catalog_runs'],
+            },
+            'scenarios': results,
+        }
+        if kwargs['output']:
+            with open(kwargs['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(
+                self.style.SUCCESS(f'Результаты записаны в {kwargs["output"]}')
+            )
+        if kwargs['compare']:
+            self.print_comparison(results, kwargs['compare'])
@@ -0,0 +1,86 @@
+"""Выполнение фоновых задач из очереди в базе данных.
+
+Команда захватывает готовые задачи и выполняет их в пуле потоков,
+периодически удаляя устаревшие. Можно запустить несколько процессов,
+в том числе на разных машинах с общей базой. SIGTERM и Ctrl+C
+завершают работу после выполнения начатых задач.
+"""
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from api.jobs import claim_jobs, cleanup_jobs, process_job
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from recipes.models import Job
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs (shopping list exports, thumbnails)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.JOBS_WORKERS,
+            help='Threads executing jobs'
+        )
+        parser.add_argument(
+            '--kind', action='append',
+            choices=[kind for kind, _ in Job.KINDS],
+            help='Run only jobs of the given kinds (can be repeated)'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit when there are no ready jobs'
+        )
+
+    def handle(self, *args, **kwargs):
+        workers = kwargs['workers']
+        if workers < 1:
+            raise CommandError('Количество потоков должно быть больше нуля!')
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stop.set())
+
+        processed = 0
+        running = set()
+        next_cleanup = 0
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='jobs'
+        ) as executor:
+            while not stop.is_set():
+                close_old_connections()
+                if time.monotonic() >= next_cleanup:
+                    if deleted := cleanup_jobs():
+                        self.stdout.write(f'Удалено задач: {deleted}')
+                    next_cleanup = (
+                        time.monotonic() + settings.JOBS_CLEANUP_INTERVAL
+                    )
+                if len(running) < workers:
+                    running.update(
+                        executor.submit(process_job, pk)
+                        for pk in claim_jobs(
+                            workers - len(running), kwargs['kind']
+                        )
+                    )
+                if kwargs['once'] and not running:
+                    break
+                if running:
+                    done, running = wait(
+                        running,
+                        timeout=settings.JOBS_POLL_INTERVAL,
+                        return_when=FIRST_COMPLETED,
+                    )
+                    processed += len(done)
+                    for future in done:
+                        if error := future.exception():
+                            self.stderr.write(
+                                self.style.ERROR(f'Ошибка очереди: {error}')
+                            )
+                else:
+                    stop.wait(settings.JOBS_POLL_INTERVAL)
+            processed += len(running)
+        self.stdout.write(
+            self.style.SUCCESS(f'Выполнено задач: {processed}.')
+        )
@@ -0,0 +1,86 @@
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from recipes.catalog import get_catalog_version
+
+from .executors import call_view_async
+
+
+class ConditionalCatalogMixin:
+    """Условные GET-запросы к справочникам.
+
+    ETag строится из версии справочника и адреса запроса, поэтому
+    ответ 304 отдаётся без обращений к базе данных. Представление
+    должно отдавать только JSON: ETag не зависит от формата ответа.
+    """
+
+    catalog = None
+
+    def perform_authentication(self, request):
+        """Справочники доступны всем, пользователь определяется лениво."""
+
+    def get_etag(self, request):
+        version = get_catalog_version(self.catalog)
+        return quote_etag(
+            hashlib.sha256(
+                f'{version}:{request.get_full_path()}'.encode()
+            ).hexdigest()
+        )
+
+    def conditional(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if not 200 <= response.status_code < 300:
+                return response
+            response['ETag'] = etag
+        patch_cache_control(
+            response, public=True, max_age=settings.CATALOG_CACHE_MAX_AGE
+        )
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+
+class AsyncReadMixin:
+    """Асинхронное представление для ASGI-режима.
+
+    Действия async_actions выполняются в ограниченном пуле потоков
+    чтения, поэтому долгие изменяющие запросы и выгрузки не занимают
+    потоки, нужные для чтения. Остальные запросы обрабатываются как
+    обычно. В WSGI-режиме представление остаётся синхронным.
+    """
+
+    async_actions = ('list', 'retrieve')
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        read_methods = {
+            method.upper() for method, action in actions.items()
+            if action in cls.async_actions
+        }
+        if 'GET' in read_methods:
+            read_methods.add('HEAD')
+        if settings.SERVER_MODE != 'asgi' or not read_methods:
+            return view
+
+        async def async_view(request, *args, **kwargs):
+            if request.method in read_methods:
+                return await call_view_async(view, request, *args, **kwargs)
+            return await sync_to_async(view)(request, *args, **kwargs)
+
+        for name in ('cls', 'initkwargs', 'actions', 'csrf_exempt'):
+            if hasattr(view, name):
+                setattr(async_view, name, getattr(view, name))
+        async_view.__name__ = view.__name__
+        async_view.__doc__ = view.__doc__
+        return async_view
@@ -1,6 +1,117 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ParseError
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class FoodgramPagination(PageNumberPagination):
+    """Постраничная пагинация с курсорным режимом по запросу.
+
+    Если в запросе есть параметр cursor (для первой страницы пустой),
+    страница выбирается по ключу сортировки вью keyset_ordering без
+    OFFSET и без подсчёта общего количества объектов. Повреждённый
+    курсор и курсор для списка с другой сортировкой, например по
+    релевантности поиска, - ошибка 400.
+    """
+
+    page_size_query_param = 'limit'
+    page_size = 6
+    cursor_query_param = 'cursor'
+    keyset_ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Неверный курсор.'
+    ordered_cursor_message = (
+        'Курсор недоступен для списка с другой сортировкой.'
+    )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.ordering = getattr(view, 'keyset_ordering', self.keyset_ordering)
+        page_size = self.get_page_size(request)
+        if queryset.query.order_by and (
+            tuple(queryset.query.order_by) != tuple(self.ordering)
+        ):
+            raise ParseError(self.ordered_cursor_message)
+        queryset = queryset.order_by(*self.ordering)
+        if position := self.decode_cursor(request, queryset.model):
+            queryset = queryset.filter(self.keyset_filter(position))
+        results = list(queryset[:page_size + 1])
+        self.next_position = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            self.next_position = [
+                getattr(results[-1], name.lstrip('-'))
+                for name in self.ordering
+            ]
+        return results
+
+    def keyset_filter(self, position):
+        """Условие (a, b) < (x, y) для ключа сортировки с учётом
+        направления каждого поля."""
+
+        condition = Q()
+        equal = Q()
+        for name, value in zip(self.ordering, position):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def decode_cursor(self, request, model):
+        cursor = request.query_params[self.cursor_query_param]
+        if not cursor:
+            return None
+        try:
+            values = json.loads(urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                model._meta.get_field(name.lstrip('-')).to_python(value)
+                for name, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, ValidationError, BinasciiError):
+            raise ParseError(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        values = [
+            value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in position
+        ]
+        return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position),
+        )
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+
+class RankingPagination(PageNumberPagination):
+    """Постраничная пагинация списков, упорядоченных по релевантности,
+    для которых курсор по ключу сортировки не подходит."""
+
     page_size_query_param = 'limit'
     page_size = 6
@@ -0,0 +1,53 @@
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Рендерер формата списка покупок.
+
+    Сам список отдаётся потоком из вью, а ответы с ошибками
+    RecipeViewSet переключает на JSONRenderer.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data)
+
+
+class PDFRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+
+class CSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class TXTRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class ShoppingListNegotiation(DefaultContentNegotiation):
+    """Выбор формата списка покупок по заголовку Accept.
+
+    Если клиент не принимает ни один из форматов, например
+    присылает Accept: application/json, список отдаётся в первом
+    формате (pdf), как до появления выбора формата.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except NotAcceptable:
+            return renderers[0], renderers[0].media_type
+
+
+SHOPPING_LIST_RENDERERS = {
+    renderer.format: renderer
+    for renderer in (PDFRenderer, CSVRenderer, TXTRenderer)
+}
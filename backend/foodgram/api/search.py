@@ -0,0 +1,224 @@
+"""Поиск рецептов по названию, тексту и названиям ингредиентов.
+
+В PostgreSQL используется полнотекстовый поиск по полю search_vector
+(recipes.search). В других базах данных, например в SQLite при
+тестовых запусках, поиск выполняется по инвертированному индексу
+в памяти процесса.
+"""
+import heapq
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, IntegerField, Value, When
+from recipes.catalog import (RECIPE_SEARCH_CATALOG, bump_catalog_version,
+                             get_catalog_version)
+from recipes.models import Recipe, RecipeIngredient
+from recipes.search import (full_text_search, is_supported,
+                            update_search_vectors)
+
+WORD = re.compile(r'\w+')
+# Окончания, отбрасываемые при грубом стемминге русских слов.
+ENDINGS = tuple(sorted(
+    (
+        'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+        'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ой', 'ей', 'ий', 'ый', 'ом',
+        'ем', 'ам', 'ям', 'ах', 'ях', 'ую', 'юю', 'ов', 'ев', 'ью',
+        'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+    ),
+    key=len,
+    reverse=True,
+))
+MIN_STEM_LENGTH = 3
+# Веса полей, как веса A, B и C по умолчанию в ts_rank.
+WEIGHTS = {'name': 1.0, 'ingredients': 0.4, 'text': 0.2}
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    for ending in ENDINGS:
+        if (
+            word.endswith(ending)
+            and len(word) - len(ending) >= MIN_STEM_LENGTH
+        ):
+            return word[:-len(ending)]
+    return word
+
+
+def terms(text):
+    return [stem(word) for word in WORD.findall(text or '')]
+
+
+class RecipeSearchIndex:
+    """Инвертированный индекс рецептов в памяти процесса.
+
+    Для каждой основы слова хранится вес рецептов, в полях которых
+    она встречается. Индекс строится при первом обращении, изменённые
+    рецепты переиндексируются по одному со сменой версии поиска.
+    Весь индекс перестраивается, если версию сменил другой процесс
+    или команда update_search_vectors, и по истечении
+    RECIPE_SEARCH_INDEX_TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = None
+        self._recipe_terms = None
+        self._version = None
+        self._built_at = 0
+
+    def invalidate(self):
+        self._postings = None
+
+    def load(self, recipe_ids=None):
+        """Поля рецептов: {id: {поле: текст}}."""
+
+        recipes = Recipe.objects.order_by()
+        ingredients = RecipeIngredient.objects.order_by()
+        if recipe_ids is not None:
+            recipes = recipes.filter(pk__in=recipe_ids)
+            ingredients = ingredients.filter(recipe_id__in=recipe_ids)
+        documents = {
+            pk: {'name': name, 'text': text, 'ingredients': []}
+            for pk, name, text in recipes.values_list(
+                'id', 'name', 'text'
+            ).iterator()
+        }
+        for recipe_id, name in ingredients.values_list(
+            'recipe_id', 'ingredient__name'
+        ).iterator():
+            if recipe_id in documents:
+                documents[recipe_id]['ingredients'].append(name)
+        return documents
+
+    def add(self, recipe_id, document):
+        scores = defaultdict(float)
+        for field, weight in WEIGHTS.items():
+            value = document[field]
+            if field == 'ingredients':
+                value = ' '.join(value)
+            for term in terms(value):
+                scores[term] += weight
+        for term, score in scores.items():
+            self._postings[term][recipe_id] = score
+        self._recipe_terms[recipe_id] = tuple(scores)
+
+    def discard(self, recipe_id):
+        for term in self._recipe_terms.pop(recipe_id, ()):
+            postings = self._postings[term]
+            postings.pop(recipe_id, None)
+            if not postings:
+                del self._postings[term]
+
+    def build(self):
+        self._postings = defaultdict(dict)
+        self._recipe_terms = {}
+        for recipe_id, document in self.load().items():
+            self.add(recipe_id, document)
+        self._built_at = time.monotonic()
+
+    def update(self, recipe_ids):
+        """Переиндексация изменённых и удаление удалённых рецептов.
+
+        Индекс получает новую версию, только если был построен по
+        предыдущей, иначе он пропустил чужие изменения и перестроится
+        при следующем поиске.
+        """
+
+        documents = self.load(recipe_ids)
+        previous, version = bump_catalog_version(RECIPE_SEARCH_CATALOG)
+        with self._lock:
+            if self._postings is None:
+                return
+            for recipe_id in recipe_ids:
+                self.discard(recipe_id)
+                if recipe_id in documents:
+                    self.add(recipe_id, documents[recipe_id])
+            if self._version == previous:
+                self._version = version
+
+    def search(self, value, limit, recipe_ids=None):
+        """id наиболее релевантных рецептов, содержащих все слова.
+
+        Если передано множество recipe_ids, выбираются только
+        рецепты из него.
+        """
+
+        query = set(terms(value))
+        if not query:
+            return []
+        version = get_catalog_version(RECIPE_SEARCH_CATALOG)
+        with self._lock:
+            if self._postings is None or self._version != version or (
+                time.monotonic() - self._built_at
+                > settings.RECIPE_SEARCH_INDEX_TTL
+            ):
+                self.build()
+                self._version = version
+            postings = sorted(
+                (self._postings.get(term, {}) for term in query), key=len
+            )
+            scores = {
+                recipe_id: sum(posting[recipe_id] for posting in postings)
+                for recipe_id in postings[0]
+                if (recipe_ids is None or recipe_id in recipe_ids)
+                and all(recipe_id in posting for posting in postings[1:])
+            }
+        return heapq.nlargest(
+            limit, scores, key=lambda recipe_id: (scores[recipe_id], recipe_id)
+        )
+
+
+recipe_index = RecipeSearchIndex()
+
+
+def search_recipes(queryset, value):
+    """Рецепты, подходящие под поисковый запрос, в порядке релевантности.
+
+    В индексе в памяти учитываются только RECIPE_SEARCH_MAX_RESULTS
+    самых релевантных рецептов из уже отфильтрованного queryset.
+    """
+
+    if is_supported():
+        return full_text_search(queryset, value)
+    candidates = None
+    if queryset.query.has_filters():
+        candidates = set(queryset.order_by().values_list('pk', flat=True))
+    recipe_ids = recipe_index.search(
+        value, settings.RECIPE_SEARCH_MAX_RESULTS, candidates
+    )
+    if not recipe_ids:
+        return queryset.none()
+    return queryset.filter(pk__in=recipe_ids).annotate(
+        search_rank=Case(
+            *(
+                When(pk=recipe_id, then=Value(-position))
+                for position, recipe_id in enumerate(recipe_ids)
+            ),
+            output_field=IntegerField(),
+        )
+    ).order_by('-search_rank')
+
+
+def reindex_recipes(recipe_ids):
+    """Обновление поиска по рецептам после фиксации транзакции."""
+
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    if is_supported():
+        transaction.on_commit(lambda: update_search_vectors(recipe_ids))
+    else:
+        transaction.on_commit(lambda: recipe_index.update(recipe_ids))
+
+
+def unindex_recipes(recipe_ids):
+    """Удаление рецептов из индекса в памяти, поисковый вектор
+    в PostgreSQL удаляется вместе со строкой рецепта."""
+
+    if not is_supported():
+        recipe_ids = list(recipe_ids)
+        transaction.on_commit(lambda: recipe_index.update(recipe_ids))
@@ -1,13 +1,26 @@
-import base64
+from collections import OrderedDict
 
 import djoser.serializers
-from django.core.files.base import ContentFile
+from django.conf import settings
 from django.core.validators import MinValueValidator
-from recipes.models import (MIN_AMOUNT, MIN_COOKING_TIME, Ingredient, Recipe,
-                            RecipeIngredient, Tag)
+from django.db import transaction
+from django.db.models import Manager
+from django.urls import reverse
+from recipes.bulk import bulk_changes
+from recipes.carts import change_recipe_in_carts
+from recipes.images import thumbnail_url
+from recipes.models import (MIN_AMOUNT, MIN_COOKING_TIME, Ingredient, Job,
+                            Recipe, RecipeIngredient, Tag)
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 from users.models import Subscription, User
 
+from .cache import get_cards, invalidate_recipe_carts, set_cards
+from .cookable import update_cookable
+from .executors import run_cpu
+from .exports import EXPORTS
+from .images import decode_base64_image, prepare_image, store_recipe_image
+
 
 class CreateUserSerializer(djoser.serializers.UserCreateSerializer):
     """Сериализатор для создания пользователя."""
@@ -38,17 +51,33 @@ class UserSerializer(serializers.ModelSerializer):
             'first_name',
             'last_name',
             'is_subscribed',
+            'recipes_count',
+            'followers_count',
         )
+        read_only_fields = ('recipes_count', 'followers_count')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         return (
             request.user.is_authenticated
-            and Subscription.objects.filter(
-                subscriber=request.user, subscriptions=obj
-            ).exists()
+            and obj.id in self.get_subscriptions(request.user)
         )
 
+    def get_subscriptions(self, user):
+        """Множество id авторов, на которых подписан пользователь.
+        Загружается один раз и хранится в контексте на время запроса."""
+
+        context = self.context
+        if 'subscriptions' not in context:
+            context['subscriptions'] = set(
+                Subscription.objects.filter(subscriber=user).values_list(
+                    'subscriptions_id', flat=True
+                )
+            )
+        return context['subscriptions']
+
 
 class TagSerializer(serializers.ModelSerializer):
     """Сериализатор для работы с тегами."""
@@ -81,10 +110,67 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
+def resolve_in_bulk(queryset, pks):
+    """Получение объектов по списку id одним запросом.
+
+    Возвращает объекты в порядке переданных id, о всех
+    несуществующих id сообщает одной ошибкой валидации.
+    """
+
+    try:
+        pks = [int(pk) for pk in pks]
+    except (TypeError, ValueError):
+        raise serializers.ValidationError('Id должны быть целыми числами!')
+    objects = queryset.in_bulk(set(pks))
+    if missing := sorted({pk for pk in pks if pk not in objects}):
+        raise serializers.ValidationError(
+            f'Объекты с id {missing} не существуют!'
+        )
+    return [objects[pk] for pk in pks]
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Список связанных объектов, получаемых одним запросом."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return resolve_in_bulk(self.child_relation.get_queryset(), data)
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Поле id, которое при many=True проверяет все id одним запросом."""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+
+class AddIngredientListSerializer(serializers.ListSerializer):
+    """Список ингредиентов рецепта: все id проверяются одним запросом
+    и заменяются объектами ингредиентов."""
+
+    def to_internal_value(self, data):
+        ingredients = super().to_internal_value(data)
+        objects = resolve_in_bulk(
+            Ingredient.objects.all(),
+            [ingredient['id'] for ingredient in ingredients],
+        )
+        for ingredient, obj in zip(ingredients, objects):
+            ingredient['id'] = obj
+        return ingredients
+
+
 class AddIngredientSerializer(serializers.ModelSerializer):
     """Сериализатор для поля ingredients при создании рецепта"""
 
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(
         validators=[MinValueValidator(MIN_AMOUNT)]
     )
@@ -92,21 +178,104 @@ class AddIngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = RecipeIngredient
         fields = ('id', 'amount')
+        list_serializer_class = AddIngredientListSerializer
 
 
 class Base64ImageField(serializers.ImageField):
-    """Сериализатор для изображений."""
+    """Сериализатор для изображений.
+
+    Изображение перекодируется, но не сохраняется: в validated_data
+    передаётся UploadedImage, который сериализатор рецепта записывает
+    в хранилище после фиксации транзакции.
+    """
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = run_cpu(decode_base64_image, data)
+        return prepare_image(super().to_internal_value(data))
+
+
+class ThumbnailsField(serializers.Field):
+    """Адреса миниатюр изображения рецепта всех размеров."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = 'image'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, image):
+        request = self.context.get('request')
+        thumbnails = {}
+        for size_name in settings.IMAGE_THUMBNAILS:
+            url = thumbnail_url(image, size_name)
+            if url and request is not None:
+                url = request.build_absolute_uri(url)
+            thumbnails[size_name] = url
+        return thumbnails
+
+
+class RecipeCardSerializer(serializers.ModelSerializer):
+    """Общая для всех пользователей часть карточки рецепта.
+
+    Сериализуется без запроса, адреса изображений относительные.
+    """
+
+    tags = TagSerializer(many=True, read_only=True)
+    ingredients = RecipeIngredientSerializer(
+        many=True,
+        read_only=True,
+        source='recipeingredients'
+    )
+    image = serializers.ImageField(read_only=True)
+    thumbnails = ThumbnailsField()
+
+    class Meta:
+        model = Recipe
+        fields = (
+            'id',
+            'tags',
+            'ingredients',
+            'name',
+            'image',
+            'thumbnails',
+            'text',
+            'cooking_time',
+        )
+
+
+def load_cards(recipe_ids):
+    """Карточки рецептов из кэша, недостающие собираются общими
+    запросами для всех рецептов и сохраняются в кэш."""
+
+    cards = get_cards(recipe_ids)
+    if missing := [pk for pk in recipe_ids if pk not in cards]:
+        recipes = (
+            Recipe.objects.card_data().filter(pk__in=missing).order_by()
+        )
+        built = {
+            recipe.pk: RecipeCardSerializer(recipe).data
+            for recipe in recipes
+        }
+        set_cards(built)
+        cards.update(built)
+    return cards
+
 
-        return super().to_internal_value(data)
+class ReadRecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов: карточки всей страницы загружаются вместе."""
+
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, Manager) else data)
+        self.child.cards = load_cards([recipe.pk for recipe in recipes])
+        return [self.child.to_representation(recipe) for recipe in recipes]
 
 
 class ReadRecipeSerializer(serializers.ModelSerializer):
-    """Сериализатор для чтения рецептов."""
+    """Сериализатор для чтения рецептов.
+
+    Общая часть берётся из кэша карточек, поверх неё добавляются
+    автор, счётчики и признаки избранного и списка покупок.
+    """
 
     tags = TagSerializer(many=True, read_only=True)
     author = UserSerializer(read_only=True)
@@ -116,6 +285,7 @@ class ReadRecipeSerializer(serializers.ModelSerializer):
         source='recipeingredients'
     )
     image = Base64ImageField(required=True)
+    thumbnails = ThumbnailsField()
     is_favorited = serializers.BooleanField(
         default=False,
         required=False
@@ -136,15 +306,51 @@ class ReadRecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'thumbnails',
             'text',
             'cooking_time',
+            'favorites_count',
+            'in_carts_count',
         )
+        read_only_fields = ('favorites_count', 'in_carts_count')
+        list_serializer_class = ReadRecipeListSerializer
+
+    def get_card(self, instance):
+        cards = getattr(self, 'cards', {})
+        if instance.pk not in cards:
+            cards = load_cards([instance.pk])
+        return cards[instance.pk]
+
+    def absolute_url(self, url):
+        request = self.context.get('request')
+        if url and request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    def to_representation(self, instance):
+        card = self.get_card(instance)
+        data = OrderedDict()
+        for field in self._readable_fields:
+            if field.field_name in card:
+                data[field.field_name] = card[field.field_name]
+                continue
+            attribute = field.get_attribute(instance)
+            data[field.field_name] = (
+                None if attribute is None
+                else field.to_representation(attribute)
+            )
+        data['image'] = self.absolute_url(data['image'])
+        data['thumbnails'] = {
+            size_name: self.absolute_url(url)
+            for size_name, url in data['thumbnails'].items()
+        }
+        return data
 
 
 class WriteRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для создания/редактирования рецептов."""
 
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = BulkPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all(),
     )
@@ -199,32 +405,82 @@ class WriteRecipeSerializer(serializers.ModelSerializer):
         return data
 
     @staticmethod
-    def create_update_ingredients(ingredients, recipe):
+    def create_update_ingredients(ingredients, recipe, existing=None):
+        """Запись ингредиентов рецепта по разнице с уже сохранёнными:
+        новые создаются одним запросом, изменённые обновляются,
+        лишние удаляются, остальные не затрагиваются.
+        При обновлении (existing не None) разница переносится в списки
+        покупок с этим рецептом, даже если ингредиентов у него не было."""
+
+        updating = existing is not None
+        existing = {row.ingredient_id: row for row in existing or ()}
+        new_rows = []
+        changed_rows = []
+        deltas = {}
         for ingredient in ingredients:
-            ingredient_id = ingredient.get('id')
-            amount = ingredient.get('amount')
-            RecipeIngredient.objects.update_or_create(
-                ingredient=ingredient_id, recipe=recipe, amount=amount
-            )
+            ingredient_id = ingredient['id'].id
+            amount = ingredient['amount']
+            row = existing.pop(ingredient_id, None)
+            if row is None:
+                new_rows.append(
+                    RecipeIngredient(
+                        recipe=recipe, ingredient_id=ingredient_id,
+                        amount=amount
+                    )
+                )
+                deltas[ingredient_id] = amount
+            elif row.amount != amount:
+                deltas[ingredient_id] = amount - row.amount
+                row.amount = amount
+                changed_rows.append(row)
+        if existing:
+            for row in existing.values():
+                deltas[row.ingredient_id] = -row.amount
+            with bulk_changes():
+                RecipeIngredient.objects.filter(
+                    pk__in=[row.pk for row in existing.values()]
+                ).delete()
+        if changed_rows:
+            RecipeIngredient.objects.bulk_update(changed_rows, ('amount',))
+        if new_rows:
+            RecipeIngredient.objects.bulk_create(new_rows)
+        if existing or changed_rows or new_rows:
+            invalidate_recipe_carts(recipe.id)
+        if updating:
+            change_recipe_in_carts(recipe.id, deltas)
+        update_cookable(
+            recipe.id, [ingredient['id'].id for ingredient in ingredients]
+        )
 
+    @transaction.atomic
     def create(self, validated_data):
         request = self.context.get('request')
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        recipe = Recipe.objects.create(**validated_data, author=request.user)
+        image = validated_data.pop('image')
+        recipe = Recipe.objects.create(
+            **validated_data, image=image.name, author=request.user
+        )
         recipe.tags.set(tags)
         self.create_update_ingredients(ingredients, recipe)
+        store_recipe_image(recipe, image)
+        recipe.author.refresh_from_db(
+            fields=('recipes_count', 'followers_count')
+        )
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
-        instance.tags.clear()
         instance.tags.set(tags)
         ingredients = validated_data.pop('ingredients')
-        instance.ingredients.clear()
-        self.create_update_ingredients(ingredients, instance)
+        self.create_update_ingredients(
+            ingredients, instance, instance.recipeingredients.all()
+        )
         instance.author = validated_data.get('author', instance.author)
-        instance.image = validated_data.get('image', instance.image)
+        if image := validated_data.get('image'):
+            instance.image = image.name
+            store_recipe_image(instance, image)
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
         instance.cooking_time = validated_data.get(
@@ -238,25 +494,75 @@ class WriteRecipeSerializer(serializers.ModelSerializer):
 
 
 class SimplyRecipeSerializer(serializers.ModelSerializer):
+    thumbnails = ThumbnailsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'thumbnails', 'cooking_time')
 
 
 class SubscribeSerializer(UserSerializer):
     """Сериализатор для работы с подписками."""
 
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta(UserSerializer.Meta):
         model = User
-        fields = UserSerializer.Meta.fields + ('recipes', 'recipes_count')
+        fields = UserSerializer.Meta.fields + ('recipes',)
 
     def get_recipes(self, obj):
-        recipes = Recipe.objects.filter(author=obj)
+        if hasattr(obj, 'limited_recipes'):
+            recipes = obj.limited_recipes
+        else:
+            recipes = obj.recipes.all()
+            recipes_limit = self.context.get('recipes_limit')
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
         serializers = SimplyRecipeSerializer(recipes, many=True)
         return serializers.data
 
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
+
+class CookableQuerySerializer(serializers.Serializer):
+    """Сериализатор ингредиентов, имеющихся у пользователя."""
+
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.COOKABLE_MAX_INGREDIENTS,
+    )
+
+
+class ShoppingListJobCreateSerializer(serializers.Serializer):
+    """Сериализатор параметров формирования списка покупок."""
+
+    format = serializers.ChoiceField(choices=tuple(EXPORTS), default='pdf')
+
+
+class ShoppingListJobSerializer(serializers.ModelSerializer):
+    """Сериализатор задачи формирования списка покупок."""
+
+    format = serializers.CharField(source='params.format')
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = (
+            'id',
+            'status',
+            'format',
+            'attempts',
+            'error',
+            'created_at',
+            'updated_at',
+            'download',
+        )
+
+    def get_download(self, obj):
+        if obj.status != Job.DONE:
+            return None
+        return self.context['request'].build_absolute_uri(
+            reverse(
+                'api:recipes-shopping_cart_job_download',
+                kwargs={'job_id': obj.pk},
+            )
+        )
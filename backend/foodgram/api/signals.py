@@ -0,0 +1,263 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from recipes.bulk import in_bulk_block
+from recipes.carts import (add_cart_lines, recipe_amounts, recipe_buyers,
+                           recipe_buyers_query, subtract_cart_lines)
+from recipes.catalog import bump_catalog_version
+from recipes.counters import change_counter
+from recipes.models import (CartLine, Favorite, Ingredient, Purchase, Recipe,
+                            RecipeIngredient, Tag)
+from rest_framework.authtoken.models import Token
+from users.models import Subscription, User
+
+from .authentication import token_cache
+from .autocomplete import ingredient_index
+from .cache import invalidate_cards, invalidate_recipe_carts, invalidate_users
+from .cookable import refresh_cookable
+from .search import reindex_recipes, unindex_recipes
+
+
+@receiver((post_save, post_delete), sender=Purchase)
+def purchase_changed(sender, instance, **kwargs):
+    """Сброс кэша списка покупок пользователя."""
+
+    invalidate_users([instance.user_id])
+
+
+# Модель, поле ссылки на объект со счётчиком, модель и поле счётчика.
+COUNTERS = {
+    Favorite: ('favorites_id', Recipe, 'favorites_count'),
+    Purchase: ('recipe_id', Recipe, 'in_carts_count'),
+    Recipe: ('author_id', User, 'recipes_count'),
+    Subscription: ('subscriptions_id', User, 'followers_count'),
+}
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=Purchase)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Subscription)
+def counted_object_saved(sender, instance, created, **kwargs):
+    """Увеличение счётчика при создании объекта, в том числе
+    из админки."""
+
+    if created and not in_bulk_block():
+        field, model, counter = COUNTERS[sender]
+        change_counter(model, getattr(instance, field), counter, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=Purchase)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Subscription)
+def counted_object_deleted(sender, instance, **kwargs):
+    """Уменьшение счётчика при удалении объекта, в том числе
+    каскадном."""
+
+    if not in_bulk_block():
+        field, model, counter = COUNTERS[sender]
+        change_counter(model, getattr(instance, field), counter, -1)
+
+
+@receiver(post_save, sender=Purchase)
+def purchase_saved(sender, instance, created, **kwargs):
+    """Добавление ингредиентов рецепта в список покупок."""
+
+    if created and not in_bulk_block():
+        add_cart_lines([instance.user_id], recipe_amounts(instance.recipe_id))
+
+
+@receiver(post_delete, sender=Purchase)
+def purchase_deleted(sender, instance, **kwargs):
+    """Вычитание ингредиентов рецепта из списка покупок.
+
+    При каскадном удалении рецепта вычитаются только ещё не удалённые
+    ингредиенты, остальные вычел сигнал удаления RecipeIngredient.
+    """
+
+    if not in_bulk_block():
+        subtract_cart_lines(
+            [instance.user_id], recipe_amounts(instance.recipe_id)
+        )
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def recipe_ingredient_saving(sender, instance, **kwargs):
+    """Запоминание сохранённой строки, чтобы перенести правку
+    из админки в списки покупок."""
+
+    instance.saved_row = None
+    if instance.pk is not None and not in_bulk_block():
+        instance.saved_row = RecipeIngredient.objects.filter(
+            pk=instance.pk
+        ).values_list('recipe_id', 'ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def recipe_ingredient_saved_to_carts(sender, instance, **kwargs):
+    """Замена старой строки новой в списках покупок с рецептом."""
+
+    if in_bulk_block():
+        return
+    if saved_row := getattr(instance, 'saved_row', None):
+        recipe_id, ingredient_id, amount = saved_row
+        subtract_cart_lines(
+            recipe_buyers_query(recipe_id), {ingredient_id: amount}
+        )
+    add_cart_lines(
+        recipe_buyers(instance.recipe_id),
+        {instance.ingredient_id: instance.amount},
+    )
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_deleted_from_carts(sender, instance, **kwargs):
+    """Вычитание ингредиента из списков покупок ещё не удалённых
+    покупателей рецепта."""
+
+    if not in_bulk_block():
+        subtract_cart_lines(
+            recipe_buyers_query(instance.recipe_id),
+            {instance.ingredient_id: instance.amount},
+        )
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    """Сброс кэша списков покупок, в которые входит рецепт."""
+
+    if in_bulk_block():
+        return
+    invalidate_recipe_carts(instance.recipe_id)
+    invalidate_cards([instance.recipe_id])
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def recipe_ingredient_saved(sender, instance, **kwargs):
+    """Обновление индекса подбора рецептов по ингредиентам.
+
+    WriteRecipeSerializer создаёт ингредиенты через bulk_create без
+    сигналов и обновляет индекс сам, сюда попадают изменения из
+    админки.
+    """
+
+    if in_bulk_block():
+        return
+    refresh_cookable([instance.recipe_id])
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_deleted(sender, instance, **kwargs):
+    """Удаление ингредиента рецепта из индекса подбора рецептов."""
+
+    if in_bulk_block():
+        return
+    refresh_cookable([instance.recipe_id])
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    """Сброс карточки рецепта."""
+
+    invalidate_cards([instance.pk])
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, **kwargs):
+    """Обновление поиска после фиксации транзакции, когда записаны
+    и ингредиенты рецепта."""
+
+    reindex_recipes([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    """Удаление рецепта из индекса поиска в памяти."""
+
+    unindex_recipes([instance.pk])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Сброс карточек рецептов при изменении их тегов."""
+
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_cards([instance.pk])
+    elif pk_set:
+        invalidate_cards(pk_set)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(sender, instance, **kwargs):
+    """Перестроение индекса автодополнения и смена версии справочника."""
+
+    ingredient_index.invalidate()
+    bump_catalog_version('ingredients')
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, **kwargs):
+    """Сброс карточек, списков покупок и обновление поиска рецептов
+    с изменённым ингредиентом: его название и единица измерения
+    входят в карточки и в выгрузку списка покупок.
+
+    При удалении ингредиента карточки и списки покупок сбрасываются
+    сигналами удаляемых вместе с ним RecipeIngredient.
+    """
+
+    recipe_ids = list(
+        RecipeIngredient.objects.filter(ingredient=instance).values_list(
+            'recipe_id', flat=True
+        )
+    )
+    invalidate_cards(recipe_ids)
+    reindex_recipes(recipe_ids)
+    invalidate_users(
+        CartLine.objects.filter(ingredient=instance).values_list(
+            'user_id', flat=True
+        )
+    )
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    """Смена версии справочника тегов."""
+
+    bump_catalog_version('tags')
+
+
+@receiver((post_save, pre_delete), sender=Tag)
+def tag_saved(sender, instance, **kwargs):
+    """Сброс карточек рецептов с изменённым или удаляемым тегом."""
+
+    invalidate_cards(
+        Recipe.tags.through.objects.filter(tag=instance).values_list(
+            'recipe_id', flat=True
+        )
+    )
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """Сброс кэша аутентификации при выходе пользователя."""
+
+    token_cache.delete(instance.key)
+
+
+def forget_tokens(user_id):
+    """Сброс кэша аутентификации для всех токенов пользователя."""
+
+    token_cache.delete(
+        *Token.objects.filter(user_id=user_id).values_list('key', flat=True)
+    )
+
+
+@receiver((post_save, post_delete), sender=User)
+def user_changed(sender, instance, **kwargs):
+    """Сброс кэша аутентификации при изменении и удалении
+    пользователя."""
+
+    forget_tokens(instance.pk)
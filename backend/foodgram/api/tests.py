@@ -0,0 +1,1918 @@
+import asyncio
+import importlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+from urllib.parse import urlencode, urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve
+from django.utils import timezone
+from recipes.bulk import bulk_changes
+from recipes.carts import aggregate_cart_lines
+from recipes.catalog import COOKABLE_CATALOG, bump_catalog_version
+from recipes.images import IMAGES_DIR, thumbnail_url
+from recipes.models import (CartLine, CatalogVersion, Favorite, Ingredient,
+                            Job, Purchase, Recipe, RecipeIngredient, Tag)
+from recipes.search import full_text_search, update_search_vectors
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import (APIRequestFactory, APITestCase,
+                                 APITransactionTestCase)
+from users.models import Subscription, User
+
+from . import urls
+from .authentication import CachedTokenAuthentication, TokenCache, token_cache
+from .autocomplete import ingredient_index
+from .cache import get_cards
+from .cookable import CookableIndex, cookable_index, pending, rank_in_database
+from .images import thumbnails_job
+from .jobs import claim_jobs, cleanup_jobs, enqueue, finish_job, process_job
+from .management.commands.check_query_counts import ENDPOINTS
+from .management.commands.check_query_plans import get_hot_queries
+from .pagination import FoodgramPagination
+from .search import RecipeSearchIndex, recipe_index
+from .serializers import WriteRecipeSerializer
+
+MEDIA_ROOT = tempfile.mkdtemp()
+SERVER_MODE = settings.SERVER_MODE
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=='
+)
+
+
+class FoodgramTestMixin:
+    """Общие данные и помощники тестов API."""
+
+    def setUp(self):
+        for alias_cache in caches.all():
+            alias_cache.clear()
+        ingredient_index.invalidate()
+        recipe_index.invalidate()
+        cookable_index.invalidate()
+        pending.recipes = {}
+        token_cache.clear()
+
+    @staticmethod
+    def create_user(username):
+        return User.objects.create_user(
+            username=username,
+            email=f'{username}@example.com',
+            password='password',
+            first_name=username,
+            last_name=username,
+        )
+
+    @staticmethod
+    def create_recipe(author, name='Рецепт', ingredients=(), tags=()):
+        recipe = Recipe.objects.create(
+            author=author,
+            name=name,
+            text='Текст',
+            cooking_time=10,
+            image='recipes/images/test.png',
+        )
+        recipe.tags.set(tags)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=10)
+            for ingredient in ingredients
+        )
+        return recipe
+
+    @staticmethod
+    def create_ingredients(count):
+        return [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(count)
+        ]
+
+    @staticmethod
+    def create_tag(slug='breakfast'):
+        return Tag.objects.create(name=slug, color='#E26C2D', slug=slug)
+
+
+class FoodgramTestCase(FoodgramTestMixin, APITestCase):
+    pass
+
+
+class SubscriptionsTests(FoodgramTestCase):
+    """Лента подписок: количество запросов не зависит от страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('subscriber')
+        for number in range(8):
+            author = cls.create_user(f'author{number}')
+            Subscription.objects.create(
+                subscriber=cls.user, subscriptions=author
+            )
+            for recipe_number in range(4):
+                cls.create_recipe(author, f'Рецепт {recipe_number}')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for limit in (1, 8):
+            with self.subTest(limit=limit), self.assertNumQueries(3):
+                response = self.client.get(
+                    '/api/users/subscriptions/',
+                    {'limit': limit, 'recipes_limit': 2},
+                )
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_recipes_limit(self):
+        response = self.client.get(
+            '/api/users/subscriptions/', {'recipes_limit': 2}
+        )
+        for author in response.data['results']:
+            self.assertEqual(len(author['recipes']), 2)
+            self.assertEqual(author['recipes_count'], 4)
+            self.assertTrue(author['is_subscribed'])
+
+    def test_subscribe_response_respects_recipes_limit(self):
+        author = self.create_user('new_author')
+        for number in range(3):
+            self.create_recipe(author, f'Рецепт {number}')
+        response = self.client.post(
+            f'/api/users/{author.pk}/subscribe/?recipes_limit=1'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['recipes']), 1)
+        self.assertEqual(response.data['followers_count'], 1)
+
+
+class ListQueryCountTests(FoodgramTestCase):
+    """Списки рецептов и пользователей без N+1."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('reader')
+        tags = [cls.create_tag('breakfast'), cls.create_tag('dinner')]
+        ingredients = cls.create_ingredients(3)
+        for number in range(10):
+            author = cls.create_user(f'author{number}')
+            Subscription.objects.create(
+                subscriber=cls.user, subscriptions=author
+            )
+            cls.create_recipe(
+                author, f'Рецепт {number}', ingredients, tags
+            )
+
+    def assert_constant_queries(self, url, expected):
+        """Карточки рецептов собираются заново на каждой странице,
+        теги и версии справочников уже в кэше."""
+
+        self.client.get(url)
+        for limit in (1, 10):
+            caches[settings.CARDS_CACHE_ALIAS].clear()
+            with self.subTest(limit=limit), self.assertNumQueries(expected):
+                response = self.client.get(url, {'limit': limit})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_recipes_anonymous(self):
+        self.assert_constant_queries('/api/recipes/', 5)
+
+    def test_recipes_authenticated(self):
+        self.client.force_authenticate(self.user)
+        self.assert_constant_queries('/api/recipes/', 6)
+
+    def test_users_anonymous(self):
+        self.assert_constant_queries('/api/users/', 2)
+
+    def test_users_authenticated(self):
+        self.client.force_authenticate(self.user)
+        self.assert_constant_queries('/api/users/', 3)
+
+
+@override_settings(CACHES={
+    **settings.CACHES,
+    'uncached': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+})
+class RecipeCardCacheTests(FoodgramTestCase):
+    """Карточки рецептов из кэша совпадают с собранными без кэша."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.alice = cls.create_user('alice')
+        cls.bob = cls.create_user('bob')
+        cls.tag = cls.create_tag('breakfast')
+        cls.ingredient, other = cls.create_ingredients(2)
+        cls.recipe = cls.create_recipe(
+            cls.author, 'Каша', [cls.ingredient, other], [cls.tag]
+        )
+        cls.other_recipe = cls.create_recipe(
+            cls.author, 'Суп', [other], [cls.tag]
+        )
+        Favorite.objects.create(user=cls.alice, favorites=cls.recipe)
+        Purchase.objects.create(user=cls.bob, recipe=cls.other_recipe)
+
+    def get(self, url, user=None, cached=True):
+        self.client.force_authenticate(user)
+        alias = settings.CARDS_CACHE_ALIAS if cached else 'uncached'
+        with override_settings(CARDS_CACHE_ALIAS=alias):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def assert_same_as_uncached(self, user=None):
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/'):
+            with self.subTest(url=url, user=user):
+                self.assertEqual(
+                    self.get(url, user), self.get(url, user, cached=False)
+                )
+
+    def flags(self, user):
+        return {
+            recipe['id']: (
+                recipe['is_favorited'], recipe['is_in_shopping_cart']
+            )
+            for recipe in self.get('/api/recipes/', user)['results']
+        }
+
+    def test_same_as_uncached_for_each_user(self):
+        self.get('/api/recipes/', self.alice)
+        self.assertTrue(get_cards([self.recipe.pk, self.other_recipe.pk]))
+        for user in (self.alice, self.bob, None, self.alice):
+            self.assert_same_as_uncached(user)
+        self.assertEqual(
+            self.flags(self.alice),
+            {self.recipe.pk: (True, False),
+             self.other_recipe.pk: (False, False)},
+        )
+        self.assertEqual(
+            self.flags(self.bob),
+            {self.recipe.pk: (False, False),
+             self.other_recipe.pk: (False, True)},
+        )
+        self.assertEqual(
+            self.flags(None),
+            {self.recipe.pk: (False, False),
+             self.other_recipe.pk: (False, False)},
+        )
+
+    def test_changes_invalidate_cards(self):
+        new_tag = self.create_tag('dinner')
+        changes = {
+            'tag': lambda: Tag.objects.filter(pk=self.tag.pk).first().save(),
+            'tag_renamed': lambda: self.save(self.tag, name='Завтрак'),
+            'ingredient': lambda: self.save(
+                self.ingredient, name='Овсянка', measurement_unit='кг'
+            ),
+            'recipe': lambda: self.save(
+                self.recipe, name='Овсяная каша', cooking_time=15
+            ),
+            'amount': lambda: self.save(
+                RecipeIngredient.objects.get(
+                    recipe=self.recipe, ingredient=self.ingredient
+                ),
+                amount=250,
+            ),
+            'tags_added': lambda: self.recipe.tags.add(new_tag),
+            'tags_removed': lambda: new_tag.recipe_set.remove(self.recipe),
+            'tag_deleted': lambda: Tag.objects.filter(
+                pk=self.tag.pk
+            ).first().delete(),
+        }
+        for name, change in changes.items():
+            with self.subTest(change=name):
+                self.assert_same_as_uncached(self.alice)
+                with self.captureOnCommitCallbacks(execute=True):
+                    change()
+                self.assert_same_as_uncached(self.alice)
+        recipe = self.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(recipe['name'], 'Овсяная каша')
+        self.assertEqual(recipe['tags'], [])
+        self.assertIn(
+            {'id': self.ingredient.pk, 'name': 'Овсянка',
+             'measurement_unit': 'кг', 'amount': 250},
+            recipe['ingredients'],
+        )
+
+    @staticmethod
+    def save(instance, **values):
+        for name, value in values.items():
+            setattr(instance, name, value)
+        instance.save()
+
+
+class KeysetPaginationTests(FoodgramTestCase):
+    """Курсорный режим ленты рецептов и списка пользователей."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        now = timezone.now()
+        for number in range(11):
+            recipe = cls.create_recipe(cls.author, f'Рецепт {number}')
+            # Семь рецептов с одинаковым временем создания.
+            Recipe.objects.filter(pk=recipe.pk).update(
+                created_at=now - timedelta(minutes=max(number - 6, 0))
+            )
+
+    @staticmethod
+    def cursor(values):
+        return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def walk(self, url):
+        """Идентификаторы всех объектов по ссылкам next."""
+
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_encode_decode(self):
+        pagination = FoodgramPagination()
+        pagination.ordering = pagination.keyset_ordering
+        position = [timezone.now(), 42]
+        request = Request(APIRequestFactory().get(
+            '/api/recipes/', {'cursor': pagination.encode_cursor(position)}
+        ))
+        self.assertEqual(pagination.decode_cursor(request, Recipe), position)
+
+    def test_tampered_cursor(self):
+        for cursor in (
+            'не курсор',
+            urlsafe_b64encode(b'{').decode(),
+            self.cursor(['2024-01-01T00:00:00+00:00']),
+            self.cursor(['не дата', 1]),
+            self.cursor(['2024-01-01T00:00:00+00:00', 'не число']),
+        ):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(
+                    '/api/recipes/', {'cursor': cursor}
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data['detail'], 'Неверный курсор.')
+
+    def test_ties_without_duplicates_or_gaps(self):
+        expected = list(
+            Recipe.objects.order_by('-created_at', '-id').values_list(
+                'id', flat=True
+            )
+        )
+        for limit in (1, 2, 3, 6, 11, 20):
+            with self.subTest(limit=limit):
+                self.assertEqual(
+                    self.walk(f'/api/recipes/?cursor=&limit={limit}'),
+                    expected,
+                )
+        self.assertEqual(self.walk('/api/recipes/?limit=3'), expected)
+        response = self.client.get('/api/recipes/?cursor=')
+        self.assertEqual(list(response.data), ['next', 'results'])
+
+    def test_relevance_order_without_cursor(self):
+        for url in ('/api/recipes/', '/api/recipes/facets/'):
+            with self.subTest(url=url):
+                response = self.client.get(
+                    url, {'cursor': '', 'search': 'рецепт'}
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(
+                    response.data['detail'],
+                    FoodgramPagination.ordered_cursor_message,
+                )
+                response = self.client.get(url, {'search': 'рецепт'})
+                self.assertEqual(response.data['count'], 11)
+
+    def test_users(self):
+        for number in range(4):
+            self.create_user(f'user{number}')
+        self.assertEqual(
+            self.walk('/api/users/?cursor=&limit=2'),
+            list(User.objects.order_by('id').values_list('id', flat=True)),
+        )
+
+
+class ShoppingListExportTests(FoodgramTestCase):
+    """Выгрузка списка покупок и выбор её формата."""
+
+    url = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('buyer')
+        ingredients = cls.create_ingredients(2)
+        cls.recipe = cls.create_recipe(cls.user, ingredients=ingredients)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.client.post(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+
+    def test_formats(self):
+        for accept, content_type in (
+            ('application/pdf', 'application/pdf'),
+            ('text/csv', 'text/csv; charset=utf-8'),
+            ('text/plain', 'text/plain; charset=utf-8'),
+            ('application/json', 'application/pdf'),
+            ('*/*', 'application/pdf'),
+        ):
+            with self.subTest(accept=accept):
+                response = self.client.get(self.url, HTTP_ACCEPT=accept)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], content_type)
+                content = b''.join(response.streaming_content)
+                if content_type == 'text/plain; charset=utf-8':
+                    self.assertIn('Ингредиент 0 (г) — 10', content.decode())
+
+    def download_txt(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='text/plain')
+        return b''.join(response.streaming_content).decode()
+
+    def test_ingredient_rename_invalidates_list(self):
+        self.assertIn('Ингредиент 0 (г) — 10', self.download_txt())
+        ingredient = Ingredient.objects.get(name='Ингредиент 0')
+        ingredient.name = 'Мука'
+        ingredient.measurement_unit = 'кг'
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        self.assertIn('Мука (кг) — 10', self.download_txt())
+
+    def test_users_invalidated_after_commit(self):
+        self.download_txt()
+        ingredient = Ingredient.objects.get(name='Ингредиент 0')
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Ingredient.objects.filter(pk=ingredient.pk).update(
+                    name='Мука'
+                )
+                ingredient.refresh_from_db()
+                ingredient.save()
+                self.assertIn('Ингредиент 0 (г)', self.download_txt())
+        self.assertIn('Мука (г)', self.download_txt())
+
+    def test_errors_are_json(self):
+        self.client.force_authenticate(None)
+        for accept in ('application/pdf', 'text/csv', 'application/json'):
+            with self.subTest(accept=accept):
+                response = self.client.get(self.url, HTTP_ACCEPT=accept)
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response['Content-Type'], 'application/json')
+                self.assertIn('detail', response.json())
+
+
+class JobQueueTests(FoodgramTestCase):
+    """Очередь задач и формирование списка покупок в ней."""
+
+    url = '/api/recipes/download_shopping_cart/jobs/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('buyer')
+        ingredients = cls.create_ingredients(2)
+        cls.recipe = cls.create_recipe(cls.user, ingredients=ingredients)
+        Purchase.objects.create(user=cls.user, recipe=cls.recipe)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        # Как тестовый клиент Django, не закрываем соединение внутри
+        # транзакции теста.
+        patcher = mock.patch('api.jobs.close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def submit(self, export_format='txt'):
+        response = self.client.post(self.url, {'format': export_format})
+        self.assertIn(response.status_code, (200, 202))
+        return response.status_code, response.data['id']
+
+    @staticmethod
+    def create_jobs(count, status=Job.PENDING, **fields):
+        return [
+            Job.objects.create(
+                kind=Job.SHOPPING_LIST,
+                key=f'{status}{number}',
+                status=status,
+                **fields,
+            )
+            for number in range(count)
+        ]
+
+    def test_submit_deduplicated(self):
+        status, job_id = self.submit()
+        self.assertEqual(status, 202)
+        self.assertEqual(self.submit(), (200, job_id))
+        status, pdf_id = self.submit('pdf')
+        self.assertEqual(status, 202)
+        self.assertNotEqual(pdf_id, job_id)
+
+        self.client.force_authenticate(self.create_user('other'))
+        status, other_id = self.submit()
+        self.assertEqual(status, 202)
+        self.assertNotIn(other_id, (job_id, pdf_id))
+
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            Purchase.objects.create(
+                user=self.user, recipe=self.create_recipe(self.user)
+            )
+        self.assertEqual(self.submit()[1], job_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.filter(recipe=self.recipe).update(
+                amount=20
+            )
+            Purchase.objects.filter(recipe=self.recipe).delete()
+        status, changed_id = self.submit()
+        self.assertEqual(status, 202)
+        self.assertNotEqual(changed_id, job_id)
+
+    def test_enqueue_after_competing_job(self):
+        """Задача, поставленная другим запросом между проверкой и
+        вставкой, возвращается, даже если она уже завершилась."""
+
+        create = Job.objects.create
+
+        def conflict_once(**fields):
+            # Вставка конфликтовала с задачей, которая к следующему
+            # запросу уже завершилась.
+            if conflict_once.calls:
+                return create(**fields)
+            conflict_once.calls += 1
+            raise IntegrityError('unique_active_job')
+
+        for status, created in ((Job.DONE, False), (Job.FAILED, True)):
+            competing = Job.objects.create(
+                kind=Job.THUMBNAILS, key=status, status=status
+            )
+            conflict_once.calls = 0
+            with self.subTest(status=status), mock.patch.object(
+                Job.objects, 'create', side_effect=conflict_once
+            ):
+                job, is_created = enqueue(Job.THUMBNAILS, status)
+                self.assertEqual(is_created, created)
+                self.assertEqual(job.pk == competing.pk, not created)
+                self.assertEqual(
+                    job.status, Job.PENDING if created else Job.DONE
+                )
+
+    def test_claim_once_until_lease_expires(self):
+        jobs = self.create_jobs(3)
+        first = claim_jobs(2)
+        self.assertEqual(len(first), 2)
+        second = claim_jobs(5)
+        self.assertEqual(len(second), 1)
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(claim_jobs(5), [])
+
+        expired = timezone.now() + timedelta(seconds=settings.JOBS_LEASE + 1)
+        with mock.patch('api.jobs.timezone.now', return_value=expired):
+            reclaimed = claim_jobs(5)
+        self.assertCountEqual(reclaimed, [job.pk for job in jobs])
+        self.assertEqual(
+            set(Job.objects.values_list('status', 'attempts')),
+            {(Job.RUNNING, 2)},
+        )
+        # Процесс, у которого истёк захват, не сохраняет результат.
+        self.assertEqual(
+            finish_job(Job(pk=jobs[0].pk, attempts=1), status=Job.DONE), 0
+        )
+
+    @override_settings(JOBS_MAX_ATTEMPTS=3, JOBS_RETRY_DELAY=10)
+    def test_retry_with_backoff_then_failed(self):
+        job = self.create_jobs(1, params={'format': 'txt'})[0]
+        with mock.patch(
+            'api.exports.shopping_list_job',
+            side_effect=RuntimeError('Ошибка формирования'),
+        ), self.assertLogs('api.jobs', 'ERROR'):
+            for attempt, delay in ((1, 10), (2, 20), (3, None)):
+                Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+                self.assertEqual(claim_jobs(1), [job.pk])
+                process_job(job.pk)
+                job.refresh_from_db()
+                self.assertEqual(job.attempts, attempt)
+                self.assertEqual(job.error, 'Ошибка формирования')
+                if delay is None:
+                    self.assertEqual(job.status, Job.FAILED)
+                    continue
+                self.assertEqual(job.status, Job.PENDING)
+                self.assertAlmostEqual(
+                    job.run_after - job.updated_at,
+                    timedelta(seconds=delay),
+                    delta=timedelta(seconds=1),
+                )
+                self.assertEqual(claim_jobs(1), [])
+        self.assertEqual(claim_jobs(1), [])
+
+    @override_settings(JOBS_TTL=60)
+    def test_cleanup_after_ttl(self):
+        old = timezone.now() - timedelta(seconds=120)
+        recent = timezone.now() - timedelta(seconds=30)
+        jobs = {
+            (status, updated_at): job
+            for status in (Job.DONE, Job.FAILED, Job.PENDING, Job.RUNNING)
+            for updated_at, job in zip(
+                (old, recent), self.create_jobs(2, status=status)
+            )
+        }
+        for (status, updated_at), job in jobs.items():
+            Job.objects.filter(pk=job.pk).update(updated_at=updated_at)
+        self.assertEqual(cleanup_jobs(), 2)
+        self.assertEqual(
+            set(Job.objects.values_list('pk', flat=True)),
+            {
+                job.pk for (status, updated_at), job in jobs.items()
+                if status in Job.ACTIVE or updated_at == recent
+            },
+        )
+        self.assertEqual(cleanup_jobs(), 0)
+
+    def test_download_when_done(self):
+        _, job_id = self.submit()
+        job_url = f'{self.url}{job_id}/'
+        response = self.client.get(f'{job_url}download/')
+        self.assertEqual(response.status_code, 409)
+        self.assertIsNone(self.client.get(job_url).data['download'])
+
+        self.assertEqual(claim_jobs(1), [job_id])
+        process_job(job_id)
+        response = self.client.get(job_url)
+        self.assertEqual(response.data['status'], Job.DONE)
+        self.assertTrue(response.data['download'].endswith(
+            f'{job_url}download/'
+        ))
+        response = self.client.get(f'{job_url}download/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertIn('Ингредиент 0 (г) — 10', response.content.decode())
+        self.assertEqual(self.submit(), (200, job_id))
+
+        self.client.force_authenticate(self.create_user('other'))
+        response = self.client.get(f'{job_url}download/')
+        self.assertEqual(response.status_code, 404)
+
+
+class CartLinesTests(FoodgramTestCase):
+    """Строки списков покупок совпадают с агрегацией по Purchase и
+    RecipeIngredient после любой последовательности изменений."""
+
+    steps = 60
+
+    def setUp(self):
+        super().setUp()
+        self.rng = random.Random(0)
+        self.author = self.create_user('author')
+        self.tag = self.create_tag()
+        self.users = [
+            self.create_user(f'buyer{number}') for number in range(3)
+        ]
+        self.ingredients = self.create_ingredients(6)
+        self.recipes = [self.new_recipe() for _ in range(4)]
+        self.client.force_authenticate(self.author)
+
+    def new_recipe(self):
+        recipe = self.create_recipe(self.author)
+        for ingredient in self.rng.sample(self.ingredients, 3):
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=self.amount()
+            )
+        return recipe
+
+    def amount(self):
+        return self.rng.randint(1, 50)
+
+    def cart_lines(self):
+        return {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount
+            in CartLine.objects.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            )
+        }
+
+    def missing_ingredients(self, recipe):
+        used = set(
+            recipe.recipeingredients.values_list('ingredient_id', flat=True)
+        )
+        return [item for item in self.ingredients if item.pk not in used]
+
+    def buy(self):
+        user = self.rng.choice(self.users)
+        recipe = self.rng.choice(self.recipes)
+        Purchase.objects.get_or_create(user=user, recipe=recipe)
+
+    def choice(self, queryset):
+        if objects := list(queryset.order_by('pk')):
+            return self.rng.choice(objects)
+        return None
+
+    def return_recipe(self):
+        if purchase := self.choice(Purchase.objects.all()):
+            purchase.delete()
+
+    def edit_row(self):
+        if row := self.choice(RecipeIngredient.objects.all()):
+            row.amount = self.amount()
+            row.save()
+
+    def swap_row(self):
+        row = self.choice(RecipeIngredient.objects.all())
+        if row and (missing := self.missing_ingredients(row.recipe)):
+            row.ingredient = self.rng.choice(missing)
+            row.save()
+
+    def add_row(self):
+        recipe = self.rng.choice(self.recipes)
+        if missing := self.missing_ingredients(recipe):
+            RecipeIngredient.objects.create(
+                recipe=recipe,
+                ingredient=self.rng.choice(missing),
+                amount=self.amount(),
+            )
+
+    def delete_row(self):
+        if row := self.choice(RecipeIngredient.objects.all()):
+            row.delete()
+
+    def delete_recipe(self):
+        recipe = self.recipes.pop(self.rng.randrange(len(self.recipes)))
+        recipe.delete()
+        self.recipes.append(self.new_recipe())
+
+    def delete_user(self):
+        self.users.pop(self.rng.randrange(len(self.users))).delete()
+        self.users.append(
+            self.create_user(f'buyer{self.rng.randrange(10 ** 9)}')
+        )
+
+    def patch_recipe(self):
+        recipe = self.rng.choice(self.recipes)
+        response = self.client.patch(
+            f'/api/recipes/{recipe.pk}/',
+            {
+                'tags': [self.tag.pk],
+                'ingredients': [
+                    {'id': ingredient.pk, 'amount': self.amount()}
+                    for ingredient in self.rng.sample(
+                        self.ingredients, self.rng.randint(1, 4)
+                    )
+                ],
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_random_changes(self):
+        operations = (
+            self.buy, self.buy, self.buy, self.return_recipe, self.edit_row,
+            self.swap_row, self.add_row, self.delete_row, self.delete_recipe,
+            self.delete_user, self.patch_recipe,
+        )
+        for seed in range(5):
+            self.rng = random.Random(seed)
+            for step in range(self.steps):
+                operation = self.rng.choice(operations)
+                operation()
+                self.assertEqual(
+                    self.cart_lines(),
+                    aggregate_cart_lines(Purchase.objects.all()),
+                    f'seed {seed}, step {step}: {operation.__name__}',
+                )
+
+
+class CatalogVersionTests(FoodgramTestCase):
+    """Условные запросы к справочникам и общая версия справочника."""
+
+    url = '/api/tags/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_tag()
+
+    def get_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_revalidation_without_queries(self):
+        for url in (self.url, '/api/ingredients/?name=ин'):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+    def test_only_json(self):
+        etag = self.get_etag()
+        for url in (self.url, '/api/ingredients/'):
+            with self.subTest(url=url):
+                response = self.client.get(
+                    url, HTTP_ACCEPT='text/html', HTTP_IF_NONE_MATCH=etag
+                )
+                self.assertEqual(response.status_code, 406)
+                self.assertNotIn('ETag', response)
+
+    def test_change_in_this_process(self):
+        etag = self.get_etag()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_tag('dinner')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+
+    def test_change_in_other_process(self):
+        """Версия, сменённая другим процессом, видна после истечения
+        CATALOG_VERSION_TTL."""
+
+        etag = self.get_etag()
+        CatalogVersion.objects.update_or_create(
+            name='tags', defaults={'version': 'other'}
+        )
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        cache.clear()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+def set_server_mode(mode):
+    """Пересборка адресов API с представлениями для режима mode:
+    AsyncReadMixin выбирает вид представления при создании."""
+
+    with override_settings(SERVER_MODE=mode):
+        importlib.reload(urls)
+        importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+@override_settings(SERVER_MODE='asgi')
+class AsyncReadTests(FoodgramTestMixin, APITransactionTestCase):
+    """Чтение справочников в ASGI-режиме совпадает с синхронным.
+
+    Представления выполняются в потоках пула чтения со своими
+    соединениями с базой, поэтому данные должны быть зафиксированы.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.tag = self.create_tag()
+        self.ingredient = self.create_ingredients(3)[0]
+        # AsyncClient в Django 3.2 не передаёт параметры data в строку
+        # запроса, поэтому она указывается в адресе.
+        self.urls = (
+            '/api/tags/',
+            f'/api/tags/{self.tag.pk}/',
+            '/api/ingredients/',
+            '/api/ingredients/?' + urlencode({'name': 'нгред', 'limit': 2}),
+            f'/api/ingredients/{self.ingredient.pk}/',
+        )
+        self.addCleanup(set_server_mode, SERVER_MODE)
+
+    @staticmethod
+    def summary(response):
+        return (
+            response.status_code,
+            response.content,
+            response.get('ETag'),
+            response.get('Cache-Control'),
+        )
+
+    async def test_same_responses_as_sync(self):
+        """Ответы и повторные запросы с If-None-Match совпадают с
+        синхронным режимом."""
+
+        set_server_mode('wsgi')
+        self.assertFalse(
+            asyncio.iscoroutinefunction(resolve('/api/tags/').func)
+        )
+        expected = []
+        for url in self.urls:
+            response = await sync_to_async(self.client.get)(url)
+            revalidated = await sync_to_async(self.client.get)(
+                url, HTTP_IF_NONE_MATCH=response['ETag']
+            )
+            expected.append(
+                (self.summary(response), self.summary(revalidated))
+            )
+        self.assertEqual(len(json.loads(expected[3][0][1])), 2)
+        set_server_mode('asgi')
+        for url, summaries in zip(self.urls, expected):
+            with self.subTest(url=url):
+                self.assertTrue(
+                    asyncio.iscoroutinefunction(
+                        resolve(urlsplit(url).path).func
+                    )
+                )
+                response = await self.async_client.get(url)
+                # AsyncClient принимает заголовки под их HTTP-именами.
+                revalidated = await self.async_client.get(
+                    url, **{'If-None-Match': response['ETag']}
+                )
+                self.assertEqual(
+                    (self.summary(response), self.summary(revalidated)),
+                    summaries,
+                )
+                self.assertEqual(revalidated.status_code, 304)
+
+    async def test_writes_stay_synchronous(self):
+        set_server_mode('asgi')
+        response = await self.async_client.post(
+            '/api/tags/', {'name': 'Ужин', 'slug': 'dinner'}
+        )
+        self.assertEqual(response.status_code, 405)
+        response = await self.async_client.get('/api/tags/404/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_errors_propagate_from_executor(self):
+        set_server_mode('asgi')
+        threads = []
+
+        def fail(catalog):
+            threads.append(threading.current_thread().name)
+            raise RuntimeError(catalog)
+
+        with mock.patch('api.mixins.get_catalog_version', fail):
+            with self.assertRaisesMessage(RuntimeError, 'tags'):
+                await self.async_client.get('/api/tags/')
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('api-read'))
+
+
+class FacetsTests(FoodgramTestCase):
+    """Фасеты поиска рецептов и фильтры по тегам и времени."""
+
+    url = '/api/recipes/facets/'
+    # Автор, время приготовления и теги рецептов.
+    recipes = (
+        (0, 1, ('breakfast',)),
+        (0, 15, ('breakfast', 'lunch')),
+        (0, 16, ('lunch',)),
+        (1, 30, ('breakfast',)),
+        (0, 31, ('dinner',)),
+        (1, 60, ('breakfast', 'dinner')),
+        (1, 61, ()),
+        (0, 120, ('breakfast', 'lunch', 'dinner')),
+        (1, 121, ('lunch', 'dinner')),
+        (0, 500, ('breakfast',)),
+    )
+    buckets = {
+        '0-15': (1, 15),
+        '16-30': (16, 30),
+        '31-60': (31, 60),
+        '61-120': (61, 120),
+        '121-': (121, 500),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [cls.create_user('first'), cls.create_user('second')]
+        cls.tags = {
+            slug: cls.create_tag(slug)
+            for slug in ('breakfast', 'lunch', 'dinner')
+        }
+        for author, cooking_time, slugs in cls.recipes:
+            recipe = cls.create_recipe(
+                cls.authors[author],
+                f'Рецепт {cooking_time}',
+                tags=[cls.tags[slug] for slug in slugs],
+            )
+            Recipe.objects.filter(pk=recipe.pk).update(
+                cooking_time=cooking_time
+            )
+
+    def matching(self, tags=(), author=None, bucket=None):
+        """Время приготовления рецептов, подходящих под фильтры."""
+
+        return sorted(
+            cooking_time
+            for recipe_author, cooking_time, slugs in self.recipes
+            if (not tags or set(tags) & set(slugs))
+            and (author is None or recipe_author == author)
+            and (
+                bucket is None
+                or self.buckets[bucket][0]
+                <= cooking_time
+                <= self.buckets[bucket][1]
+            )
+        )
+
+    def get(self, url, tags=(), author=None, bucket=None):
+        params = {'tags': list(tags), 'limit': 100}
+        if author is not None:
+            params['author'] = self.authors[author].pk
+        if bucket is not None:
+            params['cooking_time'] = bucket
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def cooking_times(self, data):
+        return sorted(
+            Recipe.objects.get(pk=recipe['id']).cooking_time
+            for recipe in data['results']
+        )
+
+    def test_several_tags_without_duplicates(self):
+        data = self.get('/api/recipes/', tags=('breakfast', 'lunch'))
+        ids = [recipe['id'] for recipe in data['results']]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(data['count'], len(ids))
+        self.assertEqual(
+            self.cooking_times(data),
+            self.matching(tags=('breakfast', 'lunch')),
+        )
+
+    def test_cooking_time_bucket_boundaries(self):
+        for bucket, times in self.buckets.items():
+            with self.subTest(bucket=bucket):
+                data = self.get('/api/recipes/', bucket=bucket)
+                self.assertEqual(self.cooking_times(data), list(times))
+        response = self.client.get('/api/recipes/', {'cooking_time': '0-5'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_facet_counts_exclude_own_filter(self):
+        for filters in (
+            {},
+            {'tags': ('breakfast',)},
+            {'tags': ('breakfast', 'dinner'), 'author': 0},
+            {'author': 1, 'bucket': '31-60'},
+            {'tags': ('lunch',), 'author': 0, 'bucket': '0-15'},
+        ):
+            with self.subTest(**filters):
+                data = self.get(self.url, **filters)
+                self.assertEqual(
+                    self.cooking_times(data), self.matching(**filters)
+                )
+                facets = data['facets']
+                without_tags = {**filters, 'tags': ()}
+                self.assertEqual(
+                    {tag['slug']: tag['count'] for tag in facets['tags']},
+                    {
+                        slug: len(self.matching(**{
+                            **without_tags, 'tags': (slug,)
+                        }))
+                        for slug in self.tags
+                    },
+                )
+                without_author = {**filters, 'author': None}
+                self.assertEqual(
+                    [
+                        (author['id'], author['count'])
+                        for author in facets['author']
+                    ],
+                    sorted(
+                        (
+                            (author.pk, count)
+                            for number, author in enumerate(self.authors)
+                            if (count := len(self.matching(**{
+                                **without_author, 'author': number
+                            })))
+                        ),
+                        key=lambda item: (-item[1], item[0]),
+                    ),
+                )
+                without_bucket = {**filters, 'bucket': None}
+                self.assertEqual(
+                    {
+                        bucket['value']: bucket['count']
+                        for bucket in facets['cooking_time']
+                    },
+                    {
+                        bucket: len(self.matching(**{
+                            **without_bucket, 'bucket': bucket
+                        }))
+                        for bucket in self.buckets
+                    },
+                )
+
+
+class IngredientAutocompleteTests(FoodgramTestCase):
+    """Автодополнение из индекса в памяти и из базы данных."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in (
+            'ёжевика', 'Ежевика садовая', 'ежевика', 'Ёрш', 'еда',
+            'Еда', 'Яйцо', 'зелень', 'Лечо', 'свёкла', 'свекла',
+        ):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+        Ingredient.objects.create(name='ежевика', measurement_unit='кг')
+
+    def search(self, backend, name, limit=None):
+        params = {'name': name}
+        if limit is not None:
+            params['limit'] = limit
+        with override_settings(INGREDIENT_SEARCH_BACKEND=backend):
+            response = self.client.get('/api/ingredients/', params)
+        self.assertEqual(response.status_code, 200)
+        return [dict(ingredient) for ingredient in response.data]
+
+    def test_same_results_as_database(self):
+        for name in ('е', 'Е', 'ё', 'Ёж', 'ек', 'свё', 'я'):
+            for limit in (None, 1, 3):
+                with self.subTest(name=name, limit=limit):
+                    self.assertEqual(
+                        self.search('memory', name, limit),
+                        self.search('database', name, limit),
+                    )
+
+
+class RecipeSearchIndexTests(FoodgramTestCase):
+    """Индекс поиска рецептов в памяти и общая версия поиска."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = cls.create_user('author')
+        beef, chicken, potato, cucumber = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Говядина', 'Курица', 'Картофель', 'Огурцы')
+        )
+        for name, text, ingredients in (
+            ('Борщ с говядиной', 'Варить два часа', [beef, potato]),
+            ('Суп с курицей', 'Варить час', [chicken, potato]),
+            ('Салат из огурцов', 'Нарезать огурцы', [cucumber]),
+            ('Курица с картофелем', 'Запекать час', [chicken, potato]),
+        ):
+            recipe = cls.create_recipe(author, name, ingredients)
+            Recipe.objects.filter(pk=recipe.pk).update(text=text)
+        update_search_vectors()
+        cls.recipe = Recipe.objects.get(name='Салат из огурцов')
+
+    def rename_recipe(self, index):
+        Recipe.objects.filter(pk=self.recipe.pk).update(name='Окрошка')
+        with self.captureOnCommitCallbacks(execute=True):
+            index.update([self.recipe.pk])
+
+    def test_change_in_this_process_without_rebuild(self):
+        self.assertEqual(recipe_index.search('салат', 10), [self.recipe.pk])
+        self.rename_recipe(recipe_index)
+        with mock.patch.object(
+            recipe_index, 'build', wraps=recipe_index.build
+        ) as build:
+            self.assertEqual(
+                recipe_index.search('окрошка', 10), [self.recipe.pk]
+            )
+            self.assertEqual(recipe_index.search('салат', 10), [])
+        build.assert_not_called()
+
+    def test_change_in_other_process(self):
+        """Индекс перестраивается, когда другой процесс сменил версию
+        поиска, после истечения CATALOG_VERSION_TTL."""
+
+        self.assertEqual(recipe_index.search('салат', 10), [self.recipe.pk])
+        self.rename_recipe(RecipeSearchIndex())
+        cache.clear()
+        self.assertEqual(recipe_index.search('окрошка', 10), [self.recipe.pk])
+        self.assertEqual(recipe_index.search('салат', 10), [])
+
+    def test_update_search_vectors_rebuilds_index(self):
+        recipe_index.search('салат', 10)
+        Recipe.objects.filter(pk=self.recipe.pk).update(name='Окрошка')
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('update_search_vectors', stdout=StringIO())
+        self.assertEqual(recipe_index.search('окрошка', 10), [self.recipe.pk])
+
+    @override_settings(RECIPE_SEARCH_MAX_RESULTS=1)
+    def test_limit_applies_after_other_filters(self):
+        soup = Recipe.objects.get(name='Суп с курицей')
+        soup.tags.add(self.create_tag('soup'))
+        response = self.client.get(
+            '/api/recipes/', {'search': 'картофель', 'tags': 'soup'}
+        )
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']], [soup.pk]
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', 'Только для PostgreSQL')
+    def test_same_results_as_full_text_search(self):
+        for value in (
+            'борщ', 'говядина', 'курица', 'картофель', 'огурцы',
+            'суп курица', 'варить', 'курица час',
+        ):
+            with self.subTest(value=value):
+                found = full_text_search(Recipe.objects.all(), value)
+                self.assertCountEqual(
+                    recipe_index.search(value, 10),
+                    found.values_list('pk', flat=True),
+                )
+
+
+class CookableIndexTests(FoodgramTestCase):
+    """Индекс подбора рецептов в памяти и общая версия индекса."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = cls.create_user('author')
+        cls.ingredients = cls.create_ingredients(4)
+        first, second, third, fourth = cls.ingredients
+        cls.recipe = cls.create_recipe(author, 'Рецепт 0', [first])
+        for number, ingredients in enumerate((
+            [first, second], [second, third, fourth], [first, third],
+        ), 1):
+            cls.create_recipe(author, f'Рецепт {number}', ingredients)
+
+    def rank(self, *ingredients):
+        return cookable_index.rank([
+            ingredient.pk for ingredient in ingredients
+        ])[:10]
+
+    def replace_ingredient(self, index):
+        """Замена единственного ингредиента рецепта без сигналов."""
+
+        RecipeIngredient.objects.filter(recipe=self.recipe).update(
+            ingredient=self.ingredients[3]
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            index.refresh([self.recipe.pk])
+
+    def test_same_order_as_database(self):
+        for count in range(1, 5):
+            ingredient_ids = [
+                ingredient.pk for ingredient in self.ingredients[:count]
+            ]
+            with self.subTest(ingredients=count):
+                self.assertEqual(
+                    cookable_index.rank(ingredient_ids)[:10],
+                    list(rank_in_database(ingredient_ids)),
+                )
+
+    def test_change_in_this_process_without_rebuild(self):
+        self.assertIn((self.recipe.pk, 1, 1), self.rank(self.ingredients[0]))
+        self.replace_ingredient(cookable_index)
+        with mock.patch.object(
+            cookable_index, 'build', wraps=cookable_index.build
+        ) as build:
+            self.assertNotIn(
+                self.recipe.pk,
+                [pk for pk, *_ in self.rank(self.ingredients[0])],
+            )
+            self.assertIn(
+                (self.recipe.pk, 1, 1), self.rank(self.ingredients[3])
+            )
+        build.assert_not_called()
+
+    def test_change_in_other_process(self):
+        """Индекс перестраивается, когда другой процесс сменил версию
+        индекса, после истечения CATALOG_VERSION_TTL."""
+
+        self.rank(self.ingredients[3])
+        self.replace_ingredient(CookableIndex())
+        cache.clear()
+        self.assertIn((self.recipe.pk, 1, 1), self.rank(self.ingredients[3]))
+
+    def test_one_version_change_per_transaction(self):
+        """Каскадное удаление рецепта со всеми ингредиентами меняет
+        версию индекса один раз."""
+
+        recipe = self.create_recipe(
+            self.recipe.author, 'Рецепт с ингредиентами', [
+                Ingredient.objects.create(
+                    name=f'Продукт {number}', measurement_unit='г'
+                )
+                for number in range(20)
+            ],
+        )
+        ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+        self.assertIn(recipe.pk, dict(
+            (pk, total)
+            for pk, _, total in cookable_index.rank(ingredient_ids)[:10]
+        ))
+        with mock.patch(
+            'api.cookable.bump_catalog_version', wraps=bump_catalog_version
+        ) as bump, self.captureOnCommitCallbacks(execute=True):
+            recipe_id = recipe.pk
+            recipe.delete()
+        bump.assert_called_once_with(COOKABLE_CATALOG, changes=[recipe_id])
+        self.assertEqual(
+            cookable_index.rank(ingredient_ids)[:10],
+            list(rank_in_database(ingredient_ids)),
+        )
+
+    def test_change_in_other_process_without_rebuild(self):
+        """Изменения другого процесса переносятся из журнала изменений."""
+
+        self.rank(self.ingredients[3])
+        self.replace_ingredient(CookableIndex())
+        cache.clear()
+        with mock.patch.object(
+            cookable_index, 'build', wraps=cookable_index.build
+        ) as build, mock.patch.object(
+            cookable_index, 'start_rebuild'
+        ) as start_rebuild:
+            self.assertIn(
+                (self.recipe.pk, 1, 1), self.rank(self.ingredients[3])
+            )
+        build.assert_not_called()
+        start_rebuild.assert_not_called()
+
+    def test_rebuild_in_background_without_changes(self):
+        """Если журнал не содержит изменений, индекс перестраивается
+        в фоне, а подбор идёт по прежнему индексу."""
+
+        self.assertIn((self.recipe.pk, 1, 1), self.rank(self.ingredients[0]))
+        RecipeIngredient.objects.filter(recipe=self.recipe).update(
+            ingredient=self.ingredients[3]
+        )
+        bump_catalog_version(COOKABLE_CATALOG)
+        cache.clear()
+        with mock.patch.object(
+            cookable_index, 'build', wraps=cookable_index.build
+        ) as build, mock.patch.object(
+            cookable_index, 'start_rebuild'
+        ) as start_rebuild:
+            self.assertIn(
+                (self.recipe.pk, 1, 1), self.rank(self.ingredients[0])
+            )
+        build.assert_not_called()
+        start_rebuild.assert_called_once()
+        cookable_index.build()
+        self.assertIn((self.recipe.pk, 1, 1), self.rank(self.ingredients[3]))
+
+    def test_saved_ingredient_skipped_in_bulk_block(self):
+        with mock.patch('api.signals.refresh_cookable') as refresh:
+            with bulk_changes():
+                RecipeIngredient.objects.create(
+                    recipe=self.recipe, ingredient=self.ingredients[1],
+                    amount=1,
+                )
+            refresh.assert_not_called()
+            RecipeIngredient.objects.create(
+                recipe=self.recipe, ingredient=self.ingredients[2], amount=1
+            )
+            refresh.assert_called_once_with([self.recipe.pk])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeIngredientsTests(FoodgramTestCase):
+    """Запись ингредиентов рецепта по разнице с сохранёнными."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('cook')
+        cls.tag = cls.create_tag()
+        cls.ingredients = cls.create_ingredients(100)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def payload(self, amounts, **extra):
+        return {
+            'tags': [self.tag.pk],
+            'ingredients': [
+                {'id': self.ingredients[number].pk, 'amount': amount}
+                for number, amount in amounts.items()
+            ],
+            **extra,
+        }
+
+    def patch(self, recipe, amounts):
+        return self.client.patch(
+            f'/api/recipes/{recipe.pk}/', self.payload(amounts),
+            format='json',
+        )
+
+    def rows(self, recipe):
+        return {
+            row.ingredient_id: (row.pk, row.amount)
+            for row in recipe.recipeingredients.all()
+        }
+
+    def test_diff(self):
+        recipe = self.create_recipe(
+            self.user, ingredients=self.ingredients[:3]
+        )
+        before = self.rows(recipe)
+        response = self.patch(recipe, {0: 10, 1: 20, 3: 5})
+        self.assertEqual(response.status_code, 200)
+        after = self.rows(recipe)
+        first, second, third, fourth = (
+            ingredient.pk for ingredient in self.ingredients[:4]
+        )
+        self.assertEqual(after[first], before[first])
+        self.assertEqual(after[second], (before[second][0], 20))
+        self.assertNotIn(third, after)
+        self.assertEqual(after[fourth][1], 5)
+        self.assertEqual(
+            sorted(item['amount'] for item in response.data['ingredients']),
+            [5, 10, 20],
+        )
+
+    def test_unchanged(self):
+        recipe = self.create_recipe(
+            self.user, ingredients=self.ingredients[:3]
+        )
+        before = self.rows(recipe)
+        response = self.patch(recipe, {0: 10, 1: 10, 2: 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.rows(recipe), before)
+
+    def test_update_query_count(self):
+        """Все ингредиенты рецепта заменяются на другие: количество
+        запросов не зависит от числа удалённых и добавленных строк."""
+
+        self.patch(self.create_recipe(self.user), {0: 1})
+        counts = {}
+        for count in (1, 10, 50):
+            recipe = self.create_recipe(
+                self.user, ingredients=self.ingredients[:count]
+            )
+            amounts = {number: 7 for number in range(count, 2 * count)}
+            with CaptureQueriesContext(connection) as context:
+                response = self.patch(recipe, amounts)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                set(self.rows(recipe)),
+                {
+                    ingredient.pk
+                    for ingredient in self.ingredients[count:2 * count]
+                },
+            )
+            counts[count] = len(context.captured_queries)
+        self.assertEqual(len(set(counts.values())), 1, counts)
+
+    def test_create_query_count(self):
+        counts = {}
+        for count in (1, 10, 50):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(
+                    '/api/recipes/',
+                    self.payload(
+                        {number: 7 for number in range(count)},
+                        image=IMAGE,
+                        name=f'Рецепт {count}',
+                        text='Текст',
+                        cooking_time=5,
+                    ),
+                    format='json',
+                )
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(len(response.data['ingredients']), count)
+            counts[count] = len(context.captured_queries)
+        self.assertEqual(len(set(counts.values())), 1, counts)
+
+
+@override_settings(IMAGE_PROCESSING_WORKERS=0, IMAGE_PROCESSING_JOBS=False)
+class ImageStorageTests(FoodgramTestCase):
+    """Изображение рецепта записывается в хранилище только после
+    фиксации транзакции."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('cook')
+        cls.tag = cls.create_tag()
+        cls.ingredient, = cls.create_ingredients(1)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def files(self):
+        return sorted(
+            os.path.relpath(os.path.join(path, name), self.media_root)
+            for path, _, names in os.walk(self.media_root)
+            for name in names
+        )
+
+    def post(self, **extra):
+        return self.client.post(
+            '/api/recipes/',
+            {
+                'tags': [self.tag.pk],
+                'ingredients': [{'id': self.ingredient.pk, 'amount': 1}],
+                'image': IMAGE,
+                'name': 'Рецепт',
+                'text': 'Текст',
+                'cooking_time': 5,
+                **extra,
+            },
+            format='json',
+        )
+
+    def test_invalid_request_leaves_no_files(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post(tags=[])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.files(), [])
+
+    def test_stored_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.post()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.files(), [])
+        recipe = Recipe.objects.get()
+        self.assertEqual(
+            thumbnail_url(recipe.image, 'card'), recipe.image.url
+        )
+        for callback in callbacks:
+            callback()
+        self.assertIn(recipe.image.name, self.files())
+        self.assertEqual(len(self.files()), 1 + len(settings.IMAGE_THUMBNAILS))
+        self.assertNotEqual(
+            thumbnail_url(recipe.image, 'card'), recipe.image.url
+        )
+
+    def test_name_returned_by_storage(self):
+        save = default_storage.save
+
+        def save_with_suffix(name, content, **kwargs):
+            if name.startswith(IMAGES_DIR):
+                name = name.replace('.', '_copy.')
+            return save(name, content, **kwargs)
+
+        with mock.patch.object(
+            default_storage, 'save', side_effect=save_with_suffix
+        ), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.post().status_code, 201)
+        name = Recipe.objects.get().image.name
+        self.assertTrue(name.endswith('_copy.webp'))
+        self.assertIn(name, self.files())
+
+    def test_thumbnails_job(self):
+        missing = f'{IMAGES_DIR}{"0" * 64}.webp'
+        self.assertIsNone(thumbnails_job(Job(params={'name': missing})))
+        broken = default_storage.save(missing, ContentFile(b'not an image'))
+        result = thumbnails_job(Job(params={'name': broken}))
+        self.assertEqual(result['status'], Job.FAILED)
+
+
+class BulkResolutionTests(FoodgramTestCase):
+    """Проверка id тегов и ингредиентов рецепта одним запросом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('cook')
+        cls.tags = [cls.create_tag('breakfast'), cls.create_tag('dinner')]
+        cls.ingredients = cls.create_ingredients(50)
+        cls.recipe = cls.create_recipe(
+            cls.user, ingredients=cls.ingredients[:1], tags=cls.tags[:1]
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def patch(self, tags, ingredients):
+        return self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/',
+            {
+                'tags': tags,
+                'ingredients': [
+                    {'id': pk, 'amount': 5} for pk in ingredients
+                ],
+            },
+            format='json',
+        )
+
+    def validate(self, tags, ingredients):
+        serializer = WriteRecipeSerializer(
+            self.recipe,
+            data={
+                'tags': tags,
+                'ingredients': [
+                    {'id': pk, 'amount': 5} for pk in ingredients
+                ],
+            },
+            partial=True,
+        )
+        return serializer.is_valid(), serializer.errors
+
+    def test_unknown_ids_reported_together(self):
+        known = self.ingredients[0].pk
+        response = self.patch([self.tags[0].pk], [known, 9001, 9000])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data['ingredients'],
+            ['Объекты с id [9000, 9001] не существуют!'],
+        )
+        response = self.patch([self.tags[0].pk, 777], [known])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data['tags'], ['Объекты с id [777] не существуют!']
+        )
+
+    def test_not_integer_ids(self):
+        response = self.patch(['breakfast'], [self.ingredients[0].pk])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data['tags'], ['Id должны быть целыми числами!']
+        )
+
+    def test_duplicates(self):
+        tag, ingredient = self.tags[0].pk, self.ingredients[0].pk
+        response = self.patch([tag], [ingredient, ingredient])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data['non_field_errors'],
+            ['Ингредиенты не должны повторяться!'],
+        )
+        response = self.patch([tag, tag], [ingredient])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data['non_field_errors'], ['Теги не должны повторяться!']
+        )
+
+    def test_query_count(self):
+        """Один запрос на теги и один на ингредиенты при любом их числе."""
+
+        for count in (1, 50):
+            with self.subTest(count=count), self.assertNumQueries(2):
+                valid, errors = self.validate(
+                    [tag.pk for tag in self.tags],
+                    [ingredient.pk for ingredient in self.ingredients[:count]],
+                )
+            self.assertTrue(valid, errors)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class CountersTests(FoodgramTestCase):
+    """Счётчики поддерживаются сигналами моделей при любых изменениях."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.reader = cls.create_user('reader')
+        cls.tag = cls.create_tag()
+        cls.ingredient, = cls.create_ingredients(1)
+
+    def counters(self):
+        return {
+            'recipes': list(
+                Recipe.objects.order_by('pk').values_list(
+                    'favorites_count', 'in_carts_count'
+                )
+            ),
+            'author': User.objects.values_list(
+                'recipes_count', 'followers_count'
+            ).get(pk=self.author.pk),
+        }
+
+    def test_create_response(self):
+        self.client.force_authenticate(self.author)
+        Subscription.objects.create(
+            subscriber=self.reader, subscriptions=self.author
+        )
+        response = self.client.post(
+            '/api/recipes/',
+            {
+                'tags': [self.tag.pk],
+                'ingredients': [{'id': self.ingredient.pk, 'amount': 1}],
+                'image': IMAGE,
+                'name': 'Рецепт',
+                'text': 'Текст',
+                'cooking_time': 5,
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['author']['recipes_count'], 1)
+        self.assertEqual(response.data['author']['followers_count'], 1)
+
+    def test_model_changes_and_cascades(self):
+        recipe = self.create_recipe(self.author)
+        Favorite.objects.create(user=self.reader, favorites=recipe)
+        Purchase.objects.create(user=self.reader, recipe=recipe)
+        Subscription.objects.create(
+            subscriber=self.reader, subscriptions=self.author
+        )
+        self.assertEqual(
+            self.counters(), {'recipes': [(1, 1)], 'author': (1, 1)}
+        )
+        self.reader.delete()
+        self.assertEqual(
+            self.counters(), {'recipes': [(0, 0)], 'author': (1, 0)}
+        )
+        recipe.delete()
+        self.assertEqual(self.counters(), {'recipes': [], 'author': (0, 0)})
+
+
+class TokenAuthenticationTests(FoodgramTestCase):
+    """Кэш аутентификации хранит только нужные поля пользователя."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('user')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def authenticate(self):
+        return CachedTokenAuthentication().authenticate_credentials(
+            self.token.key
+        )[0]
+
+    def test_cached_projection(self):
+        self.authenticate()
+        values = token_cache.get(self.token.key)
+        self.assertNotIn('password', values)
+        self.assertNotIn(self.user.password, values.values())
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(user.email, self.user.email)
+        self.assertTrue(
+            {'password', 'recipes_count', 'followers_count'}
+            <= user.get_deferred_fields()
+        )
+
+    def test_counter_changes_keep_cache(self):
+        """Счётчики не кэшируются: их изменение не сбрасывает кэш
+        и сразу видно в ответе."""
+
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        cached = token_cache.get(self.token.key)
+        self.assertIsNotNone(cached)
+        reader = self.create_user('reader')
+        with CaptureQueriesContext(connection) as queries:
+            Subscription.objects.create(
+                subscriber=reader, subscriptions=self.user
+            )
+        self.assertFalse(any(
+            'authtoken_token' in query['sql'] for query in queries
+        ))
+        self.create_recipe(self.user)
+        self.assertEqual(token_cache.get(self.token.key), cached)
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.data['recipes_count'], 1)
+        self.assertEqual(response.data['followers_count'], 1)
+
+    def test_set_password_saves_only_password(self):
+        self.client.get('/api/users/me/')
+        User.objects.filter(pk=self.user.pk).update(first_name='Новое')
+        response = self.client.post(
+            '/api/users/set_password/',
+            {'current_password': 'password', 'new_password': 'Pa55-word!'},
+        )
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Новое')
+        self.assertTrue(self.user.check_password('Pa55-word!'))
+        self.assertIsNone(token_cache.get(self.token.key))
+
+    def two_processes(self):
+        """Кэши токенов двух процессов с общим кэшем: запросы
+        аутентифицирует один, сигналы сбрасывают записи в другом."""
+
+        this, other = (
+            TokenCache(max_size=100, ttl=60, shared_alias='default')
+            for _ in range(2)
+        )
+        for patcher in (
+            mock.patch('api.signals.token_cache', this),
+            mock.patch('api.authentication.token_cache', other),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return this, other
+
+    def test_logout_in_other_process(self):
+        this, other = self.two_processes()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        self.assertIsNotNone(other.get(self.token.key))
+        self.assertIsNotNone(this.get(self.token.key))
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(other.get(self.token.key))
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_password_and_deactivation_in_other_process(self):
+        this, other = self.two_processes()
+        for change in (
+            lambda user: user.set_password('Pa55-word!'),
+            lambda user: setattr(user, 'is_active', False),
+        ):
+            self.assertEqual(
+                self.client.get('/api/users/me/').status_code, 200
+            )
+            with self.assertNumQueries(0):
+                self.authenticate()
+            change(self.user)
+            self.user.save()
+            self.assertIsNone(other.get(self.token.key))
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+
+class QueryBudgetTests(FoodgramTestCase):
+    """Команда check_query_counts: бюджеты запросов эндпоинтов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = cls.create_user('reader')
+        tag = cls.create_tag()
+        ingredients = cls.create_ingredients(3)
+        for number in range(4):
+            author = cls.create_user(f'author{number}')
+            if number:
+                Subscription.objects.create(
+                    subscriber=cls.reader, subscriptions=author
+                )
+            for recipe_number in range(3):
+                recipe = cls.create_recipe(
+                    author, f'Рецепт {number} {recipe_number}',
+                    ingredients, [tag]
+                )
+                if recipe_number:
+                    Favorite.objects.create(user=cls.reader, favorites=recipe)
+                    Purchase.objects.create(user=cls.reader, recipe=recipe)
+
+    def check_counts(self):
+        stdout = StringIO()
+        stderr = StringIO()
+        try:
+            call_command(
+                'check_query_counts', '--page-size', '5',
+                stdout=stdout, stderr=stderr,
+            )
+        finally:
+            self.stderr = stderr.getvalue()
+        return stdout.getvalue()
+
+    def test_endpoints_within_budget(self):
+        output = self.check_counts()
+        self.assertEqual(self.stderr, '')
+        for method, url, _ in ENDPOINTS:
+            self.assertIn(f'{method.upper()} {url}: ', output)
+
+    def test_exceeded_budget_reported(self):
+        endpoints = (('get', '/api/recipes/?limit={limit}', 1),)
+        with mock.patch(
+            'api.management.commands.check_query_counts.ENDPOINTS',
+            endpoints,
+        ), self.assertRaisesMessage(
+            CommandError, 'Эндпоинтов с ошибками: 1.'
+        ):
+            self.check_counts()
+        self.assertIn('запросов при бюджете 1', self.stderr)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Только для PostgreSQL')
+class QueryPlanTests(FoodgramTestCase):
+    """Команда check_query_plans на настоящих планах EXPLAIN."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.reader = cls.create_user('reader')
+        cls.tag = cls.create_tag()
+        ingredients = cls.create_ingredients(3)
+        for number in range(3):
+            recipe = cls.create_recipe(
+                cls.author, f'Рецепт {number}', ingredients, [cls.tag]
+            )
+            Favorite.objects.create(user=cls.reader, favorites=recipe)
+            Purchase.objects.create(user=cls.reader, recipe=recipe)
+        Subscription.objects.create(
+            subscriber=cls.reader, subscriptions=cls.author
+        )
+
+    def check_plans(self):
+        stdout = StringIO()
+        stderr = StringIO()
+        try:
+            call_command('check_query_plans', stdout=stdout, stderr=stderr)
+        finally:
+            self.stderr = stderr.getvalue()
+        return stdout.getvalue()
+
+    def test_hot_queries_use_indexes(self):
+        output = self.check_plans()
+        for name in get_hot_queries(self.author, self.tag):
+            self.assertIn(f'{name}: OK', output)
+        self.assertEqual(self.stderr, '')
+
+    def test_missing_index_reported(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX recipe_created_at_id_idx')
+        with self.assertRaisesMessage(
+            CommandError, 'Чтение таблиц целиком в запросах: 1.'
+        ):
+            self.check_plans()
+        self.assertIn(
+            'Лента рецептов: Index Scan on recipes_recipe', self.stderr
+        )
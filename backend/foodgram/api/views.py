@@ -1,35 +1,49 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch, Subquery
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.serializers import SetPasswordSerializer
-from recipes.models import (Favorite, Ingredient, Purchase, Recipe,
-                            RecipeIngredient, Tag)
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.platypus import Paragraph, SimpleDocTemplate
-from reportlab.platypus.tables import Table
+from recipes.models import Favorite, Ingredient, Job, Purchase, Recipe, Tag
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from users.models import Subscription, User
 
+from .autocomplete import ingredient_index
+from .cache import (cache_content, get_content, get_user_digest, make_etag,
+                    rows_digest, set_user_digest)
+from .cookable import rank_recipes
+from .exports import (get_shopping_list, render_shopping_list,
+                      submit_shopping_list)
+from .facets import get_facets
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import FoodgramPagination
+from .mixins import AsyncReadMixin, ConditionalCatalogMixin
+from .pagination import FoodgramPagination, RankingPagination
 from .permissions import IsAuthorOrAdminOrReadOnly
-from .serializers import (CreateUserSerializer, IngredientSerializer,
-                          ReadRecipeSerializer, SimplyRecipeSerializer,
+from .renderers import (SHOPPING_LIST_RENDERERS, CSVRenderer, PDFRenderer,
+                        ShoppingListNegotiation, ShoppingListRenderer,
+                        TXTRenderer)
+from .serializers import (CookableQuerySerializer, CreateUserSerializer,
+                          IngredientSerializer, ReadRecipeSerializer,
+                          ShoppingListJobCreateSerializer,
+                          ShoppingListJobSerializer, SimplyRecipeSerializer,
                           SubscribeSerializer, TagSerializer, UserSerializer,
                           WriteRecipeSerializer)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(
+    AsyncReadMixin, ConditionalCatalogMixin, viewsets.ReadOnlyModelViewSet
+):
     """Вьюсет для работы с тегами."""
 
+    catalog = 'tags'
+    renderer_classes = (JSONRenderer,)
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
@@ -37,9 +51,13 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     ordering_fields = 'name'
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
-    """Вьюсет для работы с тегами."""
+class IngredientViewSet(
+    AsyncReadMixin, ConditionalCatalogMixin, viewsets.ReadOnlyModelViewSet
+):
+    """Вьюсет для работы с ингредиентами."""
 
+    catalog = 'ingredients'
+    renderer_classes = (JSONRenderer,)
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
@@ -47,24 +65,49 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_class = IngredientFilter
     pagination_class = None
 
+    def get_limit(self):
+        """Метод возвращает значение query-параметра limit."""
+
+        try:
+            limit = int(self.request.query_params['limit'])
+        except (KeyError, ValueError):
+            return None
+        return limit if limit > 0 else None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(self.search, request, *args, **kwargs)
+
+    def search(self, request, *args, **kwargs):
+        """Список ингредиентов с автодополнением по названию."""
+
+        name = request.query_params.get('name')
+        limit = self.get_limit()
+        if name and settings.INGREDIENT_SEARCH_BACKEND == 'memory':
+            return Response(ingredient_index.search(name, limit))
+        queryset = self.filter_queryset(self.get_queryset())
+        if limit is not None:
+            queryset = queryset[:limit]
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(AsyncReadMixin, viewsets.ModelViewSet):
     """Вьюсет для работы с рецептами."""
 
     permission_classes = (IsAuthorOrAdminOrReadOnly,)
     pagination_class = FoodgramPagination
+    keyset_ordering = ('-created_at', '-id')
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    read_actions = ('list', 'retrieve', 'facets', 'cookable')
+    async_actions = read_actions
 
     def get_queryset(self):
+        if self.action not in self.read_actions:
+            return Recipe.objects.all()
         if self.request.user.is_authenticated:
-            queryset = Recipe.objects.add_user_annotations(
-                self.request.user.id
-            )
-        else:
-            queryset = Recipe.objects.all_recipes()
-
-        return queryset
+            return Recipe.objects.add_user_annotations(self.request.user)
+        return Recipe.objects.all_recipes()
 
     def get_serializer_class(self):
         """Метод  для определения класса сериализатора."""
@@ -73,6 +116,62 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return WriteRecipeSerializer
         return ReadRecipeSerializer
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Ошибки выгрузки списка покупок отдаются в json, а не с
+        типом содержимого выбранного формата."""
+
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if isinstance(response, Response) and isinstance(
+            response.accepted_renderer, ShoppingListRenderer
+        ):
+            response.accepted_renderer = JSONRenderer()
+            response.accepted_media_type = JSONRenderer.media_type
+        return response
+
+    @action(detail=False, methods=['GET'], url_name='facets')
+    def facets(self, request):
+        """Метод  для поиска рецептов с количеством вариантов фильтров."""
+
+        response = self.list(request)
+        filterset = self.filterset_class(
+            request.query_params,
+            queryset=Recipe.objects.all(),
+            request=request,
+        )
+        filterset.is_valid()
+        response.data['facets'] = get_facets(filterset)
+        return response
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        url_name='cookable',
+        url_path='cookable',
+        pagination_class=RankingPagination,
+    )
+    def cookable(self, request):
+        """Метод  для подбора рецептов по имеющимся ингредиентам."""
+
+        serializer = CookableQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        matches = self.paginate_queryset(
+            rank_recipes(serializer.validated_data['ingredients'])
+        )
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in matches]
+        )
+        matches = [match for match in matches if match[0] in recipes]
+        data = self.get_serializer(
+            [recipes[recipe_id] for recipe_id, _, _ in matches], many=True
+        ).data
+        for item, (_, matched, total) in zip(data, matches):
+            item['coverage'] = round(matched / total, 3)
+            item['missing_count'] = total - matched
+        return self.get_paginated_response(data)
+
+    @transaction.atomic
     def add_method(self, model, recipe, args):
         """Метод  для добавления в избранное или список покупок."""
 
@@ -85,6 +184,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
         serializer = SimplyRecipeSerializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
     def delete_method(self, model, args):
         """Метод  для удаления из избранного или списка покупок."""
 
@@ -152,81 +252,126 @@ class RecipeViewSet(viewsets.ModelViewSet):
         args = {'user': self.request.user, 'recipe': recipe}
         return self.delete_method(Purchase, args)
 
-    @staticmethod
-    def generate_pdf(pdf, ingredients):
-        """Метод, генерирующий pdf-файл."""
+    @action(
+        detail=False,
+        methods=['GET'],
+        url_name='download_shopping_cart',
+        url_path='download_shopping_cart',
+        permission_classes=[IsAuthenticated],
+        renderer_classes=[PDFRenderer, CSVRenderer, TXTRenderer],
+        content_negotiation_class=ShoppingListNegotiation,
+    )
+    def download_shopping_cart(self, request):
+        """Метод  для формирования списка покупок в pdf, csv или txt."""
+
+        renderer = request.accepted_renderer
+        export_format = renderer.format
+        user = self.request.user
+        rows = None
+        if (digest := get_user_digest(user.id)) is None:
+            rows = list(get_shopping_list(user))
+            digest = rows_digest(rows)
+            set_user_digest(user.id, digest)
+        etag = make_etag(digest, export_format)
+        if not_modified := get_conditional_response(
+            request, etag=quote_etag(etag)
+        ):
+            return not_modified
+        if (content := get_content(etag)) is not None:
+            content = [content]
+        else:
+            if rows is None:
+                rows = list(get_shopping_list(user))
+            content = cache_content(
+                etag, render_shopping_list(rows, export_format)
+            )
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="purchase.{export_format}"'
+        )
+        response['ETag'] = quote_etag(etag)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @action(
+        detail=False,
+        methods=['POST'],
+        url_name='shopping_cart_jobs',
+        url_path='download_shopping_cart/jobs',
+        permission_classes=[IsAuthenticated],
+    )
+    def shopping_cart_jobs(self, request):
+        """Метод  для постановки формирования списка покупок в очередь."""
 
-        pdfmetrics.registerFont(TTFont('DejaVuSerif', 'DejaVuSerif.ttf'))
-        pdfmetrics.registerFont(
-            TTFont('DejaVuSerifBold', 'DejaVuSerif-Bold.ttf')
+        serializer = ShoppingListJobCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job, created = submit_shopping_list(
+            request.user, serializer.validated_data['format']
         )
-        doc_obj = []
-        style = ParagraphStyle(
-            name='Normal',
-            fontName='DejaVuSerifBold',
-            fontSize=15,
-            spaceAfter=14,
-            spaceBefore=20,
+        serializer = ShoppingListJobSerializer(
+            job, context={'request': request}
         )
-        doc_obj.append(Paragraph('Список покупок:', style=style))
-        rows = []
-        rows.append(('Ингредиент', 'Количество', 'Ед.измерения'))
-        for ingredient in ingredients:
-            rows.append(
-                (
-                    ingredient['ingredient__name'],
-                    ingredient['sum_amount'],
-                    ingredient['ingredient__measurement_unit'],
-                )
-            )
-        table = Table(
-            rows,
-            colWidths=[340, 100, 100],
-            rowHeights=20,
+        return Response(
+            serializer.data,
+            status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK,
         )
-        table.setStyle(
-            [
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.darkcyan),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSerif'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-                ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-            ]
+
+    def get_job(self, job_id):
+        """Метод возвращает задачу списка покупок пользователя."""
+
+        return get_object_or_404(
+            Job.objects.defer('result'),
+            pk=job_id,
+            kind=Job.SHOPPING_LIST,
+            user=self.request.user,
         )
-        doc_obj.append(table)
-        pdf.build(doc_obj)
-        return pdf
 
     @action(
         detail=False,
         methods=['GET'],
-        url_name='download_shopping_cart',
-        url_path='download_shopping_cart',
+        url_name='shopping_cart_job',
+        url_path=r'download_shopping_cart/jobs/(?P<job_id>\d+)',
         permission_classes=[IsAuthenticated],
     )
-    def download_shopping_cart(self, request):
-        """Метод  для формирования списка покупок в pdf-файле."""
+    def shopping_cart_job(self, request, job_id):
+        """Метод  для получения статуса задачи списка покупок."""
+
+        serializer = ShoppingListJobSerializer(
+            self.get_job(job_id), context={'request': request}
+        )
+        return Response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        url_name='shopping_cart_job_download',
+        url_path=r'download_shopping_cart/jobs/(?P<job_id>\d+)/download',
+        permission_classes=[IsAuthenticated],
+    )
+    def shopping_cart_job_download(self, request, job_id):
+        """Метод  для скачивания готового списка покупок."""
 
-        ingredients = (
-            RecipeIngredient.objects.filter(
-                recipe__purchases_recipe__user=self.request.user
+        job = self.get_job(job_id)
+        if job.status != Job.DONE:
+            return Response(
+                {'errors': 'Список покупок ещё не сформирован!'},
+                status=status.HTTP_409_CONFLICT,
             )
-            .values('ingredient__name', 'ingredient__measurement_unit')
-            .annotate(sum_amount=Sum('amount'))
+        renderer = SHOPPING_LIST_RENDERERS[job.params['format']]
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        response = HttpResponse(
+            Job.objects.values_list('result', flat=True).get(pk=job.pk),
+            content_type=content_type,
         )
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename="purchase.pdf"'
-        pdf = SimpleDocTemplate(
-            response,
-            pagesize=A4,
-            rightMargin=20,
-            leftMargin=20,
-            topMargin=15,
-            bottomMargin=15,
+        response['Content-Disposition'] = (
+            f'attachment; filename="purchase.{renderer.format}"'
         )
-        self.generate_pdf(pdf, ingredients)
+        response['Cache-Control'] = 'private, no-cache'
         return response
 
 
@@ -236,18 +381,62 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     permission_classes = (AllowAny,)
     pagination_class = FoodgramPagination
+    keyset_ordering = ('id',)
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return UserSerializer
         return CreateUserSerializer
 
+    def get_serializer_context(self):
+        return {
+            **super().get_serializer_context(),
+            'recipes_limit': self.get_recipes_limit(),
+        }
+
+    def get_recipes_limit(self):
+        """Метод возвращает значение query-параметра recipes_limit."""
+
+        try:
+            recipes_limit = int(self.request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return recipes_limit if recipes_limit >= 0 else None
+
+    def annotate_subscriptions(self, queryset):
+        """Метод добавляет к авторам количество рецептов, признак подписки
+        и срез последних рецептов, загружаемый одним запросом."""
+
+        recipes_limit = self.get_recipes_limit()
+        recipes = Recipe.objects.only(
+            'id', 'name', 'image', 'cooking_time', 'author'
+        )
+        if recipes_limit is not None:
+            recipes = recipes.filter(
+                pk__in=Subquery(
+                    Recipe.objects.filter(
+                        author=OuterRef('author')
+                    ).values('pk')[:recipes_limit]
+                )
+            )
+        return queryset.annotate(
+            is_subscribed=Exists(
+                Subscription.objects.filter(
+                    subscriber=self.request.user,
+                    subscriptions=OuterRef('pk'),
+                )
+            ),
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        ).order_by('id')
+
     @action(
         detail=False, methods=['GET'], permission_classes=[IsAuthenticated]
     )
     def me(self, request):
         """Метод для получения профиля пользователя."""
         user = self.request.user
+        user.refresh_from_db(fields=('recipes_count', 'followers_count'))
         serializer = self.get_serializer(user)
         return Response(serializer.data)
 
@@ -262,7 +451,7 @@ class UserViewSet(viewsets.ModelViewSet):
         )
         serializer.is_valid(raise_exception=True)
         user.set_password(serializer.validated_data['new_password'])
-        user.save()
+        user.save(update_fields=('password',))
         return Response(
             'Пароль успешно изменен.', status=status.HTTP_204_NO_CONTENT
         )
@@ -285,11 +474,13 @@ class UserViewSet(viewsets.ModelViewSet):
                 {'errors': 'Ошибка подписки!'},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        _ = Subscription.objects.create(
-            subscriber=self.request.user, subscriptions=user
-        )
+        with transaction.atomic():
+            Subscription.objects.create(
+                subscriber=self.request.user, subscriptions=user
+            )
         serializer = SubscribeSerializer(
-            self.request.user, context={'request': request}
+            self.annotate_subscriptions(User.objects.filter(pk=user.pk)).get(),
+            context=self.get_serializer_context(),
         )
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -318,11 +509,11 @@ class UserViewSet(viewsets.ModelViewSet):
     def subscriptions(self, request):
         """Подписки пользователя."""
 
-        subscriptions = User.objects.filter(
-            subscriptions__subscriber=self.request.user
+        subscriptions = self.annotate_subscriptions(
+            User.objects.filter(subscriptions__subscriber=self.request.user)
         )
         limit_pages = self.paginate_queryset(subscriptions)
         serializer = SubscribeSerializer(
-            limit_pages, many=True, context={'request': request}
+            limit_pages, many=True, context=self.get_serializer_context()
         )
         return self.get_paginated_response(serializer.data)
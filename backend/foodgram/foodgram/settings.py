@@ -68,7 +68,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -76,6 +76,16 @@ REST_FRAMEWORK = {
 }
 
 
+# Без общего кэша (SHARED_ALIAS) каждый процесс хранит токены в своей
+# памяти, и выход или смена пароля в другом процессе действуют в нём
+# только через TTL секунд. С общим кэшем они действуют сразу.
+TOKEN_CACHE = {
+    'MAX_SIZE': int(os.getenv('TOKEN_CACHE_MAX_SIZE', 10000)),
+    'TTL': int(os.getenv('TOKEN_CACHE_TTL', 5)),
+    'SHARED_ALIAS': os.getenv('TOKEN_CACHE_SHARED_ALIAS') or None,
+    'REPORT_EVERY': int(os.getenv('TOKEN_CACHE_REPORT_EVERY', 1000)),
+}
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'HIDE_USERS': False,
@@ -102,6 +112,78 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    },
+    'exports': {
+        'BACKEND': os.getenv(
+            'EXPORTS_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.getenv('EXPORTS_CACHE_LOCATION', 'exports'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('EXPORTS_CACHE_MAX_ENTRIES', 200)),
+        },
+    },
+    'cards': {
+        'BACKEND': os.getenv(
+            'CARDS_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.getenv('CARDS_CACHE_LOCATION', 'cards'),
+        'TIMEOUT': int(os.getenv('CARDS_CACHE_TIMEOUT', 3600)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CARDS_CACHE_MAX_ENTRIES', 5000)),
+        },
+    },
+}
+
+EXPORTS_CACHE_ALIAS = 'exports'
+
+CARDS_CACHE_ALIAS = 'cards'
+
+# Наибольший размер файла в кэше выгрузок. Кэш в памяти процесса
+# занимает не больше MAX_ENTRIES * EXPORTS_CACHE_MAX_SIZE байт,
+# по умолчанию 50 МиБ; pdf со 100 ингредиентами весит около 50 КиБ.
+EXPORTS_CACHE_MAX_SIZE = int(
+    os.getenv('EXPORTS_CACHE_MAX_SIZE', 256 * 1024)
+)
+
+CATALOG_CACHE_MAX_AGE = int(os.getenv('CATALOG_CACHE_MAX_AGE', 60))
+
+# Сколько секунд процесс использует версию справочника из кэша, прежде
+# чем перечитать её из базы данных.
+CATALOG_VERSION_TTL = int(os.getenv('CATALOG_VERSION_TTL', 5))
+
+# Сколько последних записей журнала изменений хранится для каждого
+# справочника. Процесс, отставший сильнее, перестраивает свой индекс.
+CATALOG_CHANGES_KEPT = int(os.getenv('CATALOG_CHANGES_KEPT', 1000))
+
+INGREDIENT_SEARCH_BACKEND = os.getenv('INGREDIENT_SEARCH_BACKEND', 'memory')
+
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 300))
+
+# Полнотекстовый поиск рецептов: конфигурация PostgreSQL, для других баз
+# данных - индекс в памяти процесса с ограничением числа результатов.
+RECIPE_SEARCH_CONFIG = os.getenv('RECIPE_SEARCH_CONFIG', 'russian')
+
+RECIPE_SEARCH_INDEX_TTL = int(os.getenv('RECIPE_SEARCH_INDEX_TTL', 300))
+
+RECIPE_SEARCH_MAX_RESULTS = int(os.getenv('RECIPE_SEARCH_MAX_RESULTS', 1000))
+
+# Подбор рецептов по ингредиентам: memory (индекс в памяти процесса)
+# или database (запрос с группировкой).
+COOKABLE_BACKEND = os.getenv('COOKABLE_BACKEND', 'memory')
+
+COOKABLE_INDEX_TTL = int(os.getenv('COOKABLE_INDEX_TTL', 300))
+
+COOKABLE_MAX_INGREDIENTS = int(os.getenv('COOKABLE_MAX_INGREDIENTS', 100))
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -146,6 +228,55 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = '/media/'
 
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'WEBP')
+
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', 85))
+
+IMAGE_MAX_SIZE = (1920, 1920)
+
+IMAGE_MAX_UPLOAD_SIZE = int(
+    os.getenv('IMAGE_MAX_UPLOAD_SIZE', 5 * 1024 * 1024)
+)
+
+IMAGE_THUMBNAILS = {
+    'card': (600, 400),
+    'list': (300, 200),
+    'admin': (100, 100),
+}
+
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', 2))
+
+# Миниатюры создаются задачами очереди (команда run_jobs).
+IMAGE_PROCESSING_JOBS = os.getenv(
+    'IMAGE_PROCESSING_JOBS', 'False'
+).lower() in ('true', '1', 't')
+
+# Base64 увеличивает размер изображения на треть.
+DATA_UPLOAD_MAX_MEMORY_SIZE = IMAGE_MAX_UPLOAD_SIZE * 4 // 3 + 64 * 1024
+
+# wsgi - синхронные воркеры gunicorn, asgi - воркеры uvicorn
+# и асинхронные представления для чтения рецептов и справочников.
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+
+ASYNC_READ_WORKERS = int(os.getenv('ASYNC_READ_WORKERS', 8))
+
+CPU_WORKERS = int(os.getenv('CPU_WORKERS', os.cpu_count() or 1))
+
+# Очередь фоновых задач в базе данных, выполняется командой run_jobs.
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', 2))
+
+JOBS_POLL_INTERVAL = float(os.getenv('JOBS_POLL_INTERVAL', 1))
+
+JOBS_MAX_ATTEMPTS = int(os.getenv('JOBS_MAX_ATTEMPTS', 3))
+
+JOBS_RETRY_DELAY = int(os.getenv('JOBS_RETRY_DELAY', 10))
+
+JOBS_LEASE = int(os.getenv('JOBS_LEASE', 300))
+
+JOBS_TTL = int(os.getenv('JOBS_TTL', 3600))
+
+JOBS_CLEANUP_INTERVAL = int(os.getenv('JOBS_CLEANUP_INTERVAL', 300))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
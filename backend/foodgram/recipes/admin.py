@@ -1,14 +1,17 @@
-from itertools import chain
-
 from django.contrib import admin
+from django.db.models import Prefetch
 from django.utils.safestring import mark_safe
 
+from .admin_utils import AuthorFilter, EstimatedCountPaginator
+from .images import thumbnail_url
 from .models import (Favorite, Ingredient, Purchase, Recipe, RecipeIngredient,
                      Tag)
+from .search import full_text_search, is_supported
 
 
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
+    autocomplete_fields = ('ingredient',)
 
 
 @admin.register(Recipe)
@@ -26,38 +29,52 @@ class RecipeAdmin(admin.ModelAdmin):
         'text',
         'ingredients_names',
         'cooking_time',
-        'count_favorite'
+        'count_favorite',
+        'in_carts_count',
     )
     search_fields = ('name',)
     list_filter = (
         'tags',
-        'name',
-        'author',
+        AuthorFilter,
     )
     list_display_links = ('name',)
-    readonly_fields = ('preview',)
+    list_select_related = ('author',)
+    readonly_fields = ('preview', 'favorites_count', 'in_carts_count')
+    autocomplete_fields = ('author',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        """Полнотекстовый поиск по индексу в PostgreSQL."""
+
+        if search_term and is_supported():
+            return full_text_search(queryset, search_term), False
+        return super().get_search_results(request, queryset, search_term)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('ingredients', queryset=Ingredient.objects.only('name')),
+            Prefetch('tags', queryset=Tag.objects.only('name')),
+        )
 
     @admin.display(description="В избранном", empty_value="Нет в избранном")
     def count_favorite(self, object):
-        count = object.favorites.count()
-        if count:
-            return count
+        if object.favorites_count:
+            return object.favorites_count
 
     @admin.display(description='Ингредиенты')
     def ingredients_names(self, object):
-        ingredients = object.ingredients.values_list('name')
-        return list(chain.from_iterable(ingredients))
+        return [ingredient.name for ingredient in object.ingredients.all()]
 
     @admin.display(description='Теги')
     def tags_names(self, object):
-        tags = object.tags.values_list('name')
-        return list(chain.from_iterable(tags))
+        return [tag.name for tag in object.tags.all()]
 
     @admin.display(description='Фото рецепта', empty_value='Нет фото')
     def preview(self, object):
         if object.image:
             return mark_safe(
-                f'<img src="{object.image.url}" '
+                f'<img src="{thumbnail_url(object.image, "admin")}" '
                 'style="max-height: 100px; max-width: 100px">'
             )
 
@@ -70,7 +87,7 @@ class TagAdmin(admin.ModelAdmin):
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit')
-    list_filter = ('name', )
+    search_fields = ('name',)
 
 
 admin.site.register(Purchase)
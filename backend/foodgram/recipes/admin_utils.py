@@ -0,0 +1,61 @@
+"""Общие инструменты админки для больших таблиц."""
+from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+ESTIMATE_THRESHOLD = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор, который для таблиц без фильтров берёт оценку
+    количества строк из статистики PostgreSQL вместо COUNT(*)."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] > ESTIMATE_THRESHOLD:
+                return int(row[0])
+        return super().count
+
+
+class InputFilter(admin.SimpleListFilter):
+    """Фильтр с полем ввода вместо списка всех значений."""
+
+    template = 'admin/input_filter.html'
+
+    def lookups(self, request, model_admin):
+        return ((None, None),)
+
+    def choices(self, changelist):
+        query_params = changelist.get_filters_params()
+        query_params.pop(self.parameter_name, None)
+        yield {
+            'value': self.value() or '',
+            'parameter_name': self.parameter_name,
+            'query_params': query_params,
+            'reset_query_string': changelist.get_query_string(
+                remove=[self.parameter_name]
+            ),
+        }
+
+
+class AuthorFilter(InputFilter):
+    title = 'Автор (имя пользователя или email)'
+    parameter_name = 'author'
+
+    def queryset(self, request, queryset):
+        if value := self.value():
+            return queryset.filter(
+                Q(author__username=value) | Q(author__email=value)
+            )
+        return queryset
@@ -0,0 +1,25 @@
+"""Пакетные изменения без построчной обработки сигналов."""
+import threading
+from contextlib import contextmanager
+
+bulk_state = threading.local()
+
+
+@contextmanager
+def bulk_changes():
+    """Блок, в котором построчные сигналы не обрабатываются.
+
+    Код, изменяющий строки пакетно, сам переносит изменения в счётчики,
+    списки покупок и индексы или пересчитывает их после, иначе
+    удаление каждой строки стоило бы отдельных запросов.
+    """
+
+    bulk_state.active = True
+    try:
+        yield
+    finally:
+        bulk_state.active = False
+
+
+def in_bulk_block():
+    return getattr(bulk_state, 'active', False)
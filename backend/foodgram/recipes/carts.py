@@ -0,0 +1,158 @@
+"""Предварительно агрегированные списки покупок пользователей."""
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from .models import CartLine, Purchase, RecipeIngredient
+
+BATCH_SIZE = 1000
+# Строк в одном INSERT ... ON CONFLICT, по три параметра на строку.
+UPSERT_BATCH_SIZE = 300
+
+
+def recipe_amounts(recipe_id, sign=1):
+    """Количество каждого ингредиента рецепта, умноженное на sign."""
+
+    amounts = defaultdict(int)
+    for ingredient_id, amount in RecipeIngredient.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('ingredient_id', 'amount'):
+        amounts[ingredient_id] += sign * amount
+    return amounts
+
+
+def recipe_buyers_query(recipe_id):
+    return Purchase.objects.filter(recipe_id=recipe_id).values('user_id')
+
+
+def recipe_buyers(recipe_id):
+    return list(
+        recipe_buyers_query(recipe_id).values_list('user_id', flat=True)
+    )
+
+
+def add_cart_lines(user_ids, amounts):
+    """Прибавление amounts вида {ingredient_id: количество} к спискам
+    покупок пользователей.
+
+    Одним запросом INSERT ... ON CONFLICT DO UPDATE на пакет строк,
+    работает в PostgreSQL и SQLite.
+    """
+
+    rows = [
+        (user_id, ingredient_id, amount)
+        for user_id in user_ids
+        for ingredient_id, amount in amounts.items()
+        if amount > 0
+    ]
+    table = connection.ops.quote_name(CartLine._meta.db_table)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, ingredient_id, total_amount) '
+                f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} '
+                'ON CONFLICT (user_id, ingredient_id) DO UPDATE SET '
+                f'total_amount = {table}.total_amount + excluded.total_amount',
+                [value for row in batch for value in row],
+            )
+
+
+def subtract_cart_lines(user_ids, amounts):
+    """Вычитание amounts из списков покупок пользователей.
+
+    Только UPDATE существующих строк, затем удаление обнулившихся.
+    user_ids может быть подзапросом.
+    """
+
+    amounts = {pk: amount for pk, amount in amounts.items() if amount > 0}
+    if not amounts:
+        return
+    lines = CartLine.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=amounts
+    )
+    lines.update(
+        total_amount=Greatest(
+            F('total_amount') - Case(
+                *(
+                    When(ingredient_id=pk, then=Value(amount))
+                    for pk, amount in amounts.items()
+                ),
+                output_field=IntegerField(),
+            ),
+            0,
+        )
+    )
+    lines.filter(total_amount__lte=0).delete()
+
+
+def change_recipe_in_carts(recipe_id, deltas):
+    """Перенос изменения ингредиентов рецепта в списки покупок."""
+
+    if not any(deltas.values()):
+        return
+    subtract_cart_lines(
+        recipe_buyers_query(recipe_id),
+        {pk: -delta for pk, delta in deltas.items() if delta < 0},
+    )
+    if any(delta > 0 for delta in deltas.values()):
+        add_cart_lines(recipe_buyers(recipe_id), deltas)
+
+
+def aggregate_cart_lines(purchases):
+    """Строки списков покупок, вычисленные по рецептам в purchases.
+
+    Возвращает словарь {(user_id, ingredient_id): количество}.
+    """
+
+    return {
+        (user_id, ingredient_id): total_amount
+        for user_id, ingredient_id, total_amount in purchases.order_by()
+        .values_list('user_id', 'recipe__recipeingredients__ingredient_id')
+        .annotate(total_amount=Sum('recipe__recipeingredients__amount'))
+        if ingredient_id is not None
+    }
+
+
+def repair_cart_lines(user_ids, dry_run=False):
+    """Сверка строк списков покупок пользователей с агрегацией по
+    Purchase и RecipeIngredient и исправление расхождений.
+
+    Возвращает количество созданных, изменённых и удалённых строк.
+    """
+
+    actual = aggregate_cart_lines(
+        Purchase.objects.filter(user_id__in=user_ids)
+    )
+    new_lines = []
+    changed_lines = []
+    extra_lines = []
+    for line in CartLine.objects.select_for_update().filter(
+        user_id__in=user_ids
+    ):
+        total_amount = actual.pop((line.user_id, line.ingredient_id), None)
+        if total_amount is None:
+            extra_lines.append(line.pk)
+        elif line.total_amount != total_amount:
+            line.total_amount = total_amount
+            changed_lines.append(line)
+    for (user_id, ingredient_id), total_amount in actual.items():
+        new_lines.append(
+            CartLine(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=total_amount,
+            )
+        )
+    if not dry_run:
+        if extra_lines:
+            CartLine.objects.filter(pk__in=extra_lines).delete()
+        if changed_lines:
+            CartLine.objects.bulk_update(
+                changed_lines, ('total_amount',), batch_size=BATCH_SIZE
+            )
+        if new_lines:
+            CartLine.objects.bulk_create(new_lines, batch_size=BATCH_SIZE)
+    return len(new_lines), len(changed_lines), len(extra_lines)
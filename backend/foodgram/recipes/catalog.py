@@ -0,0 +1,93 @@
+"""Версии справочников и индексов, общие для всех процессов."""
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Subquery
+
+from .models import CatalogChange, CatalogVersion
+
+# Версия индекса поиска рецептов в памяти.
+RECIPE_SEARCH_CATALOG = 'recipe_search'
+# Версия индекса подбора рецептов по ингредиентам.
+COOKABLE_CATALOG = 'cookable'
+
+
+def catalog_key(catalog):
+    return f'catalog:shared_version:{catalog}'
+
+
+def get_catalog_version(catalog):
+    """Версия справочника, меняется при каждом изменении его данных.
+
+    Хранится в базе данных и одна для всех процессов. В кэше версия
+    запоминается на CATALOG_VERSION_TTL секунд, поэтому условные
+    запросы обычно обходятся без обращений к базе, а изменение,
+    сделанное в другом процессе, видно не позже чем через это время.
+    """
+
+    key = catalog_key(catalog)
+    if (version := cache.get(key)) is None:
+        version = CatalogVersion.objects.filter(name=catalog).values_list(
+            'version', flat=True
+        ).first() or ''
+        cache.set(key, version, settings.CATALOG_VERSION_TTL)
+    return version
+
+
+def bump_catalog_version(catalog, changes=None):
+    """Смена версии справочника в базе данных, кэш версии
+    сбрасывается после фиксации транзакции.
+
+    Возвращает прежнюю и новую версии. Строка версии блокируется до
+    конца транзакции, поэтому смены версии выстраиваются в цепочку
+    и процесс может проверить, что между прежней и новой версиями
+    не было чужих изменений. Если переданы changes, они записываются
+    в журнал изменений, из которого другие процессы переносят их
+    в свои индексы без перестроения.
+    """
+
+    version = uuid4().hex
+    with transaction.atomic():
+        row, _ = CatalogVersion.objects.select_for_update().get_or_create(
+            name=catalog, defaults={'version': ''}
+        )
+        CatalogVersion.objects.filter(name=catalog).update(version=version)
+        if changes is not None:
+            change = CatalogChange.objects.create(
+                catalog=catalog,
+                previous=row.version,
+                version=version,
+                changes=changes,
+            )
+            CatalogChange.objects.filter(
+                catalog=catalog,
+                pk__lte=change.pk - settings.CATALOG_CHANGES_KEPT,
+            ).delete()
+    key = catalog_key(catalog)
+    transaction.on_commit(lambda: cache.delete(key))
+    return row.version, version
+
+
+def get_catalog_changes(catalog, version):
+    """Изменения справочника после версии version из журнала.
+
+    Возвращает пары (версия, изменения) в порядке смены версий или
+    None, если журнал их не содержит: записи уже удалены или версию
+    сменили без записи в журнал.
+    """
+
+    start = CatalogChange.objects.filter(
+        catalog=catalog, previous=version
+    ).order_by('pk').values('pk')[:1]
+    entries = CatalogChange.objects.filter(
+        catalog=catalog, pk__gte=Subquery(start)
+    ).order_by('pk').values_list('previous', 'version', 'changes')
+    changes = []
+    for previous, next_version, change in entries:
+        if previous != version:
+            break
+        changes.append((next_version, change))
+        version = next_version
+    return changes or None
@@ -0,0 +1,41 @@
+"""Денормализованные счётчики рецептов и пользователей."""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+
+def change_counter(model, pk, counter, delta):
+    """Атомарное изменение счётчика объекта на delta.
+
+    Счётчик не опускается ниже нуля, даже если он разошёлся с данными.
+    """
+
+    model.objects.filter(pk=pk).update(
+        **{counter: Greatest(F(counter) + delta, 0)}
+    )
+
+
+def count_related(related_model, field):
+    """Подзапрос количества строк related_model, ссылающихся на объект."""
+
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('pk'))
+            .values('count')
+        ),
+        0,
+    )
+
+
+def repair_counter(model, counter, related_model, field):
+    """Пересчёт счётчика для всех объектов с расхождением.
+
+    Возвращает количество исправленных строк.
+    """
+
+    actual = count_related(related_model, field)
+    return model.objects.exclude(**{counter: actual}).update(
+        **{counter: actual}
+    )
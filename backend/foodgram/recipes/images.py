@@ -0,0 +1,35 @@
+"""Имена файлов изображений рецептов по хэшу содержимого и адреса
+их миниатюр."""
+import re
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+IMAGES_DIR = 'recipes/images/'
+THUMBNAILS_DIR = 'recipes/thumbnails/'
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+# Хранилище может добавить к занятому имени случайный суффикс.
+HASHED_NAME = re.compile(
+    rf'^{IMAGES_DIR}(?P<digest>[0-9a-f]{{64}})(?:_\w+)?\.(?:webp|jpg)$'
+)
+
+
+def thumbnail_name(digest, size_name):
+    return (
+        f'{THUMBNAILS_DIR}{digest}_{size_name}.'
+        f'{EXTENSIONS[settings.IMAGE_FORMAT]}'
+    )
+
+
+def thumbnail_url(image, size_name):
+    """Адрес миниатюры или исходного изображения для старых файлов
+    и миниатюр, которые ещё не созданы."""
+
+    if not image:
+        return None
+    if (match := HASHED_NAME.match(image.name)) is None:
+        return image.url
+    name = thumbnail_name(match['digest'], size_name)
+    if not default_storage.exists(name):
+        return image.url
+    return default_storage.url(name)
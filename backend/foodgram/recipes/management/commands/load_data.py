@@ -1,9 +1,66 @@
-"""Загрузка json-файла из папки /data/."""
+"""Загрузка ингредиентов из csv- или json-файла из папки /data/."""
+import csv
+import io
 import json
+import time
+from itertools import islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipes.catalog import bump_catalog_version
 from recipes.models import Ingredient
 
+READ_SIZE = 64 * 1024
+
+
+def iter_csv(file):
+    """Построчное чтение csv-файла вида 'название,единица измерения'."""
+
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1]
+
+
+def iter_json(file):
+    """Потоковое чтение json-массива объектов без загрузки файла целиком."""
+
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    while True:
+        chunk = file.read(READ_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise CommandError('Ожидается json-массив ингредиентов!')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item['name'], item['measurement_unit']
+        if not chunk:
+            if buffer[position:].strip():
+                raise CommandError('Файл json повреждён!')
+            return
+
+
+READERS = {
+    '.csv': iter_csv,
+    '.json': iter_json,
+}
+
 
 class Command(BaseCommand):
     help = 'Download ingredients to database'
@@ -12,44 +69,98 @@ class Command(BaseCommand):
         parser.add_argument(
             'path', type=str, help='Select download file location'
         )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of ingredients inserted per query'
+        )
+        parser.add_argument(
+            '--method', choices=('auto', 'bulk', 'copy'), default='auto',
+            help='bulk_create or PostgreSQL COPY (auto: COPY if available)'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Read and validate the file without writing to database'
+        )
+
+    def insert_bulk(self, batch):
+        Ingredient.objects.bulk_create(
+            [
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in batch
+            ],
+            ignore_conflicts=True,
+        )
+
+    def insert_copy(self, batch):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {Ingredient._meta.db_table} (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                buffer,
+            )
 
     def handle(self, *args, **kwargs):
-        path = kwargs['path']
+        path = Path(kwargs['path'])
+        batch_size = kwargs['batch_size']
+        dry_run = kwargs['dry_run']
+        if (reader := READERS.get(path.suffix.lower())) is None:
+            raise CommandError('Поддерживаются только файлы csv и json!')
+        if batch_size < 1:
+            raise CommandError('Размер пакета должен быть больше нуля!')
+        method = kwargs['method']
+        if method == 'auto':
+            method = 'copy' if connection.vendor == 'postgresql' else 'bulk'
+        if method == 'copy' and connection.vendor != 'postgresql':
+            raise CommandError('COPY доступен только для PostgreSQL!')
+        insert = self.insert_copy if method == 'copy' else self.insert_bulk
 
+        seen = set(Ingredient.objects.values_list('name', 'measurement_unit'))
+        existing = len(seen)
+        total = duplicates = created = 0
+        start = time.perf_counter()
         try:
-            with open(path, encoding='utf-8') as file:
-                data = json.load(file)
-                obj = 0
-                for i in data:
-                    name = i['name']
-                    measurement_unit = i['measurement_unit']
-                    try:
-                        print(name, measurement_unit)
-                        ingredient, created = Ingredient.objects.get_or_create(
-                            name=name,
-                            measurement_unit=measurement_unit,
-                        )
-                        if created:
-                            ingredient.save()
-                            self.stdout.write(
-                                self.style.SUCCESS(
-                                    f'Ингредиент {name} сохранен в базе!'
-                                )
-                            )
-                            obj += 1
-                        else:
-                            self.stderr.write(
-                                self.style.NOTICE(
-                                    f'Ингредиент {name} уже есть в базе!'
-                                )
-                            )
-                    except Exception as error:
-                        self.stderr.write(self.style.WARNING(f'{error}'))
-                        raise Exception(error)
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f'Успешно загружены {obj} ингредиентов из {len(data)}.'
+            with open(path, encoding='utf-8', newline='') as file:
+                rows = reader(file)
+                while batch := list(islice(rows, batch_size)):
+                    total += len(batch)
+                    new = []
+                    for row in batch:
+                        if row in seen:
+                            duplicates += 1
+                            continue
+                        seen.add(row)
+                        new.append(row)
+                    if new and not dry_run:
+                        with transaction.atomic():
+                            insert(new)
+                    created += len(new)
+                    self.stdout.write(
+                        f'Обработано {total}, новых {created}', ending='\r'
                     )
-                )
         except FileNotFoundError as error:
-            self.stderr.write(self.style.WARNING(f'{error}'))
+            raise CommandError(error)
+        except (KeyError, IndexError) as error:
+            raise CommandError(f'Неверный формат строки: {error}')
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write('')
+        if created and not dry_run:
+            bump_catalog_version('ingredients')
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{"Проверено" if dry_run else "Загружено"} {created} '
+                f'ингредиентов из {total} '
+                f'(пропущено уже существующих и повторов: {duplicates}, '
+                f'было в базе: {existing}) '
+                f'за {elapsed:.2f} с, {total / (elapsed or 1):.0f} строк/с.'
+            )
+        )
+        if created and not dry_run:
+            self.stdout.write(
+                'Версия справочника ингредиентов обновлена, процессы '
+                'увидят новые ингредиенты в течение '
+                f'{settings.CATALOG_VERSION_TTL} с.'
+            )
@@ -0,0 +1,29 @@
+"""Пересчёт денормализованных счётчиков рецептов и пользователей."""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.counters import repair_counter
+from recipes.models import Favorite, Purchase, Recipe
+from users.models import Subscription, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'favorites'),
+    (Recipe, 'in_carts_count', Purchase, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscription, 'subscriptions'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Recount favorites, purchases, recipes and followers counters'
+
+    def handle(self, *args, **kwargs):
+        for model, counter, related_model, field in COUNTERS:
+            with transaction.atomic():
+                repaired = repair_counter(
+                    model, counter, related_model, field
+                )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'{model.__name__}.{counter}: исправлено {repaired}.'
+                )
+            )
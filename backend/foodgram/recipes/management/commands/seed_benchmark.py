@@ -0,0 +1,303 @@
+"""Генерация синтетических данных для нагрузочного тестирования.
+
+Популярность авторов, рецептов и ингредиентов распределена по закону
+Ципфа: немногие авторы получают большую часть подписок, немногие
+рецепты - большую часть избранного и списков покупок. Все пользователи
+создаются с префиксом имени bench_ и паролем benchmark.
+"""
+import random
+import time
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.bulk import bulk_changes
+from recipes.catalog import COOKABLE_CATALOG, bump_catalog_version
+from recipes.models import (Favorite, Ingredient, Purchase, Recipe,
+                            RecipeIngredient, Tag)
+from users.models import Subscription, User
+
+PREFIX = 'bench_'
+PASSWORD = 'benchmark'
+IMAGE = 'recipes/images/benchmark.png'
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+WORDS = (
+    'салат', 'суп', 'пирог', 'рагу', 'каша', 'запеканка', 'омлет',
+    'паста', 'котлеты', 'блины', 'плов', 'соус', 'десерт', 'жаркое',
+)
+TEXT_WORDS = (
+    'добавить', 'нарезать', 'обжарить', 'варить', 'посолить', 'перемешать',
+    'минут', 'масло', 'лук', 'морковь', 'чеснок', 'соль', 'перец', 'вода',
+    'сковорода', 'кастрюля', 'духовка', 'огонь', 'тесто', 'мука', 'яйцо',
+    'молоко', 'сметана', 'сыр', 'мясо', 'курица', 'говядина', 'свинина',
+    'рыба', 'картофель', 'капуста', 'помидор', 'огурец', 'зелень',
+    'укроп', 'петрушка', 'сахар', 'сливки', 'грибы', 'рис', 'гречка',
+    'фасоль', 'тыква', 'кабачок', 'баклажан', 'яблоко', 'лимон', 'мёд',
+    'корица', 'ваниль', 'орехи', 'изюм', 'творог', 'кефир', 'дрожжи',
+    'бульон', 'томатный', 'острый', 'сладкий', 'хрустящий', 'нежный',
+    'запечь', 'тушить', 'остудить', 'подавать', 'украсить', 'взбить',
+    'натереть', 'замесить', 'раскатать', 'процедить', 'мариновать',
+    'имбирь', 'кориандр', 'базилик', 'розмарин', 'тимьян', 'шафран',
+    'кокос', 'манго', 'авокадо', 'киноа', 'булгур', 'нут', 'чечевица',
+)
+
+
+def zipf_weights(size, exponent):
+    """Накопленные веса рангов 1..size для random.choices."""
+
+    return list(
+        accumulate(1 / rank ** exponent for rank in range(1, size + 1))
+    )
+
+
+def sample_distinct(rng, population, cum_weights, count):
+    """До count различных элементов с учётом весов."""
+
+    return set(rng.choices(population, cum_weights=cum_weights, k=count))
+
+
+def per_user(rng, average):
+    """Количество объектов у пользователя: у большинства мало,
+    у немногих много, в среднем около average."""
+
+    return min(int(rng.expovariate(1 / average)), average * 20)
+
+
+class Command(BaseCommand):
+    help = 'Generate users, recipes, subscriptions, favorites and purchases'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, default=8,
+            help='Average number of ingredients in a recipe'
+        )
+        parser.add_argument(
+            '--subscriptions', type=int, default=20,
+            help='Average number of subscriptions per user'
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=30,
+            help='Average number of favorite recipes per user'
+        )
+        parser.add_argument(
+            '--purchases', type=int, default=5,
+            help='Average number of recipes in a shopping cart'
+        )
+        parser.add_argument(
+            '--ingredients', type=int, default=2000,
+            help='Number of ingredients created if there are none'
+        )
+        parser.add_argument(
+            '--skew', type=float, default=1.1,
+            help='Zipf exponent of author, recipe and ingredient popularity'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Delete previously generated data before seeding'
+        )
+
+    def bulk_create(self, model, objects, label=None, **kwargs):
+        """Пакетная вставка из генератора без накопления всех объектов."""
+
+        batch = []
+        created = 0
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                model.objects.bulk_create(batch, **kwargs)
+                created += len(batch)
+                batch = []
+        if batch:
+            model.objects.bulk_create(batch, **kwargs)
+            created += len(batch)
+        label = label or model._meta.verbose_name_plural
+        self.stdout.write(f'{label}: {created}')
+
+    def create_users(self, count):
+        password = make_password(PASSWORD)
+        start = User.objects.filter(username__startswith=PREFIX).count()
+        self.bulk_create(
+            User,
+            (
+                User(
+                    username=f'{PREFIX}{number}',
+                    email=f'{PREFIX}{number}@example.com',
+                    first_name='Имя',
+                    last_name=f'Фамилия{number}',
+                    password=password,
+                )
+                for number in range(start, start + count)
+            ),
+        )
+        return list(
+            User.objects.filter(username__startswith=PREFIX)
+            .order_by('id').values_list('id', flat=True)
+        )
+
+    def get_ingredients(self, count):
+        if not Ingredient.objects.exists():
+            self.bulk_create(
+                Ingredient,
+                (
+                    Ingredient(
+                        name=f'ингредиент {number}',
+                        measurement_unit=self.rng.choice(('г', 'мл', 'шт')),
+                    )
+                    for number in range(count)
+                ),
+            )
+            bump_catalog_version('ingredients')
+        return list(Ingredient.objects.values_list('id', flat=True))
+
+    def get_tags(self):
+        if not Tag.objects.exists():
+            Tag.objects.bulk_create(
+                Tag(name=name, color=color, slug=slug)
+                for name, color, slug in TAGS
+            )
+            bump_catalog_version('tags')
+        return list(Tag.objects.values_list('id', flat=True))
+
+    def create_recipes(self, authors, count):
+        rng = self.rng
+        author_weights = zipf_weights(len(authors), self.skew)
+        text_weights = zipf_weights(len(TEXT_WORDS), self.skew)
+        first_id = Recipe.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
+        self.bulk_create(
+            Recipe,
+            (
+                Recipe(
+                    author_id=author,
+                    name=f'{rng.choice(WORDS).capitalize()} {number}',
+                    text=' '.join(
+                        rng.choices(
+                            TEXT_WORDS,
+                            cum_weights=text_weights,
+                            k=rng.randint(20, 80),
+                        )
+                    ),
+                    cooking_time=rng.randint(5, 180),
+                    image=IMAGE,
+                )
+                for number, author in enumerate(
+                    rng.choices(authors, cum_weights=author_weights, k=count)
+                )
+            ),
+        )
+        return list(
+            Recipe.objects.filter(
+                id__gt=first_id, author__username__startswith=PREFIX
+            ).order_by('id').values_list('id', flat=True)
+        )
+
+    def create_recipe_relations(self, recipes, ingredients, tags, average):
+        rng = self.rng
+        weights = zipf_weights(len(ingredients), self.skew)
+        self.bulk_create(
+            RecipeIngredient,
+            (
+                RecipeIngredient(
+                    recipe_id=recipe,
+                    ingredient_id=ingredient,
+                    amount=rng.randint(1, 500),
+                )
+                for recipe in recipes
+                for ingredient in sample_distinct(
+                    rng, ingredients, weights,
+                    rng.randint(max(average // 2, 1), average * 3 // 2 + 1),
+                )
+            ),
+        )
+        self.bulk_create(
+            Recipe.tags.through,
+            (
+                Recipe.tags.through(recipe_id=recipe, tag_id=tag)
+                for recipe in recipes
+                for tag in rng.sample(tags, rng.randint(1, len(tags)))
+            ),
+            label='Теги рецептов',
+        )
+
+    def create_user_relations(
+        self, model, fields, users, targets, average, exclude_self=False
+    ):
+        """Связи пользователей с популярными объектами, например
+        подписки на авторов или рецепты в избранном."""
+
+        rng = self.rng
+        weights = zipf_weights(len(targets), self.skew)
+        user_field, target_field = fields
+        self.bulk_create(
+            model,
+            (
+                model(**{user_field: user, target_field: target})
+                for user in users
+                for target in sample_distinct(
+                    rng, targets, weights, per_user(rng, average)
+                )
+                if not exclude_self or target != user
+            ),
+            ignore_conflicts=True,
+        )
+
+    def handle(self, *args, **kwargs):
+        self.rng = random.Random(kwargs['seed'])
+        self.skew = kwargs['skew']
+        self.batch_size = kwargs['batch_size']
+        if min(kwargs['users'], kwargs['recipes'], self.batch_size) < 1:
+            raise CommandError(
+                'Количество пользователей, рецептов и размер пакета '
+                'должны быть больше нуля!'
+            )
+        start = time.perf_counter()
+        if kwargs['clear']:
+            with bulk_changes():
+                deleted, _ = User.objects.filter(
+                    username__startswith=PREFIX
+                ).delete()
+            self.stdout.write(f'Удалено объектов: {deleted}')
+
+        with transaction.atomic():
+            users = self.create_users(kwargs['users'])
+            ingredients = self.get_ingredients(kwargs['ingredients'])
+            tags = self.get_tags()
+            recipes = self.create_recipes(users, kwargs['recipes'])
+            self.create_recipe_relations(
+                recipes, ingredients, tags, kwargs['ingredients_per_recipe']
+            )
+            self.create_user_relations(
+                Subscription, ('subscriber_id', 'subscriptions_id'),
+                users, users, kwargs['subscriptions'], exclude_self=True,
+            )
+            popular = recipes[:]
+            self.rng.shuffle(popular)
+            self.create_user_relations(
+                Favorite, ('user_id', 'favorites_id'),
+                users, popular, kwargs['favorites'],
+            )
+            self.create_user_relations(
+                Purchase, ('user_id', 'recipe_id'),
+                users, popular, kwargs['purchases'],
+            )
+        call_command('recount_counters', stdout=self.stdout)
+        call_command('reconcile_cart_lines', stdout=self.stdout)
+        call_command('update_search_vectors', stdout=self.stdout)
+        bump_catalog_version(COOKABLE_CATALOG)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Данные созданы за {time.perf_counter() - start:.1f} с.'
+            )
+        )
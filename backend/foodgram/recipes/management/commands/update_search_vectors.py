@@ -0,0 +1,44 @@
+"""Пересчёт поисковых векторов всех рецептов в PostgreSQL.
+
+Нужен после массовой загрузки рецептов в обход приложения и после
+смены RECIPE_SEARCH_CONFIG. Рецепты обновляются пакетами по id,
+каждый пакет в отдельной транзакции. Команда также меняет версию
+поиска, и процессы перестраивают индекс поиска в памяти.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from recipes.catalog import RECIPE_SEARCH_CATALOG, bump_catalog_version
+from recipes.models import Recipe
+from recipes.search import is_supported, update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Recompute full-text search vectors of recipes (PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs['batch_size']
+        if batch_size < 1:
+            raise CommandError('Размер пакета должен быть больше нуля!')
+        bump_catalog_version(RECIPE_SEARCH_CATALOG)
+        if not is_supported():
+            self.stdout.write(
+                'Поисковые векторы используются только в PostgreSQL, '
+                'индекс поиска в памяти будет перестроен.'
+            )
+            return
+        updated = 0
+        last_id = 0
+        while True:
+            recipe_ids = list(
+                Recipe.objects.filter(pk__gt=last_id).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not recipe_ids:
+                break
+            updated += update_search_vectors(recipe_ids)
+            last_id = recipe_ids[-1]
+        self.stdout.write(
+            self.style.SUCCESS(f'Обновлено поисковых векторов: {updated}.')
+        )
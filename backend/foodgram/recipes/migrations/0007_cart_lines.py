@@ -0,0 +1,43 @@
+# Generated by Django 3.2.16 on 2026-10-17 04:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+FILL_CART_LINES = '''
+    INSERT INTO recipes_cartline (user_id, ingredient_id, total_amount)
+    SELECT purchase.user_id, line.ingredient_id, SUM(line.amount)
+    FROM recipes_purchase purchase
+    JOIN recipes_recipeingredient line
+        ON line.recipe_id = purchase.recipe_id
+    GROUP BY purchase.user_id, line.ingredient_id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0006_query_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.PositiveIntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_lines', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_lines', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Строка списка покупок',
+                'verbose_name_plural': 'Строки списков покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='cartline',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_cart_line'),
+        ),
+        migrations.RunSQL(FILL_CART_LINES, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.2.16 on 2026-10-17 04:53
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def fill_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    config = settings.RECIPE_SEARCH_CONFIG
+    ingredient_names = apps.get_model(
+        'recipes', 'RecipeIngredient'
+    ).objects.filter(recipe=OuterRef('pk')).order_by().values(
+        'recipe'
+    ).annotate(
+        names=StringAgg('ingredient__name', ' ')
+    ).values('names')
+    apps.get_model('recipes', 'Recipe').objects.update(
+        search_vector=(
+            SearchVector('name', weight='A', config=config)
+            + SearchVector(
+                Subquery(ingredient_names), weight='B', config=config
+            )
+            + SearchVector('text', weight='C', config=config)
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='recipe_search_vector_idx'),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.16 on 2026-10-17 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_catalog_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('catalog', models.CharField(max_length=32, verbose_name='Справочник')),
+                ('previous', models.CharField(max_length=32, verbose_name='Прежняя версия')),
+                ('version', models.CharField(max_length=32, verbose_name='Версия')),
+                ('changes', models.JSONField(verbose_name='Изменения')),
+            ],
+            options={
+                'verbose_name': 'Изменение справочника',
+                'verbose_name_plural': 'Изменения справочников',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='catalogchange',
+            index=models.Index(fields=['catalog', 'previous'], name='catalog_change_previous_idx'),
+        ),
+    ]
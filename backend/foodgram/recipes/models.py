@@ -1,25 +1,71 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models import Exists, OuterRef
+from django.db.models import Exists, OuterRef, Prefetch, Q
+from django.utils import timezone
 
 from .constants import MAX_LENGTH_VALUE, MIN_AMOUNT, MIN_COOKING_TIME
 
 User = get_user_model()
 
+RECIPE_ROW_FIELDS = (
+    'id',
+    'created_at',
+    'favorites_count',
+    'in_carts_count',
+    'author__id',
+    'author__email',
+    'author__username',
+    'author__first_name',
+    'author__last_name',
+    'author__recipes_count',
+    'author__followers_count',
+)
+
 
 class CustomQuerySet(models.QuerySet):
 
     def all_recipes(self):
-        return (
-            self.all()
-            .select_related('author')
-            .prefetch_related('tags', 'recipeingredients')
+        """Рецепты с авторами для выдачи в API.
+
+        Загружаются только поля, которых нет в карточке рецепта:
+        теги, ингредиенты и текст берутся из кэша карточек.
+        """
+
+        return self.select_related('author').only(*RECIPE_ROW_FIELDS)
+
+    def card_data(self):
+        """Рецепты со всеми данными общей части карточки."""
+
+        return self.only(
+            'id', 'name', 'image', 'text', 'cooking_time'
+        ).prefetch_related(
+            Prefetch(
+                'tags',
+                queryset=Tag.objects.only('id', 'name', 'color', 'slug'),
+            ),
+            Prefetch(
+                'recipeingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                ).only(
+                    'recipe',
+                    'amount',
+                    'ingredient__id',
+                    'ingredient__name',
+                    'ingredient__measurement_unit',
+                ),
+            ),
         )
 
-    def add_user_annotations(self, user_id):
+    def add_user_annotations(self, user):
+        """Признаки избранного и списка покупок для пользователя.
+
+        Принимает объект пользователя или его id.
+        """
 
-        user = User.objects.get(id=user_id)
         return self.all_recipes().annotate(
             is_favorited=Exists(
                 Favorite.objects.filter(user=user, favorites=OuterRef('pk'))
@@ -115,12 +161,39 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата публикации рецепта',
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='В избранном',
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='В списках покупок',
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор',
+    )
     objects = CustomQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-created_at',)
+        indexes = [
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='recipe_created_at_id_idx',
+            ),
+            models.Index(
+                fields=['author', '-created_at'],
+                name='recipe_author_created_at_idx',
+            ),
+            GinIndex(
+                fields=['search_vector'],
+                name='recipe_search_vector_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -141,6 +214,13 @@ class RecipeIngredient(models.Model):
     )
 
     class Meta:
+        indexes = [
+            models.Index(
+                fields=['recipe', 'ingredient'],
+                include=['amount'],
+                name='recipeingredient_covering_idx',
+            ),
+        ]
         verbose_name = 'Ингредиент рецепта'
         verbose_name_plural = 'Ингредиенты рецепта'
 
@@ -206,3 +286,156 @@ class Purchase(models.Model):
 
     def __str__(self):
         return f'{self.recipe} в списке покупок у {self.user}'
+
+
+class CartLine(models.Model):
+    """ Модель строки списка покупок: суммарное количество ингредиента
+    во всех рецептах из списка покупок пользователя. """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='cart_lines',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='cart_lines',
+        verbose_name='Ингредиент',
+    )
+    total_amount = models.PositiveIntegerField(verbose_name='Количество')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_line'
+            )
+        ]
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Строки списков покупок'
+
+    def __str__(self):
+        return f'{self.ingredient}: {self.total_amount} у {self.user}'
+
+
+class Job(models.Model):
+    """ Модель фоновой задачи. """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+    ACTIVE = (PENDING, RUNNING)
+    SHOPPING_LIST = 'shopping_list'
+    THUMBNAILS = 'thumbnails'
+    KINDS = (
+        (SHOPPING_LIST, 'Список покупок'),
+        (THUMBNAILS, 'Миниатюры изображения'),
+    )
+
+    kind = models.CharField(
+        max_length=32, choices=KINDS, verbose_name='Тип задачи'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='jobs',
+        null=True,
+        blank=True,
+        verbose_name='Пользователь',
+    )
+    key = models.CharField(max_length=MAX_LENGTH_VALUE, verbose_name='Ключ')
+    params = models.JSONField(default=dict, verbose_name='Параметры')
+    status = models.CharField(
+        max_length=16,
+        choices=STATUSES,
+        default=PENDING,
+        verbose_name='Статус',
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0, verbose_name='Попыток'
+    )
+    run_after = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Выполнить не раньше',
+    )
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    result = models.BinaryField(
+        null=True, editable=False, verbose_name='Результат'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name='Создана'
+    )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Изменена')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'key'],
+                condition=Q(status__in=('pending', 'running')),
+                name='unique_active_job',
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['status', 'run_after'],
+                name='job_status_run_after_idx',
+            ),
+            models.Index(
+                fields=['kind', 'key'],
+                name='job_kind_key_idx',
+            ),
+        ]
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+
+    def __str__(self):
+        return f'{self.get_kind_display()} #{self.pk}: {self.status}'
+
+
+class CatalogVersion(models.Model):
+    """ Модель версии справочника, общей для всех процессов. """
+
+    name = models.CharField(
+        max_length=32,
+        primary_key=True,
+        verbose_name='Справочник'
+    )
+    version = models.CharField(max_length=32, verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'Версия справочника'
+        verbose_name_plural = 'Версии справочников'
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
+
+
+class CatalogChange(models.Model):
+    """ Модель записи журнала изменений справочника. """
+
+    catalog = models.CharField(max_length=32, verbose_name='Справочник')
+    previous = models.CharField(max_length=32, verbose_name='Прежняя версия')
+    version = models.CharField(max_length=32, verbose_name='Версия')
+    changes = models.JSONField(verbose_name='Изменения')
+
+    class Meta:
+        verbose_name = 'Изменение справочника'
+        verbose_name_plural = 'Изменения справочников'
+        indexes = [
+            models.Index(
+                fields=['catalog', 'previous'],
+                name='catalog_change_previous_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.catalog}: {self.previous} -> {self.version}'
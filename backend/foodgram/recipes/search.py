@@ -0,0 +1,61 @@
+"""Полнотекстовый поиск рецептов в PostgreSQL.
+
+Поисковый вектор хранится в поле Recipe.search_vector: название
+с весом A, названия ингредиентов с весом B, текст с весом C.
+Вектор обновляется приложением при сохранении рецепта и изменении
+ингредиента, у всех рецептов - командой update_search_vectors.
+В других базах данных функции ничего не делают.
+"""
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import F, OuterRef, Subquery
+
+from .models import Recipe, RecipeIngredient
+
+
+def is_supported():
+    return connection.vendor == 'postgresql'
+
+
+def search_vector():
+    """Выражение поискового вектора рецепта."""
+
+    config = settings.RECIPE_SEARCH_CONFIG
+    ingredient_names = RecipeIngredient.objects.filter(
+        recipe=OuterRef('pk')
+    ).order_by().values('recipe').annotate(
+        names=StringAgg('ingredient__name', ' ')
+    ).values('names')
+    return (
+        SearchVector('name', weight='A', config=config)
+        + SearchVector(Subquery(ingredient_names), weight='B', config=config)
+        + SearchVector('text', weight='C', config=config)
+    )
+
+
+def update_search_vectors(recipe_ids=None):
+    """Пересчёт поисковых векторов рецептов (по умолчанию всех).
+
+    Возвращает количество обновлённых рецептов.
+    """
+
+    if not is_supported():
+        return 0
+    recipes = Recipe.objects.all()
+    if recipe_ids is not None:
+        recipes = recipes.filter(pk__in=recipe_ids)
+    return recipes.update(search_vector=search_vector())
+
+
+def full_text_search(queryset, value):
+    """Рецепты, подходящие под запрос, в порядке релевантности."""
+
+    query = SearchQuery(
+        value, config=settings.RECIPE_SEARCH_CONFIG, search_type='websearch'
+    )
+    return queryset.filter(search_vector=query).annotate(
+        search_rank=SearchRank(F('search_vector'), query)
+    ).order_by('-search_rank', '-created_at', '-id')
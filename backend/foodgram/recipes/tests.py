@@ -0,0 +1,240 @@
+import csv
+import json
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from api.autocomplete import ingredient_index
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from users.models import Subscription, User
+
+from .models import Favorite, Ingredient, Recipe, RecipeIngredient, Tag
+
+
+class LoadDataTests(APITestCase):
+    """Загрузка ингредиентов и обновление справочника во всех процессах."""
+
+    url = '/api/ingredients/?name=шаф'
+
+    def setUp(self):
+        for alias_cache in caches.all():
+            alias_cache.clear()
+        ingredient_index.invalidate()
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+
+    def load(self, rows, suffix='.json', *args):
+        with tempfile.NamedTemporaryFile(
+            'w', suffix=suffix, encoding='utf-8', newline=''
+        ) as file:
+            if suffix == '.csv':
+                csv.writer(file).writerows(rows)
+            else:
+                json.dump(rows, file, ensure_ascii=False, indent=1)
+            file.flush()
+            stdout = StringIO()
+            call_command('load_data', file.name, *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def ingredients(self):
+        return set(
+            Ingredient.objects.values_list('name', 'measurement_unit')
+        )
+
+    def test_catalog_refreshed_in_other_processes(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.data, [])
+        etag = response['ETag']
+
+        output = self.load([{'name': 'шафран', 'measurement_unit': 'г'}])
+        self.assertIn('Версия справочника ингредиентов обновлена', output)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        caches['default'].clear()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [ingredient['name'] for ingredient in response.data], ['шафран']
+        )
+
+    def test_catalog_refreshed_in_this_process(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.load([{'name': 'шафран', 'measurement_unit': 'г'}])
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+
+    def test_nothing_loaded(self):
+        output = self.load([{'name': 'соль', 'measurement_unit': 'г'}])
+        self.assertNotIn('Версия справочника', output)
+
+    def test_csv(self):
+        self.load(
+            [('шафран', 'г'), ('соус "чили", острый', 'мл'), ()], '.csv',
+            '--batch-size', '1',
+        )
+        self.assertEqual(
+            self.ingredients(),
+            {('соль', 'г'), ('шафран', 'г'), ('соус "чили", острый', 'мл')},
+        )
+
+    def test_json_across_read_chunks(self):
+        """Объекты, разрезанные границей прочитанных блоков, собираются
+        из нескольких блоков."""
+
+        rows = [
+            {'name': f'ингредиент {number} «с кавычками»',
+             'measurement_unit': 'г'}
+            for number in range(20)
+        ]
+        for read_size in (1, 7, 64):
+            with self.subTest(read_size=read_size), mock.patch(
+                'recipes.management.commands.load_data.READ_SIZE',
+                read_size,
+            ):
+                Ingredient.objects.exclude(name='соль').delete()
+                self.load(rows)
+                self.assertEqual(
+                    self.ingredients(),
+                    {('соль', 'г')} | {
+                        (row['name'], row['measurement_unit'])
+                        for row in rows
+                    },
+                )
+
+    def test_broken_json(self):
+        for content in ('{}', '[{"name": "шафран", "measurement_unit"'):
+            with self.subTest(content=content), tempfile.NamedTemporaryFile(
+                'w', suffix='.json', encoding='utf-8'
+            ) as file:
+                file.write(content)
+                file.flush()
+                with self.assertRaises(CommandError):
+                    call_command('load_data', file.name, stdout=StringIO())
+
+    def test_repeated_rows(self):
+        rows = [
+            {'name': 'шафран', 'measurement_unit': 'г'},
+            {'name': 'соль', 'measurement_unit': 'г'},
+            {'name': 'шафран', 'measurement_unit': 'г'},
+            {'name': 'шафран', 'measurement_unit': 'кг'},
+        ]
+        with CaptureQueriesContext(connection) as context:
+            output = self.load(rows, '.json', '--batch-size', '2')
+        self.assertIn('Загружено 2 ингредиентов из 4', output)
+        self.assertIn('пропущено уже существующих и повторов: 2', output)
+        self.assertEqual(
+            self.ingredients(),
+            {('соль', 'г'), ('шафран', 'г'), ('шафран', 'кг')},
+        )
+        inserts = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('INSERT')
+            and Ingredient._meta.db_table in query['sql']
+        ]
+        self.assertEqual(len(inserts), 2)
+
+    def test_dry_run(self):
+        with CaptureQueriesContext(connection) as context:
+            output = self.load(
+                [{'name': 'шафран', 'measurement_unit': 'г'}],
+                '.json', '--dry-run',
+            )
+        self.assertIn('Проверено 1 ингредиентов из 1', output)
+        self.assertEqual(self.ingredients(), {('соль', 'г')})
+        self.assertFalse(
+            [
+                query for query in context.captured_queries
+                if not query['sql'].startswith('SELECT')
+            ]
+        )
+
+
+class AdminChangelistTests(APITestCase):
+    """Количество запросов страниц списка админки не зависит от числа
+    строк на странице."""
+
+    def setUp(self):
+        for alias_cache in caches.all():
+            alias_cache.clear()
+        self.admin = User.objects.create_superuser(
+            username='admin',
+            email='admin@example.com',
+            password='password',
+            first_name='admin',
+            last_name='admin',
+        )
+        self.client.force_login(self.admin)
+        self.tags = [
+            Tag.objects.create(name=slug, color='#E26C2D', slug=slug)
+            for slug in ('breakfast', 'dinner')
+        ]
+        self.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(3)
+        ]
+        self.number = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            self.number += 1
+            user = User.objects.create_user(
+                username=f'user{self.number}',
+                email=f'user{self.number}@example.com',
+                password='password',
+                first_name='user',
+                last_name='user',
+            )
+            recipe = Recipe.objects.create(
+                author=user,
+                name=f'Рецепт {self.number}',
+                text='Текст',
+                cooking_time=10,
+                image='recipes/images/test.png',
+            )
+            recipe.tags.set(self.tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=10
+                )
+                for ingredient in self.ingredients
+            )
+            Favorite.objects.create(user=user, favorites=recipe)
+            Subscription.objects.create(
+                subscriber=user, subscriptions=self.admin
+            )
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        changelist = response.context['cl']
+        self.assertEqual(
+            len(changelist.result_list), changelist.model.objects.count()
+        )
+        return len(context.captured_queries)
+
+    def assert_constant_queries(self, url, maximum):
+        self.add_rows(1)
+        expected = self.count_queries(url)
+        self.assertLessEqual(expected, maximum)
+        self.add_rows(20)
+        self.assertEqual(self.count_queries(url), expected)
+
+    def test_recipe_changelist(self):
+        self.assert_constant_queries('/admin/recipes/recipe/', 8)
+
+    def test_recipe_changelist_filtered(self):
+        self.assert_constant_queries(
+            f'/admin/recipes/recipe/?tags__id__exact={self.tags[0].pk}', 8
+        )
+
+    def test_user_changelist(self):
+        self.assert_constant_queries('/admin/users/user/', 7)
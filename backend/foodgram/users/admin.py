@@ -1,7 +1,8 @@
-from itertools import chain
-
 from django.conf import settings
 from django.contrib import admin
+from django.db.models import Prefetch
+from recipes.admin_utils import EstimatedCountPaginator
+from recipes.models import Favorite
 
 from .models import Subscription, User
 
@@ -17,21 +18,43 @@ class UserAdmin(admin.ModelAdmin):
         'last_name',
         'user_subscriptions',
         'user_favorites',
+        'recipes_count',
+        'followers_count',
     )
     list_display_links = ('username',)
+    readonly_fields = ('recipes_count', 'followers_count')
     search_fields = ('username', 'email', 'first_name', 'last_name')
-    list_filter = ('username', 'email', 'role')
+    list_filter = ('role',)
     empty_value_display = settings.EMPTY_VALUE
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            Prefetch(
+                'subscriber',
+                queryset=Subscription.objects.select_related(
+                    'subscriptions'
+                ).only('subscriber', 'subscriptions__username'),
+            ),
+            Prefetch(
+                'favorites',
+                queryset=Favorite.objects.select_related('favorites').only(
+                    'user', 'favorites__name'
+                ),
+            ),
+        )
 
     @admin.display(description='Подписки')
     def user_subscriptions(self, object):
-        a = object.subscriber.values_list('subscriptions__username')
-        return list(chain.from_iterable(a))
+        return [
+            subscription.subscriptions.username
+            for subscription in object.subscriber.all()
+        ]
 
     @admin.display(description='Избранное')
     def user_favorites(self, object):
-        a = object.favorites.values_list('favorites__name')
-        return list(chain.from_iterable(a))
+        return [favorite.favorites.name for favorite in object.favorites.all()]
 
 
 admin.site.register(Subscription)